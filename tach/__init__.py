@@ -1,11 +1,141 @@
+import sys
+import types
+
 from tach import config
 
 
+# The configuration instrumentation is added to, when not given
+_config = None
+
+
 def patch(config_path):
     """Patch application based on configuration."""
 
+    global _config
+
     # Load the configuration
-    cfg = config.Config(config_path)
+    cfg = _config = config.Config(config_path)
 
     # Return the configuration
     return cfg
+
+
+def _get_config(cfg=None):
+    """Return the given configuration, or the current one.
+
+    The current configuration is the one loaded by patch(), or an
+    empty one, sending to the default notifier.
+    """
+
+    global _config
+
+    if cfg is not None:
+        return cfg
+    if _config is None:
+        _config = config.Config(None)
+    return _config
+
+
+def _items(metric, notifier, options):
+    """Build the configuration items of a method."""
+
+    items = [('metric', metric)]
+    if notifier:
+        items.append(('notifier', notifier))
+    items.extend(options.items())
+    return items
+
+
+def _dotted_name(target):
+    """Return the dotted name of a method or function.
+
+    Class methods are named after the class they are bound to.  A
+    function must be an attribute of its module, since static methods
+    can't be told apart from functions.
+    """
+
+    owner = getattr(target, 'im_self', None)
+    if not isinstance(owner, (type, types.ClassType)):
+        owner = getattr(target, 'im_class', None)
+    if owner is not None:
+        return '%s.%s.%s' % (owner.__module__, owner.__name__,
+                             target.__name__)
+
+    module = sys.modules.get(target.__module__)
+    if getattr(module, target.__name__, None) is not target:
+        raise ValueError("Cannot tell the name of %r; pass its dotted "
+                         "name, such as \"module.Class.method\"" % target)
+    return '%s.%s' % (target.__module__, target.__name__)
+
+
+def instrument(target, metric='tach.metrics.ExecTime', notifier=None,
+               label=None, cfg=None, **options):
+    """Instrument a method or function, as a configuration section would.
+
+    :param target: The method or function, or its dotted name, such
+                   as "nova.compute.manager.ComputeManager.run_instance".
+    :param metric: The name of the metric class.
+    :param notifier: The name of the notifier, or None for the
+                     default notifier.
+    :param label: The label to report under; defaults to the dotted
+                  name of the target.
+    :param cfg: The configuration to add the method to; defaults to
+                the one loaded by patch().
+
+    Other keyword arguments are method options, such as "meter" or
+    "label_template".
+
+    :returns: The Method; call its detach() method to remove the
+              instrumentation.
+    """
+
+    if isinstance(target, basestring):
+        name = target
+    else:
+        name = _dotted_name(target)
+    module, _sep, method = name.rpartition('.')
+
+    items = [('module', module), ('method', method)]
+    items.extend(_items(metric, notifier, options))
+    return _get_config(cfg).add_method(label or name, items)
+
+
+def timed(label, metric='tach.metrics.ExecTime', notifier=None, cfg=None,
+          **options):
+    """Return a decorator instrumenting a function.
+
+    Takes the same arguments as instrument(), but the label is
+    required.  The decorated function is wrapped just as configured
+    methods are; the Method is available as the tach_descriptor
+    attribute of the wrapper.
+    """
+
+    def decorator(func):
+        method = _get_config(cfg).add_method(
+            label, _items(metric, notifier, options), function=func)
+        return method._method_wrapper
+
+    return decorator
+
+
+def timer(label, tags=None, metric='tach.metrics.ExecTime', notifier=None,
+          cfg=None, **options):
+    """Return a context manager timing a block of code.
+
+    Blocks with the same label share one Method, created by the
+    first block with the label, so its metric, notifier and options
+    are the ones used.  A label naming a configured method reports
+    blocks through that method.
+
+    :param label: The label of the block.
+    :param tags: A dict or sequence of tag pairs, or None.
+
+    Other arguments are as for instrument().
+    """
+
+    cfg = _get_config(cfg)
+    method = cfg.methods.get(label)
+    if method is None:
+        method = cfg.add_method(label, _items(metric, notifier, options),
+                                function=None)
+    return method.block(tags=tags)
@@ -1,41 +1,82 @@
 import ConfigParser
+import fnmatch
 import inspect
 import functools
-
+import logging
+import re
+import signal
+import sys
+import time
+
+from tach import context
+from tach import exemplars
+from tach import labels
+from tach import meters
 from tach import metrics
 from tach import notifiers
+from tach import packs
+from tach import profiler
+from tach import runtime
+from tach import streams
+from tach import templates
 from tach import utils
 
 
+LOG = logging.getLogger(__name__)
+
+# The global options that are defaults for every method; the others
+# configure tach as a whole
+_method_defaults = frozenset([
+        'bump_transaction_id', 'error_suffix', 'exemplar_app',
+        'exemplar_max_len', 'exemplar_size', 'increment',
+        'label_cache_size', 'max_error_classes', 'max_labels', 'meter',
+        'profile', 'profile_cooldown', 'profile_duration', 'profile_hz',
+        'profile_path', 'profile_threshold', 'report_interval',
+        'self_suffix', 'slow_threshold', 'slow_top', 'spans', 'stream'])
+
+
 class Config(object):
     """Represent a tach configuration."""
 
     def __init__(self, config_path):
         """Initialize a tach configuration.
 
-        Reads the configuration from the config_path.
+        Reads the configuration from the config_path.  If it is None,
+        the configuration starts out empty, with the default notifier,
+        and methods are added with add_method().
         """
 
         # Initialize a few things
         self.methods = {}
         self.notifiers = {}
+        self.packs = {}
+        self._fanouts = {}
 
         # Parse the configuration file
         config = ConfigParser.SafeConfigParser()
-        config.read(config_path)
-        app_helper = None
-        setup_module = None
-        # Process configuration
+        if config_path is not None:
+            config.read(config_path)
+        # Process configuration; some global options are defaults for
+        # every method
+        defaults = {}
         if config.has_section('global'):
-            app_helper = config.get('global', 'app_helper')
-            setup_module = config.get('global', 'setup_module')
+            defaults = dict(config.items('global'))
             config.remove_section('global')
+        self.app_helper = defaults.pop('app_helper', None)
+        setup_module = defaults.pop('setup_module', None)
+        self.defaults = dict((option, value)
+                             for option, value in defaults.items()
+                             if option in _method_defaults)
 
         if setup_module:
             # import this first to do env setup
             mod = __import__(setup_module)
             print "Environment setup module: %s" % mod
-            
+
+        # Bound the distinct labels reported by all methods
+        self.label_budget = labels.LabelBudget(
+            int(defaults.get('max_labels_total', 10000)))
+
         for sec in config.sections():
             if sec == 'notifier' or sec.startswith('notifier:'):
                 # Make a notifier
@@ -47,26 +88,159 @@ class Config(object):
                 # If it's a default notifier, add it as such
                 if notifier.default:
                     self.notifiers.setdefault(None, notifier)
+            elif sec.startswith('pack:'):
+                # Attach an instrumentation pack
+                pack = packs.load(self, sec, config.items(sec))
+                self.packs.setdefault(pack.name, pack)
             else:
-                # Make a method
-                method = Method(self, sec, config.items(sec),
-                                app_helper=app_helper)
-
-                # Add it to the recognized methods
-                self.methods.setdefault(method.label, method)
+                # Make the methods; a method pattern expands to several
+                targets = [(sec, config.items(sec), {})]
+                options = dict(config.items(sec))
+                if (options.get('module') and
+                        _is_pattern(options.get('method'))):
+                    # The expanded methods share a metric instance
+                    shared = {}
+                    targets = [('%s.%s' % (sec, name),
+                                [(option, name if option == 'method'
+                                  else value)
+                                 for option, value in config.items(sec)],
+                                dict(shared=shared))
+                               for name in expand_methods(options['module'],
+                                                          options['method'])]
+
+                for label, items, kwargs in targets:
+                    self.add_method(label, items, **kwargs)
 
         # Do we have a default notifier?
         self.notifiers.setdefault(None, Notifier(self, 'notifier', []))
 
-    def notifier(self, name):
-        """Retrieve a notifier driver given its name."""
+        # Collect garbage collector and process metrics?
+        self.runtime = None
+        if int(defaults.get('runtime', 0)) > 0:
+            self.runtime = runtime.RuntimeCollector(self, defaults)
+            self.runtime.start()
+
+        # Dump slow call exemplars on a signal?
+        self.exemplar_path = defaults.get('exemplar_path')
+        if defaults.get('exemplar_signal') and self.exemplar_path:
+            self._handle_signal(defaults['exemplar_signal'],
+                                self._dump_exemplars_handler)
+
+        # Start the profilers on a signal?
+        if defaults.get('profile_signal'):
+            self._handle_signal(defaults['profile_signal'],
+                                self._profile_handler)
+
+    def _handle_signal(self, name, handler):
+        """Install a signal handler.
+
+        Signal handlers can only be installed from the main thread;
+        elsewhere, the error is logged and the signal left alone.
+        """
+
+        signum = getattr(signal, name.upper())
+        try:
+            signal.signal(signum, handler)
+        except ValueError as e:
+            LOG.error("Could not handle signal %s: %s" % (name, e))
+
+    def add_method(self, label, items, **kwargs):
+        """Instrument a method, applying the global options.
+
+        :param label: The label to use when reporting the collected
+                      statistic.
+        :param items: A list of key, value pairs giving the
+                      configuration of the method.
+
+        Other keyword arguments are passed to Method.
+
+        :returns: The Method.
+        """
+
+        method = Method(self, label, items, app_helper=self.app_helper,
+                        defaults=self.defaults,
+                        label_budget=self.label_budget, **kwargs)
+
+        # Add it to the recognized methods
+        self.methods.setdefault(method.label, method)
+
+        return method
+
+    def notifier(self, name, nonblocking=False):
+        """Retrieve a notifier driver given its name.
+
+        If nonblocking is True, the driver is guaranteed not to block
+        the caller.  The name may be a comma-separated list of
+        notifiers, in which case the driver sends to all of them,
+        never blocking the caller.
+        """
+
+        # Send to several notifiers?
+        if name and ',' in name:
+            return self._fanout(name)
 
         # Look up the notifier
         notifier = self.notifiers.get(name, self.notifiers.get(None))
 
         # Return the driver
+        if nonblocking:
+            return notifier.async_driver
         return notifier.driver
 
+    def _fanout(self, name):
+        """Retrieve the driver sending to a list of notifiers.
+
+        The driver is built once for each list.  The notifiers that
+        may block are sent to from an AsyncNotifier configured by the
+        first notifier; the others are called in the caller's thread,
+        so they see its context.
+        """
+
+        if name not in self._fanouts:
+            members = [self.notifiers.get(sub.strip(),
+                                          self.notifiers.get(None))
+                       for sub in name.split(',') if sub.strip()]
+            drivers = [notifier.driver for notifier in members]
+            inline = [driver for driver in drivers if not driver.blocking]
+            blocking = [driver for driver in drivers if driver.blocking]
+            if blocking:
+                queued = notifiers.AsyncNotifier(
+                    members[0],
+                    driver=notifiers.FanoutNotifier(members[0], blocking))
+                inline.append(queued)
+            if len(inline) == 1:
+                driver = inline[0]
+            else:
+                driver = notifiers.FanoutNotifier(members[0], inline)
+            self._fanouts[name] = driver
+
+        return self._fanouts[name]
+
+    def dump_exemplars(self, fp):
+        """Write the slow call exemplars of all methods to a file."""
+
+        for method in self.methods.values():
+            if method.exemplars:
+                method.exemplars.dump(fp)
+
+    def _dump_exemplars_handler(self, signum, frame):
+        """Signal handler appending the exemplars to exemplar_path."""
+
+        with open(self.exemplar_path, 'a') as fp:
+            self.dump_exemplars(fp)
+
+    def profile(self, duration=None):
+        """Start the sampling profilers of all methods."""
+
+        for method in self.methods.values():
+            if method.profiler:
+                method.profiler.start(duration)
+
+    def _profile_handler(self, signum, frame):
+        """Signal handler starting the profilers."""
+
+        self.profile()
+
     def _methods(self, methods):
         """Return a list of method objects given their names."""
 
@@ -94,6 +268,7 @@ class Notifier(object):
         self.default = False
         self._driver = None
         self._driver_cache = None
+        self._async_driver_cache = None
         self.additional = {}
 
         self.label = label.partition(':')[-1]
@@ -119,15 +294,102 @@ class Notifier(object):
 
         return self.additional[key]
 
+    def get(self, key, default=None):
+        """Allow access to optional additional configuration."""
+
+        return self.additional.get(key, default)
+
     @property
     def driver(self):
         """Return an initialized notifier driver."""
 
         if not self._driver_cache:
-            self._driver_cache = self._driver(self)
+            self._driver_cache = notifiers.adapt(self._driver(self))
 
         return self._driver_cache
 
+    @property
+    def async_driver(self):
+        """Return a notifier driver that never blocks the caller.
+
+        Blocking drivers are wrapped in an AsyncNotifier.
+        """
+
+        if not self._async_driver_cache:
+            driver = self.driver
+            if driver.blocking:
+                driver = notifiers.AsyncNotifier(self, driver=driver)
+            self._async_driver_cache = driver
+
+        return self._async_driver_cache
+
+
+# Cache of method pattern expansions, by module and pattern
+_expansions = {}
+
+
+def _is_pattern(name):
+    """Determine if a method name is a pattern."""
+
+    return bool(name) and (name.startswith('re:') or
+                           any(char in name for char in '*?['))
+
+
+def expand_methods(module, pattern):
+    """Return the names of the methods or functions matching a pattern.
+
+    The pattern is a shell-style wildcard, such as "_process_*", or a
+    regular expression prefixed with "re:".  For a class, methods,
+    class methods and static methods defined by the class or its
+    bases match, except those inherited from builtin types; for a
+    module, the functions defined in it match.  Names
+    starting with "__" only match patterns starting with "__".
+    Expansions are cached.
+
+    :param module: The class or module, as given by the "module"
+                   option.
+    :param pattern: The method pattern.
+    """
+
+    key = (module, pattern)
+    if key in _expansions:
+        return _expansions[key]
+
+    if pattern.startswith('re:'):
+        pattern = pattern[3:]
+        match = re.compile('(?:%s)$' % pattern).match
+    else:
+        match = lambda name: fnmatch.fnmatchcase(name, pattern)
+
+    target = utils.import_class_or_module(module)
+    if inspect.ismodule(target):
+        candidates = dir(target)
+    else:
+        candidates = set()
+        for cls in inspect.getmro(target):
+            if cls.__module__ not in ('__builtin__', 'exceptions'):
+                candidates.update(vars(cls))
+
+    names = []
+    for name in sorted(candidates):
+        if not match(name):
+            continue
+        if name.startswith('__') and not pattern.startswith('__'):
+            continue
+
+        if inspect.ismodule(target):
+            obj = getattr(target, name)
+            if (inspect.isfunction(obj) and
+                    obj.__module__ == target.__name__):
+                names.append(name)
+        elif not hasattr(object, name):
+            _obj, _raw_obj, kind = _get_method(target, name)
+            if kind in ('method', 'class method', 'static method'):
+                names.append(name)
+
+    _expansions[key] = names
+    return names
+
 
 def _get_method(cls, name):
     """Introspect a class for a method and its kind.
@@ -190,17 +452,35 @@ class Method(object):
                       statistic.
         :param items: A list of key, value pairs giving the
                       configuration for setting up the method wrapper.
+        :param app_helper: The global application helper, if any.
+        :param defaults: A dictionary of global defaults for the
+                         additional configuration.
+        :param label_budget: The LabelBudget bounding the distinct
+                             labels of all methods, if any.
+        :param shared: A dictionary shared by methods expanded from
+                       the same pattern, holding the metric they
+                       share.
+        :param function: A function to wrap instead of the method
+                         given by the module and method options; the
+                         wrapper is left to the caller to install.
+                         If None, nothing is wrapped, and the method
+                         only times blocks.
         """
 
         self.config = config
         self.label = label
         self._app_cache = None
         self._metric_cache = None
+        self._notifier_cache = None
+        self._nonblocking_notifier_cache = None
+        self._shared = kwargs.get('shared', {})
         self._app_helper = kwargs.get('app_helper')
 
         # Other important configuration values
         required = set(['module', 'method', 'metric'])
         attrs = set(['notifier', 'app']) | required
+        if 'function' in kwargs:
+            required -= set(['module', 'method'])
 
         # if there's a global helper set, we don't require a local one
         if not self._app_helper:
@@ -208,7 +488,7 @@ class Method(object):
 
         for attr in attrs:
             setattr(self, '_' + attr, None)
-        self.additional = {}
+        self.additional = dict(kwargs.get('defaults') or {})
 
         # Process configuration
         for option, value in items:
@@ -227,16 +507,142 @@ class Method(object):
             raise Exception("Missing configuration options for %s: %s" %
                             (label, ', '.join(required)))
 
+        # Build labels from a template?
+        self._template = None
+        if self.additional.get('label_template'):
+            self._template = templates.LabelTemplate(
+                self.additional['label_template'],
+                int(self.additional.get('label_cache_size', 1000)))
+
+        # Build tags from templates?  The "tags" option is a
+        # comma-separated list of key=template pairs
+        self._tag_templates = []
+        for tag in self.additional.get('tags', '').split(','):
+            key, _sep, template = tag.partition('=')
+            if key.strip():
+                template = templates.LabelTemplate(
+                    template.strip(),
+                    int(self.additional.get('label_cache_size', 1000)))
+                self._tag_templates.append((key.strip(), template))
+
+        # How often, in seconds, to report accumulated statistics
+        self.report_interval = float(
+            self.additional.get('report_interval', 5))
+
+        # Bound the distinct labels built by the app helper or template
+        self.labels = labels.LabelSet(
+            int(self.additional.get('max_labels', 1000)),
+            label + '.other', budget=kwargs.get('label_budget'),
+            on_overflow=self._start_report_labels)
+
+        # Time lazily produced results until they are consumed?
+        self.stream = int(self.additional.get('stream', 0)) > 0
+
+        # How failed calls are reported
+        self.error_suffix = self.additional.get('error_suffix', '.error')
+        self.max_error_classes = int(
+            self.additional.get('max_error_classes', 10))
+        self._error_classes = set()
+        self._error_lock = utils.original('thread', 'allocate_lock')()
+
+        # Track calls in flight and call rates?
+        self.meter = None
+        if int(self.additional.get('meter', 0)) > 0:
+            self.meter = meters.CallMeter(self.report_interval)
+
+        # Track nesting of instrumented calls?
+        self.spans = int(self.additional.get('spans', 0)) > 0
+        self.self_suffix = self.additional.get('self_suffix', '.self')
+        self._calls = {}
+        self._calls_lock = utils.original('thread', 'allocate_lock')()
+
+        # Capture slow calls?
+        self.exemplars = None
+        slow_threshold = float(self.additional.get('slow_threshold', 0))
+        slow_top = int(self.additional.get('slow_top', 0))
+        if slow_threshold > 0 or slow_top > 0:
+            self.exemplars = exemplars.ExemplarRecorder(
+                slow_threshold, slow_top,
+                int(self.additional.get('exemplar_size', 100)),
+                self._summarizer())
+
         # Grab the method we're operating on
-        method_cls = utils.import_class_or_module(self._module)
-        if inspect.ismodule(method_cls):
-            that_method = raw_method = getattr(method_cls, self._method)
+        method_cls = None
+        if 'function' in kwargs:
+            that_method = raw_method = kwargs['function']
             kind = 'function'
         else:
-            that_method, raw_method, kind = _get_method(method_cls,
-                                                        self._method)
+            method_cls = utils.import_class_or_module(self._module)
+            if inspect.ismodule(method_cls):
+                that_method = raw_method = getattr(method_cls, self._method)
+                kind = 'function'
+            else:
+                that_method, raw_method, kind = _get_method(method_cls,
+                                                            self._method)
         self._method_cache = that_method
 
+        # Profile the method on demand?
+        self.profiler = None
+        code = getattr(getattr(that_method, 'im_func', that_method),
+                       'func_code', None)
+        if int(self.additional.get('profile', 0)) > 0 and code:
+            self.profiler = profiler.SamplingProfiler(
+                label, code,
+                self.additional.get('profile_path',
+                                    '/tmp/tach-{label}-{time}.folded'),
+                hz=float(self.additional.get('profile_hz', 100)),
+                duration=float(self.additional.get('profile_duration', 10)),
+                threshold=float(self.additional.get('profile_threshold', 0)),
+                cooldown=float(self.additional.get('profile_cooldown', 300)))
+
+        # Do we need the wall clock time of each call?
+        self._watch_slow = bool(self.exemplars or self.profiler)
+        self._timed = self.stream or self.spans or self._watch_slow
+
+        # Save what we need
+        self._method_cls = method_cls
+        self._method_orig = raw_method
+        self._method_wrapper = None
+        if that_method is not None:
+            self._method_wrapper = self._wrap(that_method, kind)
+        if method_cls is not None:
+            setattr(self._method_cls, self._method, self._method_wrapper)
+
+        # Report accumulated statistics periodically; the reports run
+        # in the ticker's native thread, so they go through the
+        # non-blocking notifier, which sends from the right kind of
+        # thread
+        if self.meter:
+            utils.ticker.every(self.report_interval, self.report)
+        if self.spans:
+            utils.ticker.every(self.report_interval, self.report_calls)
+        if self.exemplars and self.exemplars.top:
+            utils.ticker.every(self.report_interval,
+                               self.exemplars.close_window)
+
+    def detach(self):
+        if self._method_cls is not None:
+            setattr(self._method_cls, self._method, self._method_orig)
+
+        if self.meter:
+            utils.ticker.cancel(self.report)
+        if self.spans:
+            utils.ticker.cancel(self.report_calls)
+        if self.exemplars and self.exemplars.top:
+            utils.ticker.cancel(self.exemplars.close_window)
+        if self.labels.overflow:
+            utils.ticker.cancel(self.report_labels)
+
+    def _wrap(self, that_method, kind):
+        """Wrap a method to perform statistics collection.
+
+        :param that_method: The method or function to wrap.
+        :param kind: The kind of method, as returned by _get_method(),
+                     or "function".
+
+        :returns: The wrapper, as a static or class method if needed.
+        """
+
         # We need to wrap the replacement if it's a static or class
         # method
         if kind == 'static method':
@@ -254,18 +660,51 @@ class Method(object):
                 args = args[1:]
 
             # Handle app translation
-            label = None
-            if self._app:
-                args, kwargs, label = self.app(*args, **kwargs)
+            args, kwargs, label, tags = self._label(args, kwargs)
 
             # Run the method, bracketing with statistics collection
             # and notification
             if self.metric.bump_transaction_id:
-                self.notifier.bump_transaction_id()
+                context.new_transaction_id()
+            if self.meter:
+                self.meter.enter()
             value = self.metric.start()
-            result = that_method(*args, **kwargs)
-            self.notifier(self.metric(value), self.metric.vtype,
-                          label or self.label)
+            if self._timed:
+                start = time.time()
+            if self.spans:
+                span = context.push_span(label, start)
+            try:
+                result = that_method(*args, **kwargs)
+            except BaseException:
+                exc_info = sys.exc_info()
+                try:
+                    if self.spans:
+                        self._notify_span(span)
+                    if self._watch_slow:
+                        self._watch(label + self.error_suffix,
+                                    time.time() - start, args, kwargs)
+                except Exception:
+                    LOG.exception("%s: Error reporting a failed call" %
+                                  self.label)
+                self._notify_error(value, label, exc_info[0], tags=tags)
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if self.spans:
+                self._notify_span(span)
+            if self._watch_slow:
+                self._watch(label, time.time() - start, args, kwargs)
+
+            # Streamed results are timed until they are consumed
+            if self.stream and streams.is_stream(result):
+                return streams.TimedIterable(
+                    result, start,
+                    functools.partial(self._notify_stream, value, label,
+                                      tags=tags),
+                    functools.partial(self._notify_error, value, label,
+                                      tags=tags))
+
+            if self.meter:
+                self.meter.exit()
+            self.notifier(self.metric(value), self.metric.vtype, label, tags)
 
             return result
 
@@ -273,15 +712,220 @@ class Method(object):
         wrapper.tach_descriptor = self
         wrapper.tach_function = that_method
 
-        # Save what we need
-        self._method_cls = method_cls
-        self._method_wrapper = meth_wrap(wrapper)
-        self._method_orig = raw_method
+        return meth_wrap(wrapper)
 
-        setattr(self._method_cls, self._method, self._method_wrapper)
+    def _label(self, args, kwargs):
+        """Determine the label and tags of a call.
 
-    def detach(self):
-        setattr(self._method_cls, self._method, self._method_orig)
+        The app helper may translate the arguments and return a
+        label, optionally followed by a tag set; the label and tag
+        templates, if any, take precedence.  Labels and tag sets are
+        interned and bounded by max_labels.
+
+        :returns: The arguments, keyword arguments, label and tag set
+                  (or None).
+        """
+
+        label = tags = None
+        if self._app:
+            result = self.app(*args, **kwargs)
+            args, kwargs, label = result[:3]
+            if len(result) > 3:
+                tags = result[3]
+        if self._template:
+            label = self._template.render(args, kwargs) or label
+        if self._tag_templates:
+            tags = dict(tags or {})
+            for key, template in self._tag_templates:
+                value = template.render(args, kwargs)
+                if value is not None:
+                    tags[key] = value
+
+        label, tags = self._intern(label, tags)
+        return args, kwargs, label, tags
+
+    def _intern(self, label, tags):
+        """Intern a label and tag set, bounded by max_labels.
+
+        :param label: The label, or None for the method's label.
+        :param tags: A dict or sequence of tag pairs, or None.
+
+        :returns: The label and interned tag set (or None).
+        """
+
+        if tags:
+            tags = labels.intern_tags(tags)
+            interned = self.labels.intern((label or self.label, tags))
+            if interned == self.labels.other:
+                return interned, None
+            return interned[0], tags
+        if label:
+            return self.labels.intern(label), None
+        return self.label, None
+
+    def block(self, label=None, tags=None):
+        """Return a context manager timing a block of code.
+
+        The block is reported like a call of the method, including
+        its failures, spans and meters.
+
+        :param label: The label of the block, if not the method's.
+        :param tags: A dict or sequence of tag pairs, or None.
+        """
+
+        label, tags = self._intern(label, tags)
+        return Block(self, label, tags)
+
+    def _watch(self, label, duration, args, kwargs):
+        """Capture an exemplar or a profile if a call is slow.
+
+        Fast calls return after one comparison per feature enabled.
+        """
+
+        if self.exemplars and duration >= self.exemplars.floor:
+            self.exemplars.offer(label, duration, args, kwargs)
+        if self.profiler and duration >= self.profiler.threshold:
+            self.profiler.trigger()
+
+    def _summarizer(self):
+        """Return the function summarizing arguments of slow calls.
+
+        If the "exemplar_app" option names a function in the
+        application helper, it is called with the call's arguments
+        and its result is used; otherwise, a bounded repr of the
+        arguments is used.  Either way, the summary is truncated to
+        "exemplar_max_len" characters (default 256).
+        """
+
+        max_len = int(self.additional.get('exemplar_max_len', 256))
+        app_name = self.additional.get('exemplar_app')
+        if not app_name:
+            return functools.partial(exemplars.summarize, max_len=max_len)
+
+        def summarizer(args, kwargs):
+            app_cls = utils.import_class_or_module(self._app_helper)
+            summary = getattr(app_cls, app_name)(*args, **kwargs)
+            return str(summary)[:max_len]
+
+        return summarizer
+
+    def report(self):
+        """Report the calls in flight and call rates as gauges.
+
+        Reports "<label>.inflight", the peak since the last report as
+        "<label>.inflight_peak", and the 1, 5 and 15 minute average
+        call rates, in calls per second, as "<label>.rate_1m",
+        "<label>.rate_5m" and "<label>.rate_15m".
+        """
+
+        meter = self.meter
+        peak = meter.tick()
+        notifier = self.nonblocking_notifier
+        notifier(meter.inflight, 'gauge', self.label + '.inflight')
+        notifier(peak, 'gauge', self.label + '.inflight_peak')
+        for suffix, rate in zip(('1m', '5m', '15m'), meter.rates):
+            notifier(rate.rate, 'gauge', '%s.rate_%s' % (self.label, suffix))
+
+    def report_calls(self):
+        """Report the calls made to this method by other methods.
+
+        Each parent, child pair of labels is reported as an increment
+        under "<parent>.calls.<child>", giving the number of calls
+        since the last report.
+        """
+
+        with self._calls_lock:
+            calls, self._calls = self._calls, {}
+        notifier = self.nonblocking_notifier
+        for (parent, child), count in calls.iteritems():
+            notifier(count, 'increment', '%s.calls.%s' % (parent, child))
+
+    def _start_report_labels(self):
+        """Start reporting labels folded into the "other" label."""
+
+        utils.ticker.every(self.report_interval, self.report_labels)
+
+    def report_labels(self):
+        """Report the number of labels folded into the "other" label.
+
+        Reported as an increment under "<label>.labels_overflow",
+        giving the number of calls since the last report whose label
+        was folded because max_labels, or the global
+        max_labels_total, was reached.
+        """
+
+        count = self.labels.tick()
+        if count:
+            self.nonblocking_notifier(count, 'increment',
+                          self.label + '.labels_overflow')
+
+    def _notify_span(self, span):
+        """Leave a span, reporting its exclusive time.
+
+        The exclusive time is reported under the label plus the self
+        suffix, and the call is counted against the parent span.
+        """
+
+        inclusive, exclusive = context.pop_span(span, time.time())
+        self.notifier(exclusive, 'exec_time', span.label + self.self_suffix)
+
+        if span.parent is not None:
+            key = (span.parent.label, span.label)
+            with self._calls_lock:
+                self._calls[key] = self._calls.get(key, 0) + 1
+
+    def _notify_stream(self, value, label, first, items, nbytes, tags=None):
+        """Finish collecting statistics for a consumed stream.
+
+        In addition to the metric, reports the time to the first item
+        under "<label>.first_item", and the item and byte counts under
+        "<label>.items" and "<label>.bytes".
+        """
+
+        if self.meter:
+            self.meter.exit()
+
+        notifier = self.notifier
+        notifier(self.metric(value), self.metric.vtype, label, tags)
+        if first is not None:
+            notifier(first, 'exec_time', label + '.first_item', tags)
+        notifier(items, 'increment', label + '.items', tags)
+        notifier(nbytes, 'increment', label + '.bytes', tags)
+
+    def _notify_error(self, value, label, exc_type, tags=None):
+        """Finish collecting a statistic for a failed call.
+
+        The statistic is reported under the label plus the error
+        suffix, and the failure is counted under
+        "<label>.errors.<exception class>".  At most max_error_classes
+        exception classes are distinguished; the rest are counted as
+        "other".  Errors reporting the failure are logged, never
+        raised, so the call's own exception is the one the caller
+        sees.
+        """
+
+        try:
+            if self.meter:
+                self.meter.exit()
+
+            notifier = self.notifier
+
+            # Bound the number of exception classes we report
+            exc_name = exc_type.__name__
+            if exc_name not in self._error_classes:
+                with self._error_lock:
+                    if exc_name in self._error_classes:
+                        pass
+                    elif len(self._error_classes) >= self.max_error_classes:
+                        exc_name = 'other'
+                    else:
+                        self._error_classes.add(exc_name)
+
+            notifier(self.metric(value), self.metric.vtype,
+                     label + self.error_suffix, tags)
+            notifier(1, 'increment', '%s.errors.%s' % (label, exc_name), tags)
+        except Exception:
+            LOG.exception("%s: Error reporting a failed call" % self.label)
 
     def __getitem__(self, key):
         """Allow access to additional configuration."""
@@ -313,9 +957,11 @@ class Method(object):
         """Return an initialized statistic object."""
 
         if not self._metric_cache:
-            # Select an appropriate statistic
-            cls = utils.import_class_or_module(self._metric)
-            self._metric_cache = cls(self.additional)
+            if 'metric' not in self._shared:
+                # Select an appropriate statistic
+                cls = utils.import_class_or_module(self._metric)
+                self._shared['metric'] = cls(self.additional)
+            self._metric_cache = self._shared['metric']
 
         return self._metric_cache
 
@@ -323,4 +969,76 @@ class Method(object):
     def notifier(self):
         """Return the notifier driver."""
 
-        return self.config.notifier(self._notifier)
+        if not self._notifier_cache:
+            self._notifier_cache = self.config.notifier(self._notifier)
+
+        return self._notifier_cache
+
+    @property
+    def nonblocking_notifier(self):
+        """Return a notifier driver that never blocks the caller."""
+
+        if not self._nonblocking_notifier_cache:
+            self._nonblocking_notifier_cache = self.config.notifier(
+                self._notifier, nonblocking=True)
+
+        return self._nonblocking_notifier_cache
+
+
+class Block(object):
+    """Time a block of code as a call of a method."""
+
+    __slots__ = ('method', 'label', 'tags', 'value', 'start', 'span')
+
+    def __init__(self, method, label, tags=None):
+        """Initialize a block timer.
+
+        :param method: The Method reporting the block.
+        :param label: The label of the block.
+        :param tags: The interned tag set, or None.
+        """
+
+        self.method = method
+        self.label = label
+        self.tags = tags
+
+    def __enter__(self):
+        method = self.method
+        if method.metric.bump_transaction_id:
+            context.new_transaction_id()
+        if method.meter:
+            method.meter.enter()
+        self.value = method.metric.start()
+        if method._timed:
+            self.start = time.time()
+        if method.spans:
+            self.span = context.push_span(self.label, self.start)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        method = self.method
+        label = self.label
+
+        # Errors reporting a failure must not mask it
+        if exc_type is not None:
+            try:
+                if method.spans:
+                    method._notify_span(self.span)
+                if method._watch_slow:
+                    method._watch(label + method.error_suffix,
+                                  time.time() - self.start, (), {})
+            except Exception:
+                LOG.exception("%s: Error reporting a failed call" %
+                              method.label)
+            method._notify_error(self.value, label, exc_type, tags=self.tags)
+            return False
+
+        if method.spans:
+            method._notify_span(self.span)
+        if method._watch_slow:
+            method._watch(label, time.time() - self.start, (), {})
+        if method.meter:
+            method.meter.exit()
+        method.notifier(method.metric(self.value), method.metric.vtype,
+                        label, self.tags)
+        return False
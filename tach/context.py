@@ -0,0 +1,177 @@
+import itertools
+import thread
+import threading
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+
+class Span(object):
+    """Represent an instrumented call in progress."""
+
+    __slots__ = ('label', 'start', 'child_time', 'parent')
+
+    def __init__(self, label, start, parent):
+        """Initialize a span.
+
+        :param label: The label the call is reported under.
+        :param start: The time the call started.
+        :param parent: The span of the enclosing instrumented call,
+                       or None.
+        """
+
+        self.label = label
+        self.start = start
+        self.child_time = 0.0
+        self.parent = parent
+
+
+# Transaction IDs are handed out from a single counter; next() on an
+# itertools.count() is atomic, so no lock is needed
+_transaction_ids = itertools.count(1)
+
+
+# The innermost span is tracked per context: per asyncio task where
+# context variables exist, and otherwise per thread.  Thread
+# identities are looked up on every call because green thread
+# libraries patch thread.get_ident() to identify the green thread.
+if contextvars:
+    _span = contextvars.ContextVar('tach_span', default=None)
+
+    current_span = _span.get
+    _set_span = _span.set
+else:
+    _spans = {}
+
+    def current_span():
+        """Return the innermost span of the current context."""
+
+        return _spans.get(thread.get_ident())
+
+    def _set_span(span):
+        """Set the innermost span of the current context."""
+
+        if span is None:
+            _spans.pop(thread.get_ident(), None)
+        else:
+            _spans[thread.get_ident()] = span
+
+
+def push_span(label, start):
+    """Enter a span nested in the current one, and return it."""
+
+    span = Span(label, start, current_span())
+    _set_span(span)
+    return span
+
+
+def pop_span(span, end):
+    """Leave a span.
+
+    Returns the inclusive time of the span and its exclusive time,
+    which excludes the inclusive time of nested spans.  The inclusive
+    time is charged to the parent span.
+    """
+
+    _set_span(span.parent)
+
+    inclusive = end - span.start
+    if span.parent is not None:
+        span.parent.child_time += inclusive
+
+    return inclusive, inclusive - span.child_time
+
+
+# The transaction ID is also tracked per context.  Without context
+# variables, it lives in a thread local; the local is recreated if a
+# green thread library replaces threading.local, so that it follows
+# green threads once the process has been monkey-patched.
+if contextvars:
+    _transaction_id = contextvars.ContextVar('tach_transaction_id',
+                                             default=None)
+
+    _get_transaction_id = _transaction_id.get
+    set_transaction_id = _transaction_id.set
+else:
+    _local = None
+    _local_class = None
+
+    def _context():
+        """Return the thread local holding the context."""
+
+        global _local, _local_class
+
+        if threading.local is not _local_class:
+            _local_class = threading.local
+            _local = _local_class()
+
+        return _local
+
+    def _get_transaction_id():
+        """Return the transaction ID of the current context, or None."""
+
+        return getattr(_context(), 'transaction_id', None)
+
+    def set_transaction_id(transaction_id):
+        """Set the transaction ID of the current context."""
+
+        _context().transaction_id = transaction_id
+
+
+def new_transaction_id():
+    """Start a new transaction in the current context.
+
+    Returns the new transaction ID.
+    """
+
+    transaction_id = next(_transaction_ids)
+    set_transaction_id(transaction_id)
+    return transaction_id
+
+
+def transaction_id():
+    """Return the transaction ID of the current context.
+
+    A context that has not started a transaction is given a new one.
+    """
+
+    transaction_id = _get_transaction_id()
+    if transaction_id is None:
+        transaction_id = new_transaction_id()
+    return transaction_id
+
+
+# Threads doing tach's own work, such as sending metrics; the
+# instrumentation packs leave their I/O alone, so reporting can't
+# recurse.  Like spans without context variables, they are tracked by
+# thread identity, which follows green threads.
+_internal = set()
+
+
+def internal():
+    """Return True if the current thread is doing tach's own work."""
+
+    return thread.get_ident() in _internal
+
+
+def enter_internal():
+    """Mark the current thread as doing tach's own work.
+
+    Returns False, leaving the mark alone, if the thread was already
+    marked; only the caller getting True should call
+    leave_internal().
+    """
+
+    ident = thread.get_ident()
+    if ident in _internal:
+        return False
+    _internal.add(ident)
+    return True
+
+
+def leave_internal():
+    """Clear the mark set by enter_internal()."""
+
+    _internal.discard(thread.get_ident())
@@ -0,0 +1,165 @@
+import collections
+import heapq
+import json
+import re
+import time
+
+try:
+    import reprlib
+except ImportError:
+    import repr as reprlib
+
+from tach import context
+from tach import utils
+
+
+# Bounded repr: long containers and strings are elided, so summarizing
+# arguments costs the same whatever their size
+_repr = reprlib.Repr()
+_repr.maxlevel = 3
+_repr.maxstring = 64
+_repr.maxother = 64
+
+# Values following credential-like names are redacted
+_redact_re = re.compile(r"""(?i)((?:password|passwd|secret|token|auth)"""
+                        r"""[\w'"]*\s*[:=]\s*)(u?'[^']*'|u?"[^"]*"|[^,\s)}]+)""")
+
+
+def summarize(args, kwargs, max_len=256):
+    """Summarize call arguments for an exemplar.
+
+    The summary is bounded in size and has credential-like values
+    redacted.
+    """
+
+    summary = '%s, %s' % (_repr.repr(tuple(args)), _repr.repr(kwargs))
+    summary = _redact_re.sub(r'\1***', summary)
+    return summary[:max_len]
+
+
+class Exemplar(object):
+    """Represent a slow call."""
+
+    __slots__ = ('label', 'duration', 'timestamp', 'transaction_id',
+                 'summary')
+
+    def __init__(self, label, duration, timestamp, transaction_id,
+                 summary):
+        self.label = label
+        self.duration = duration
+        self.timestamp = timestamp
+        self.transaction_id = transaction_id
+        self.summary = summary
+
+    def __cmp__(self, other):
+        """Order exemplars by duration."""
+
+        return cmp(self.duration, other.duration)
+
+    def __lt__(self, other):
+        return self.duration < other.duration
+
+    def to_dict(self):
+        """Return the exemplar as a dictionary."""
+
+        return dict((attr, getattr(self, attr)) for attr in self.__slots__)
+
+
+class ExemplarRecorder(object):
+    """Capture slow calls of a method.
+
+    Calls taking at least the threshold go straight into a ring of
+    fixed size; the slowest calls in each window go into the ring when
+    the window closes.  Callers compare the duration of each call to
+    the floor attribute and only call offer() if it is not below the
+    floor, so fast calls cost a single comparison.  The window is
+    only changed under a native lock, since slow calls may finish in
+    several threads at once.
+    """
+
+    def __init__(self, threshold=0, top=0, size=100, summarizer=None):
+        """Initialize the recorder.
+
+        :param threshold: The duration, in seconds, from which calls
+                          are always captured; 0 to disable.
+        :param top: The number of slowest calls to capture per
+                    window; 0 to disable.
+        :param size: The number of exemplars to keep.
+        :param summarizer: A callable taking the call's args and
+                           kwargs and returning a summary.
+        """
+
+        self.threshold = threshold
+        self.top = top
+        self.ring = collections.deque(maxlen=size)
+        self.summarizer = summarizer or summarize
+        self._window = []
+        self._lock = utils.original('thread', 'allocate_lock')()
+        self._reset_floor()
+
+    def _reset_floor(self):
+        """Compute the floor for an empty window."""
+
+        if self.top:
+            self.floor = 0
+        elif self.threshold:
+            self.floor = self.threshold
+        else:
+            self.floor = float('inf')
+
+    def offer(self, label, duration, args, kwargs):
+        """Consider a call for capture."""
+
+        if self.threshold and duration >= self.threshold:
+            self.ring.append(self._exemplar(label, duration, args, kwargs))
+            return
+
+        if not self.top:
+            return
+
+        # Keep the slowest calls of the window
+        exemplar = self._exemplar(label, duration, args, kwargs)
+        with self._lock:
+            window = self._window
+            if len(window) < self.top:
+                heapq.heappush(window, exemplar)
+            else:
+                heapq.heappushpop(window, exemplar)
+
+            if len(window) >= self.top:
+                floor = window[0].duration
+                if self.threshold:
+                    floor = min(floor, self.threshold)
+                self.floor = floor
+
+    def _exemplar(self, label, duration, args, kwargs):
+        """Build an exemplar for a call."""
+
+        try:
+            summary = self.summarizer(args, kwargs)
+        except Exception as e:
+            summary = '<unavailable: %s>' % e.__class__.__name__
+
+        return Exemplar(label, duration, time.time(),
+                        context.transaction_id(), summary)
+
+    def close_window(self):
+        """Move the slowest calls of the window into the ring."""
+
+        with self._lock:
+            window, self._window = self._window, []
+            self._reset_floor()
+        self.ring.extend(sorted(window))
+
+    def exemplars(self):
+        """Return the captured exemplars as dictionaries."""
+
+        with self._lock:
+            window = sorted(self._window)
+        return [exemplar.to_dict() for exemplar in list(self.ring) + window]
+
+    def dump(self, fp):
+        """Write the captured exemplars to a file, one JSON per line."""
+
+        for exemplar in self.exemplars():
+            fp.write(json.dumps(exemplar) + '\n')
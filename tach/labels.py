@@ -0,0 +1,129 @@
+import itertools
+
+
+class LabelBudget(object):
+    """Bound the number of distinct labels across all methods.
+
+    Admitting a label uses itertools.count(), whose next() is atomic,
+    so no lock is needed.
+    """
+
+    def __init__(self, limit):
+        """Initialize the budget.
+
+        :param limit: The number of distinct labels to admit; 0 means
+                      no limit.
+        """
+
+        self.limit = limit
+        self._counter = itertools.count(1)
+
+    def admit(self):
+        """Return True if one more distinct label may be admitted."""
+
+        if not self.limit:
+            return True
+        return next(self._counter) <= self.limit
+
+
+class LabelSet(object):
+    """Intern the labels of a method, up to a limit.
+
+    Labels seen before are returned as the same string object, at the
+    cost of one dictionary lookup.  Once the limit, or the global
+    budget, is exhausted, new labels are folded into the "other"
+    label, and counted as overflow.
+    """
+
+    def __init__(self, limit, other, budget=None, on_overflow=None):
+        """Initialize the label set.
+
+        :param limit: The number of distinct labels to keep; 0 means
+                      no limit.
+        :param other: The label new labels are folded into once the
+                      limit is reached.
+        :param budget: An optional LabelBudget shared with other
+                       methods.
+        :param on_overflow: An optional function called when the
+                            first label overflows.
+        """
+
+        self.limit = limit
+        self.other = other
+        self.budget = budget
+        self.on_overflow = on_overflow
+        self._labels = {}
+        self._overflow_counter = itertools.count(1)
+        self._last_overflow = 0
+        self.overflow = 0
+
+    def __len__(self):
+        """Return the number of distinct labels kept."""
+
+        return len(self._labels)
+
+    def intern(self, label):
+        """Return the interned label, or the "other" label.
+
+        The label may also be a label, tag set pair.
+        """
+
+        # The fast path: a label we've seen before
+        try:
+            return self._labels[label]
+        except KeyError:
+            pass
+
+        if ((not self.limit or len(self._labels) < self.limit) and
+                (self.budget is None or self.budget.admit())):
+            return self._labels.setdefault(label, label)
+
+        # Fold the label into the other bucket
+        self.overflow = next(self._overflow_counter)
+        if self.overflow == 1 and self.on_overflow:
+            self.on_overflow()
+        return self.other
+
+    def tick(self):
+        """Return the number of labels folded since the last tick."""
+
+        overflow = self.overflow
+        count = overflow - self._last_overflow
+        self._last_overflow = overflow
+        return count
+
+
+# Interned tag sets; beyond the limit, tag sets are still usable, just
+# not shared
+_tag_sets = {}
+max_tag_sets = 10000
+
+
+def _str(value):
+    """Convert a tag key or value to a string, encoding unicode as UTF-8."""
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def intern_tags(tags):
+    """Return the interned tag set for a dict or sequence of pairs.
+
+    A tag set is a tuple of key, value pairs, sorted by key, so equal
+    tag sets are the same object and can key formatter caches and
+    aggregations cheaply.  Empty tag sets are returned as None.
+    """
+
+    if not tags:
+        return None
+    if isinstance(tags, dict):
+        tags = tags.iteritems()
+
+    tag_set = tuple(sorted((_str(key), _str(value)) for key, value in tags))
+    try:
+        return _tag_sets[tag_set]
+    except KeyError:
+        if len(_tag_sets) >= max_tag_sets:
+            return tag_set
+        return _tag_sets.setdefault(tag_set, tag_set)
@@ -0,0 +1,91 @@
+import math
+
+from tach import utils
+
+
+class EWMA(object):
+    """Exponentially-weighted moving average of an event rate.
+
+    This is the same average the Unix load average uses: the rate
+    observed over each interval is folded into the average with a
+    weight that makes older intervals decay over the given number of
+    minutes.
+    """
+
+    def __init__(self, minutes, interval):
+        """Initialize the average.
+
+        :param minutes: The period, in minutes, the average covers.
+        :param interval: How often, in seconds, update() is called.
+        """
+
+        self.interval = float(interval)
+        self.alpha = 1.0 - math.exp(-self.interval / 60.0 / minutes)
+        self.rate = None
+
+    def update(self, count):
+        """Fold in the number of events seen in the last interval."""
+
+        instant = count / self.interval
+        if self.rate is None:
+            self.rate = instant
+        else:
+            self.rate += self.alpha * (instant - self.rate)
+
+
+class CallMeter(object):
+    """Track the calls in flight and the call rate of a method.
+
+    The counts are updated under a native lock, so they never go
+    backwards, even when calls race in different threads.
+    """
+
+    def __init__(self, interval):
+        """Initialize the meter.
+
+        :param interval: How often, in seconds, tick() is called.
+        """
+
+        self._lock = utils.original('thread', 'allocate_lock')()
+        self._last_started = 0
+        self.started = 0
+        self.finished = 0
+        self.peak = 0
+        self.rates = [EWMA(minutes, interval) for minutes in (1, 5, 15)]
+
+    @property
+    def inflight(self):
+        """Return the number of calls in flight."""
+
+        return max(self.started - self.finished, 0)
+
+    def enter(self):
+        """Note the start of a call."""
+
+        with self._lock:
+            self.started += 1
+            inflight = self.started - self.finished
+            if inflight > self.peak:
+                self.peak = inflight
+
+    def exit(self):
+        """Note the end of a call."""
+
+        with self._lock:
+            self.finished += 1
+
+    def tick(self):
+        """Close the current window.
+
+        Updates the call rates and returns the peak number of calls
+        in flight during the window.
+        """
+
+        started = self.started
+        count = max(started - self._last_started, 0)
+        self._last_started = started
+        for rate in self.rates:
+            rate.update(count)
+
+        peak, self.peak = self.peak, self.inflight
+        return max(peak, self.peak)
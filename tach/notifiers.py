@@ -1,10 +1,18 @@
+import collections
+import httplib
+import inspect
 import logging
 import json
+import os
+import re
 import socket
+import thread
 import time
-import urllib
 import urllib2
 
+from tach import context
+from tach import prometheus
+from tach import spool
 from tach import utils
 
 
@@ -14,6 +22,32 @@ LOG = logging.getLogger(__name__)
 class BaseNotifier(object):
     """Base notifier class."""
 
+    # Whether calling the notifier may block on I/O
+    blocking = True
+
+    # Whether the notifier can be driven from a native thread under a
+    # green thread library: it does no I/O, or does it through the
+    # socket_factory attribute, which is switched to native sockets
+    native_io = True
+
+    # Characters not allowed in labels, and what to replace them with;
+    # None allows any label
+    label_re = None
+    label_replacement = '_'
+
+    # How many label, value type pairs to keep formatters for
+    format_cache_size = 10000
+
+    # Notifiers with the same wire format, and the same formatting
+    # methods, produce the same body for a metric, so FanoutNotifier
+    # formats it once for all of them; None means the body is never
+    # shared
+    wire_format = None
+
+    # The directory spooling bodies that couldn't be sent, if any
+    spool_path = None
+    _spool = None
+
     def __init__(self, config):
         """Initialize a notifier.
 
@@ -21,38 +55,202 @@ class BaseNotifier(object):
         """
         super(BaseNotifier, self).__init__()
         self.config = config
-        self.transaction_id = 1
+        self._formatters = {}
+
+    @property
+    def transaction_id(self):
+        """Return the transaction ID of the current context.
+
+        The ID is shared by all notifiers, and each thread, green
+        thread or asyncio task has its own.
+        """
+
+        return context.transaction_id()
 
     def bump_transaction_id(self):
-        """Bump the transaction ID. Any metrics that use this notifier
-        can bundle messages under a single transaction ID."""
-        self.transaction_id += 1
+        """Bump the transaction ID. Any metrics emitted in the current
+        context can bundle messages under a single transaction ID."""
+        context.new_transaction_id()
 
-    def format(self, value, vtype, label):
-        """Format the value.
+    def sanitize(self, label):
+        """Replace the characters not allowed in labels."""
+
+        if self.label_re is None:
+            return label
+        return self.label_re.sub(self.label_replacement, label)
+
+    def formatter(self, vtype, label, tags=None):
+        """Return a function formatting values for a label and type.
 
-        Subclasses must implement methods for metric types.
+        Subclasses may override this to do as much of the formatting
+        as possible up front; by default, the method for the value
+        type, or the default method, is called for each value, and
+        tag values are appended to the label as dotted components.
+        Returns None if the value type can't be formatted.
+
+        :param vtype: The value type.
+        :param label: The sanitized label.
+        :param tags: The tag set, if any.
         """
 
+        if tags:
+            label += ''.join('.' + self.sanitize(value)
+                             for _key, value in tags)
+
         # Get the value formatter for the value type
         meth = getattr(self, vtype, None)
         if not meth:
             meth = getattr(self, 'default', None)
             if not meth:
-                return
+                return None
+
+        return lambda value: meth(value, label)
+
+    def format(self, value, vtype, label, tags=None):
+        """Format the value.
+
+        Subclasses must implement methods for metric types.  The
+        formatter for each label, value type and tag set is built
+        once and cached.
+        """
+
+        key = (label, vtype, tags)
+        try:
+            formatter = self._formatters[key]
+        except KeyError:
+            # Keep the cache bounded
+            if len(self._formatters) >= self.format_cache_size:
+                self._formatters.clear()
+            formatter = self.formatter(vtype, self.sanitize(label), tags)
+            self._formatters[key] = formatter
+
+        if formatter is None:
+            return
 
         # Format the value into a body
-        return meth(value, label)
+        return formatter(value)
 
-    def __call__(self, value, vtype, label):
+    def __call__(self, value, vtype, label, tags=None):
         """Causes the metric to be formatted and sent.
 
         Subclasses must implement methods for metric types and the
-        send() method.
+        send() method.  The optional tags are an interned tag set, as
+        returned by tach.labels.intern_tags().
         """
 
         # Send the message
-        self.send(self.format(value, vtype, label))
+        self.send(self.format(value, vtype, label, tags))
+
+    def _setup_spool(self, config):
+        """Configure spooling of bodies that couldn't be sent.
+
+        Notifiers supporting spooling implement deliver(), which
+        tries sending a body once and returns True if it was sent.
+        The "spool" configuration option names the spool directory;
+        the spool is replayed, at most "spool_rate" bodies per second
+        (default 1000), once the server is reachable again.
+        """
+
+        self.spool_path = config.get('spool')
+        self.spool_segment_size = int(config.get('spool_segment_size',
+                                                 1048576))
+        self.spool_max_bytes = int(config.get('spool_max_bytes', 67108864))
+        self.spool_rate = int(config.get('spool_rate', 1000))
+
+    def _spool_options(self):
+        """Return the options "tach replay" builds the notifier from."""
+
+        options = dict(getattr(self.config, 'additional', self.config))
+        options.pop('spool', None)
+        return options
+
+    def _open_spool(self):
+        """Open the spool and start replaying it."""
+
+        cls = self.__class__
+        self._spool = spool.Spool(
+            self.spool_path, self.spool_segment_size, self.spool_max_bytes,
+            meta=dict(driver='%s.%s' % (cls.__module__, cls.__name__),
+                      options=self._spool_options()))
+        utils.ticker.every(1, self._replay_spool)
+
+    def _resume_spool(self):
+        """Replay a spool left by an earlier run, if any."""
+
+        if self.spool_path and os.path.isdir(self.spool_path):
+            self._open_spool()
+
+    def _spool_body(self, body):
+        """Spool a body that couldn't be sent."""
+
+        if self.spool_path:
+            if self._spool is None:
+                self._open_spool()
+            self._spool.append(body)
+
+    def _replay_spool(self):
+        """Replay spooled bodies, up to the rate limit."""
+
+        self._spool.replay(self.deliver, self.spool_rate)
+
+
+def takes_tags(driver):
+    """Determine whether a notifier driver takes a tags argument.
+
+    Drivers written before tags existed take only the value, the
+    value type and the label.
+    """
+
+    call = driver
+    if not (inspect.isfunction(driver) or inspect.ismethod(driver)):
+        call = getattr(driver, '__call__', None)
+    try:
+        spec = inspect.getargspec(call)
+    except TypeError:
+        return True
+
+    args = len(spec.args) - (1 if inspect.ismethod(call) else 0)
+    return bool(spec.varargs) or args >= 4
+
+
+class TaglessNotifier(object):
+    """Adapt a notifier driver taking no tags argument.
+
+    The tags are dropped; other attributes are those of the driver.
+    """
+
+    # The wrapped driver is always called directly
+    wire_format = None
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    @property
+    def socket_factory(self):
+        """Return the socket factory used by the driver."""
+
+        return getattr(self.driver, 'socket_factory', None)
+
+    @socket_factory.setter
+    def socket_factory(self, factory):
+        """Set the socket factory used by the driver."""
+
+        if hasattr(self.driver, 'socket_factory'):
+            self.driver.socket_factory = factory
+
+    def __call__(self, value, vtype, label, tags=None):
+        self.driver(value, vtype, label)
+
+
+def adapt(driver):
+    """Return the driver, adapted if it takes no tags argument."""
+
+    if takes_tags(driver):
+        return driver
+    return TaglessNotifier(driver)
 
 
 class PrintNotifier(BaseNotifier):
@@ -74,6 +272,11 @@ class PrintNotifier(BaseNotifier):
 
         return "Increment %s: %s" % (label, value)
 
+    def gauge(self, value, label):
+        """Format gauge."""
+
+        return "Gauge %s: %s" % (label, value)
+
     def default(self, value, label):
         """Format default string."""
 
@@ -97,90 +300,820 @@ class DebugNotifier(BaseNotifier):
         cls = utils.import_class_or_module(self.driver_name)
         self.driver = cls(config)
 
-    def __call__(self, value, vtype, label):
+    def __call__(self, value, vtype, label, tags=None):
         """Causes the metric to be formatted and sent."""
 
         # Format the value
-        body = self.driver.format(value, vtype, label)
+        body = self.driver.format(value, vtype, label, tags)
 
         # Output debugging information
         LOG.debug("DebugNotifier: Notifying %r of message %r" %
                   (self.driver_name, body))
         LOG.debug("DebugNotifier: Raw value of type %r: %r" % (vtype, value))
         LOG.debug("DebugNotifier: Statistic label: %r" % label)
+        if tags:
+            LOG.debug("DebugNotifier: Statistic tags: %r" % (tags,))
+
+        # Send to the label's shard, if the notifier has several servers
+        driver = self.driver
+        if getattr(driver, 'shards', None):
+            driver = driver.route(label)
+        driver.send(body)
+
+    @property
+    def native_io(self):
+        """Return whether the real notifier can use native I/O."""
+
+        return self.driver.native_io
+
+    @property
+    def socket_factory(self):
+        """Return the socket factory used by the real notifier."""
+
+        return getattr(self.driver, 'socket_factory', None)
 
-        self.driver.send(body)
+    @socket_factory.setter
+    def socket_factory(self, factory):
+        """Set the socket factory used by the real notifier."""
+
+        if hasattr(self.driver, 'socket_factory'):
+            self.driver.socket_factory = factory
+
+
+# The attributes of a notifier class the body of a metric depends on
+_format_attrs = ('format', 'formatter', 'sanitize', 'label_re',
+                 'label_replacement', '_types', 'exec_time', 'increment',
+                 'gauge', 'default')
+
+
+def _format_key(driver):
+    """Return what the body of a metric sent by a driver depends on.
+
+    That is the wire format and the formatting attributes of the
+    class, so a subclass changing the formatting doesn't share bodies
+    with its parent; None if the body is never shared.
+    """
+
+    if driver.wire_format is None:
+        return None
+
+    cls = driver.__class__
+    values = [getattr(cls, attr, None) for attr in _format_attrs]
+    return (driver.wire_format,) + tuple(
+        id(getattr(value, 'im_func', value)) for value in values)
+
+
+class FanoutNotifier(BaseNotifier):
+    """Send each metric to several notifiers.
+
+    Notifiers sharing a wire format and formatting methods share the
+    formatted body; other notifiers are called directly.  Configure a
+    fan-out by listing several comma-separated notifiers for a method;
+    the notifiers that may block are then sent to from an
+    AsyncNotifier, so the caller only pays for queueing the metric
+    once, and the others are called by the caller.
+    """
+
+    def __init__(self, config, drivers):
+        """Initialize the notifier.
+
+        :param config: The configuration.
+        :param drivers: The notifier drivers to send to.
+        """
+
+        super(FanoutNotifier, self).__init__(config)
+        self.drivers = drivers
+        self.blocking = any(driver.blocking for driver in drivers)
+
+        # Group the drivers sharing a wire format
+        self._groups = []
+        by_format = {}
+        for driver in drivers:
+            key = _format_key(driver)
+            if key is None:
+                self._groups.append([driver])
+            elif key in by_format:
+                by_format[key].append(driver)
+            else:
+                by_format[key] = [driver]
+                self._groups.append(by_format[key])
+
+    @property
+    def native_io(self):
+        """Return whether all the drivers can use native I/O."""
+
+        return all(driver.native_io for driver in self.drivers)
+
+    @property
+    def socket_factory(self):
+        """Return the socket factory used by the drivers."""
+
+        for driver in self.drivers:
+            if hasattr(driver, 'socket_factory'):
+                return driver.socket_factory
+        return None
+
+    @socket_factory.setter
+    def socket_factory(self, factory):
+        """Set the socket factory used by the drivers."""
+
+        for driver in self.drivers:
+            if hasattr(driver, 'socket_factory'):
+                driver.socket_factory = factory
+
+    def format(self, value, vtype, label, tags=None):
+        """Format the value using the first notifier."""
+
+        return self.drivers[0].format(value, vtype, label, tags)
+
+    def __call__(self, value, vtype, label, tags=None):
+        """Send the metric to all the notifiers.
+
+        An error in one notifier doesn't keep the metric from the
+        others.
+        """
+
+        for group in self._groups:
+            try:
+                if len(group) == 1:
+                    group[0](value, vtype, label, tags)
+                    continue
+
+                body = group[0].format(value, vtype, label, tags)
+                for driver in group:
+                    driver.send(body)
+            except Exception:
+                LOG.exception("%s: Error notifying %r" %
+                              (self.__class__.__name__,
+                               group[0].__class__.__name__))
+
+
+class AsyncNotifier(BaseNotifier):
+    """Non-blocking notifier.
+
+    Use the "real_driver" configuration option to specify the notifier
+    to wrap.  Metrics are queued and handed to the real notifier by a
+    background sender, so instrumented code never waits on metric
+    I/O.  The sender is a native OS thread, even under eventlet or
+    gevent, unless the "mode" option is set to "green", or the real
+    notifier does I/O that can't be switched to native sockets, such
+    as WebServiceNotifier's urllib2 requests.  At most
+    "queue_size" metrics (default 10000) are queued; beyond that, new
+    metrics are dropped and counted.  When a green thread library is
+    active, the event loop lag is measured every "lag_interval"
+    seconds (default 1; 0 disables) and reported as an execution time
+    under "lag_label" (default "tach.hub_lag").
+    """
+
+    blocking = False
+
+    def __init__(self, config, driver=None):
+        """Initialize the notifier from the configuration."""
+
+        super(AsyncNotifier, self).__init__(config)
+
+        # Figure out the real notifier, unless we were handed one
+        if driver is None:
+            self.driver_name = config['real_driver']
+            cls = utils.import_class_or_module(self.driver_name)
+            driver = adapt(cls(config))
+        else:
+            self.driver_name = driver.__class__.__name__
+        self.driver = driver
+
+        self.mode = config.get('mode', 'thread')
+        self.queue_size = int(config.get('queue_size', 10000))
+        self.poll_interval = float(config.get('poll_interval', 0.1))
+        self.lag_interval = float(config.get('lag_interval', 1))
+        self.lag_label = config.get('lag_label', 'tach.hub_lag')
+
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._started = False
+        self._start_lock = utils.original('thread', 'allocate_lock')()
+
+    def format(self, value, vtype, label, tags=None):
+        """Format the value using the real notifier."""
+
+        return self.driver.format(value, vtype, label, tags)
+
+    def __call__(self, value, vtype, label, tags=None):
+        """Queue the metric for sending.
+
+        Appending to a deque is atomic and never blocks, so this is
+        safe to call from any thread or green thread.
+        """
+
+        if not self._started:
+            self.start()
+
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            return
+
+        # The transaction ID travels with the metric to the sender
+        self._queue.append((value, vtype, label, tags,
+                            context.transaction_id()))
+
+    def start(self):
+        """Start the background sender, unless it was started already."""
+
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+
+        green = self.mode == 'green'
+        if not green and utils.green_library() and not self.driver.native_io:
+            # Green sockets must be driven from their own hub
+            LOG.debug("%s: Sending from a green thread for %r" %
+                      (self.__class__.__name__, self.driver_name))
+            green = True
+        if not green and hasattr(self.driver, 'socket_factory'):
+            # Native threads must not use green sockets
+            self.driver.socket_factory = utils.original('socket', 'socket')
+
+        utils.spawn(self._run, utils.sleeper(green), green=green)
+
+        if self.lag_interval > 0 and utils.green_library():
+            utils.spawn(self._monitor_lag, utils.sleeper(True), green=True)
+
+    def flush(self):
+        """Send all queued metrics.
+
+        Returns True if any metrics were sent.
+        """
+
+        sent = False
+        saved_transaction_id = context.transaction_id()
+        while True:
+            try:
+                (value, vtype, label, tags,
+                 transaction_id) = self._queue.popleft()
+            except IndexError:
+                context.set_transaction_id(saved_transaction_id)
+                return sent
+
+            try:
+                context.set_transaction_id(transaction_id)
+                self.driver(value, vtype, label, tags)
+            except Exception:
+                LOG.exception("%s: Error notifying %r" %
+                              (self.__class__.__name__, self.driver_name))
+            sent = True
+
+    def _run(self, sleep):
+        """Background sender loop."""
+
+        while True:
+            if not self.flush():
+                sleep(self.poll_interval)
+
+    def _monitor_lag(self, sleep):
+        """Measure how late the hub wakes up a sleeping green thread."""
+
+        while True:
+            start = time.time()
+            sleep(self.lag_interval)
+            lag = time.time() - start - self.lag_interval
+            self(max(lag, 0.0), 'exec_time', self.lag_label)
+
+
+class TraceNotifier(BaseNotifier):
+    """Write a timeline of calls to a local file.
+
+    Events are written in the Chrome trace-event format, which
+    chrome://tracing, Perfetto and speedscope can open.  Execution
+    times become complete events, stamped with the thread (or green
+    thread) and, when span tracking is enabled, the nesting depth of
+    the call; other metrics become counter events.
+
+    Use the "path" configuration option to specify the file.  Writes
+    are buffered ("buffer_size" bytes, default 65536).  Once the file
+    exceeds "max_bytes" (default 67108864), it is rotated, keeping
+    "backup_count" old files (default 5).  If "duration" is set, the
+    capture stops that many seconds after the first event.  Labels
+    ending in one of the comma-separated "exclude" suffixes (default
+    ".self") are not recorded.
+    """
+
+    # Writes go to a local buffer
+    blocking = False
+
+    def __init__(self, config):
+        """Initialize the notifier from the configuration."""
+
+        super(TraceNotifier, self).__init__(config)
+        self.path = config['path']
+        self.buffer_size = int(config.get('buffer_size', 65536))
+        self.max_bytes = int(config.get('max_bytes', 67108864))
+        self.backup_count = int(config.get('backup_count', 5))
+        self.duration = float(config.get('duration', 0))
+        self.exclude = tuple(suffix.strip() for suffix in
+                             config.get('exclude', '.self').split(',')
+                             if suffix.strip())
+
+        self.pid = os.getpid()
+        self.stop_time = None
+        self._started = False
+        self._file = None
+        self._written = 0
+        self._empty = True
+        self._lock = utils.original('thread', 'allocate_lock')()
+
+    def __call__(self, value, vtype, label, tags=None):
+        """Record an event.
+
+        The event is built immediately, so it is stamped with the
+        calling thread and the current time.  Tags are recorded as
+        event arguments.
+        """
+
+        if self.exclude and label.endswith(self.exclude):
+            return
+
+        now = time.time()
+        if self.stop_time is not None and now >= self.stop_time:
+            return
+
+        event = {
+            'name': label,
+            'pid': self.pid,
+            'tid': thread.get_ident(),
+            }
+        if vtype == 'exec_time':
+            event.update(ph='X', ts=int((now - value) * 1e6),
+                         dur=int(value * 1e6))
+            span = context.current_span()
+            if span is not None:
+                depth = 0
+                while span is not None:
+                    depth += 1
+                    span = span.parent
+                event['args'] = {'depth': depth}
+        else:
+            event.update(ph='C', ts=int(now * 1e6), args={'value': value})
+        if tags:
+            event.setdefault('args', {}).update(tags)
+
+        self.send(json.dumps(event))
+
+    def send(self, body):
+        """Append an encoded event to the trace file."""
+
+        with self._lock:
+            if not self._file:
+                if self._started and self.stop_time is not None:
+                    # The capture is over
+                    return
+                self._open()
+
+            if self._empty:
+                self._empty = False
+                body = '\n' + body
+            else:
+                body = ',\n' + body
+
+            self._file.write(body)
+            self._written += len(body)
+
+            if self._written >= self.max_bytes:
+                self._rotate()
+
+    def flush(self):
+        """Flush buffered events to the trace file."""
+
+        with self._lock:
+            if self._file:
+                self._file.flush()
+
+            if self.stop_time is not None and time.time() >= self.stop_time:
+                self._close()
+
+    def close(self):
+        """End the capture, completing the JSON array."""
+
+        with self._lock:
+            self._started = True
+            self.stop_time = time.time()
+            self._close()
+
+    def _open(self):
+        """Open a new trace file."""
+
+        self._file = open(self.path, 'w', self.buffer_size)
+        self._file.write('[')
+        self._written = 1
+        self._empty = True
+
+        # The capture starts with the first file
+        if not self._started:
+            self._started = True
+            if self.duration > 0:
+                self.stop_time = time.time() + self.duration
+            utils.ticker.every(1, self.flush)
+
+    def _close(self):
+        """Close the trace file, without locking."""
+
+        if self._file:
+            self._file.write('\n]\n')
+            self._file.close()
+            self._file = None
+
+    def _rotate(self):
+        """Move the full trace file aside and start a new one."""
+
+        self._close()
+
+        for i in range(self.backup_count - 1, 0, -1):
+            src = '%s.%d' % (self.path, i)
+            if os.path.exists(src):
+                os.rename(src, '%s.%d' % (self.path, i + 1))
+        if self.backup_count > 0:
+            os.rename(self.path, self.path + '.1')
+
+        self._open()
+
+
+class PrometheusNotifier(BaseNotifier):
+    """Keep metrics in memory for Prometheus to scrape.
+
+    Execution times are kept as histograms, with the bucket bounds, in
+    seconds, given by the comma-separated "buckets" option;
+    increments are kept as counters, and other metrics as gauges.
+    Metric names are the labels, prefixed with "namespace" (default
+    "tach"); tags become Prometheus labels.  At most "max_series"
+    series (default 10000) are kept.
+
+    The metrics are served in the text format from a background
+    thread, on "host" (default 127.0.0.1) and "port", or on the Unix
+    socket named by "unix_socket".
+    """
+
+    # Recording a metric only updates memory
+    blocking = False
+
+    def __init__(self, config):
+        """Initialize the notifier from the configuration."""
+
+        super(PrometheusNotifier, self).__init__(config)
+
+        buckets = prometheus.BUCKETS
+        if config.get('buckets'):
+            buckets = [float(bound) for bound in config['buckets'].split(',')]
+        self.registry = prometheus.Registry(
+            config.get('namespace', 'tach'), buckets,
+            int(config.get('max_series', 10000)))
+
+        self.unix_socket = config.get('unix_socket')
+        self.host = config.get('host', '127.0.0.1')
+        self.port = None if self.unix_socket else int(config['port'])
+        self.sock = None
+        self._started = False
+
+    def __call__(self, value, vtype, label, tags=None):
+        """Record the metric."""
+
+        if not self._started:
+            self.start()
+
+        self.registry.observe(value, vtype, label, tags)
+
+    def start(self):
+        """Start serving scrapes."""
+
+        self._started = True
+
+        try:
+            self.sock = prometheus.listen(self.port, self.host,
+                                          self.unix_socket)
+        except socket.error as e:
+            LOG.error("%s: Error listening on %s: %s" %
+                      (self.__class__.__name__,
+                       self.unix_socket or '%s:%s' % (self.host, self.port),
+                       e))
+            return
+
+        utils.spawn(prometheus.serve, self.sock, self.registry)
 
 
 class SocketNotifier(BaseNotifier):
-    """Base class for notifiers using sockets."""
+    """Base class for notifiers using sockets.
+
+    Use the "host" and "port" configuration options to specify the
+    server.  To spread metrics over several servers, list them, as
+    comma-separated "host:port" pairs, in the "hosts" option instead;
+    each label is sent to the same server every time, chosen by
+    consistent hashing, so adding a server moves only the labels it
+    takes over.  If "batch_size" is set, metrics are buffered, for
+    each server, until that many bytes are waiting or for at most
+    "batch_interval" seconds (default 1).
+
+    Connecting times out after "connect_timeout" seconds (default
+    1).  When a server can't be reached, or a send fails, metrics for
+    it are dropped, and counted, or spooled if the "spool" option
+    names a directory, while reconnection is attempted in the
+    background, waiting "reconnect_min" seconds (default 0.5) after
+    the first failure, doubling after each failure up to
+    "reconnect_max" seconds (default 30).  Only the first connection
+    is made by the caller.  Server addresses are resolved once per
+    connection outage rather than for each connection.  Once metrics
+    have been dropped, the number dropped is reported as an increment
+    under "dropped_label" (default "tach.dropped") every
+    "dropped_interval" seconds (default 10).
+    """
+
+    # Replaced by AsyncNotifier when sending from a native thread in a
+    # monkey-patched process
+    _socket_factory = None
+
+    # What separates metrics sent together
+    batch_separator = ''
 
     def __init__(self, config):
         """Initialize a SocketNotifier."""
 
         super(SocketNotifier, self).__init__(config)
-        self.host = config['host']
-        self.port = int(config['port'])
+
+        # Figure out the servers
+        servers = []
+        for server in config.get('hosts', '').split(','):
+            host, _sep, port = server.strip().partition(':')
+            if host:
+                servers.append((host, int(port or config['port'])))
+        if not servers:
+            servers.append((config['host'], int(config['port'])))
+        self.host, self.port = servers[0]
 
         # Save the socket
         self._sock = None
+        self._address = None
+
+        # Set up the reconnection backoff; while _retry_at is set, the
+        # circuit is open and metrics are dropped
+        self.connect_timeout = float(config.get('connect_timeout', 1))
+        self.reconnect_min = float(config.get('reconnect_min', 0.5))
+        self.reconnect_max = float(config.get('reconnect_max', 30))
+        self._failures = 0
+        self._retry_at = None
+        self._reconnecting = False
+
+        # Count the metrics dropped, reporting them once there are some
+        self.dropped_label = config.get('dropped_label', 'tach.dropped')
+        self.dropped_interval = float(config.get('dropped_interval', 10))
+        self.dropped = 0
+        self._dropped_reported = 0
+        self._reporting_dropped = False
+
+        # Set up the batch buffer
+        self.batch_size = int(config.get('batch_size', 0))
+        self.batch_interval = float(config.get('batch_interval', 1))
+        self._batch = collections.deque()
+        self._batch_len = 0
+        self._flushing = False
+        self._send_lock = utils.original('thread', 'allocate_lock')()
+
+        # Spool bodies that couldn't be sent?  The shards need the
+        # spool settings, so set them up first
+        self._setup_spool(config)
+
+        # Set up a shard for each server
+        self.shards = None
+        self._routes = {}
+        if len(servers) > 1:
+            self.shards = [self._shard(host, port) for host, port in servers]
+            self._ring = utils.HashRing(
+                [('%s:%s' % (shard.host, shard.port), shard)
+                 for shard in self.shards])
+
+            # The body depends on the server; don't share it
+            self.wire_format = None
+
+        # Each shard resumes its own spool, under the configured
+        # directory
+        if not self.shards:
+            self._resume_spool()
+
+    def _shard(self, host, port):
+        """Return a notifier of the same class sending to another server.
+
+        The shard has the options of the notifier, but its own server
+        and spool directory, and none of its state.  It is built
+        through the class, so subclasses initialize it fully.
+        """
+
+        options = dict(getattr(self.config, 'additional', self.config))
+        options.pop('hosts', None)
+        options.update(host=host, port=str(port))
+        if self.spool_path:
+            options['spool'] = os.path.join(self.spool_path,
+                                            '%s-%s' % (host, port))
+        return self.__class__(options)
+
+    @property
+    def socket_factory(self):
+        """Return the function creating sockets."""
+
+        return self._socket_factory
+
+    @socket_factory.setter
+    def socket_factory(self, factory):
+        """Set the function creating sockets, for all the shards."""
+
+        self._socket_factory = factory
+        for shard in self.shards or ():
+            shard._socket_factory = factory
+
+    def route(self, label):
+        """Return the shard to send a label to."""
+
+        try:
+            return self._routes[label]
+        except KeyError:
+            # Keep the cache bounded
+            if len(self._routes) >= self.format_cache_size:
+                self._routes.clear()
+            shard = self._routes[label] = self._ring.get(label)
+            return shard
+
+    def __call__(self, value, vtype, label, tags=None):
+        """Causes the metric to be formatted and sent.
+
+        With several servers, the metric goes to the label's shard.
+        """
+
+        body = self.format(value, vtype, label, tags)
+        if self.shards:
+            self.route(label).send(body)
+        else:
+            self.send(body)
 
     def send(self, body):
-        """Send to a service specified by host and port."""
+        """Send, or buffer, a body for the server."""
+
+        if self.batch_size <= 0:
+            self._send(body)
+            return
+
+        self._batch.append(body)
+        self._batch_len += len(body)
+        if not self._flushing:
+            # Flush the buffer periodically
+            self._flushing = True
+            utils.ticker.every(self.batch_interval, self.flush)
+        if self._batch_len >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Send the buffered bodies together."""
+
+        for shard in self.shards or ():
+            shard.flush()
+
+        bodies = []
+        while True:
+            try:
+                bodies.append(self._batch.popleft())
+            except IndexError:
+                break
+        self._batch_len = 0
+
+        if bodies:
+            self._send(self.batch_separator.join(bodies))
+
+    def _send(self, body):
+        """Send a body, dropping or spooling it on failure."""
+
+        if not self.deliver(body):
+            self.dropped += 1
+            self._spool_body(body)
+
+            # Start reporting the metrics dropped
+            if not self._reporting_dropped and self.dropped_interval > 0:
+                self._reporting_dropped = True
+                utils.ticker.every(self.dropped_interval, self.report_dropped)
+
+    def report_dropped(self):
+        """Report the metrics dropped since the last report.
+
+        Nothing is reported while the circuit is open, since the
+        report would be dropped too; the metrics dropped meanwhile are
+        reported once it closes.  A report failing nonetheless isn't
+        counted as dropped itself.
+        """
+
+        if self._retry_at is not None:
+            return
 
-        # Since we're keeping the socket open for a long time, we try
-        # the send twice, reopening the socket in between rounds, if
-        # sending fails the first time.
-        for rnd in range(2):
-            # Get the socket
+        dropped = self.dropped - self._dropped_reported
+        if dropped:
+            self(dropped, 'increment', self.dropped_label)
+        self._dropped_reported = self.dropped
+
+    def deliver(self, body):
+        """Send to a service specified by host and port.
+
+        Returns True if the body was sent.
+        """
+
+        # The ticker and the sender may send at the same time
+        with self._send_lock:
             sock = self.sock
             if not sock:
-                return
+                return False
 
-            # Send the body
             try:
                 sock.sendall(body)
             except socket.error as e:
-                if rnd:
-                    LOG.error("%s: Error writing to server (%s, %s): %s" %
-                              (self.__class__.__name__, self.host, self.port,
-                               e))
-
-                # Try reopening the socket next time
+                # The connection is gone; reconnect in the background,
+                # rather than making the caller wait for it
                 del self.sock
-            else:
-                # Body successfully sent
-                break
+                LOG.error("%s: Error writing to server (%s, %s): %s" %
+                          (self.__class__.__name__, self.host, self.port, e))
+                self._fail()
+                return False
+
+            return True
+
+    def _spool_options(self):
+        """Return the options "tach replay" builds the notifier from."""
+
+        options = super(SocketNotifier, self)._spool_options()
+        options.pop('hosts', None)
+        options.update(host=self.host, port=str(self.port))
+        return options
 
     @property
     def sock(self):
         """Retrieve a socket for the server.
 
-        Creates the socket, if necessary.
+        Creates the socket, if necessary, unless the circuit is open,
+        in which case None is returned.
         """
 
-        if not self._sock:
-            # TCP or UDP?
-            if getattr(self, 'sock_type', 'tcp') == 'udp':
-                sock_type = socket.SOCK_DGRAM
-            else:
-                sock_type = socket.SOCK_STREAM
+        if not self._sock and self._retry_at is None:
+            self._connect()
 
-            # Obtain the socket
-            sock = socket.socket(socket.AF_INET, sock_type)
+        return self._sock
 
-            # Connect the socket
-            try:
-                sock.connect((self.host, self.port))
-            except socket.error as e:
-                print ("Error connecting to server %s port %s: %s" %
-                       (self.host, self.port, e))
-                return None
+    def _connect(self):
+        """Connect to the server, opening the circuit on failure."""
 
-            # Save the created socket
-            self._sock = sock
+        # TCP or UDP?
+        if getattr(self, 'sock_type', 'tcp') == 'udp':
+            sock_type = socket.SOCK_DGRAM
+        else:
+            sock_type = socket.SOCK_STREAM
 
-        return self._sock
+        try:
+            # Resolve the server address
+            if self._address is None:
+                self._address = socket.getaddrinfo(
+                    self.host, self.port, socket.AF_INET, sock_type)[0][4]
+
+            # Obtain and connect the socket; never an instrumented one
+            factory = (self.socket_factory or
+                       utils.uninstrumented(socket, 'socket'))
+            sock = factory(socket.AF_INET, sock_type)
+            sock.settimeout(self.connect_timeout)
+            sock.connect(self._address)
+            sock.settimeout(None)
+        except socket.error as e:
+            # Only log the first failure of an outage
+            if not self._failures:
+                LOG.error("%s: Error connecting to server (%s, %s): %s" %
+                          (self.__class__.__name__, self.host, self.port, e))
+            self._fail()
+            return
+
+        # Save the created socket, closing the circuit
+        self._sock = sock
+        self._failures = 0
+        self._retry_at = None
+
+    def _fail(self):
+        """Open the circuit, backing off exponentially."""
+
+        self._failures += 1
+        delay = min(self.reconnect_min * 2 ** (self._failures - 1),
+                    self.reconnect_max)
+        self._retry_at = time.time() + delay
+
+        # The address may have changed
+        self._address = None
+
+        # Reconnect in the background
+        if not self._reconnecting:
+            self._reconnecting = True
+            utils.ticker.every(self.reconnect_min, self._reconnect)
+
+    def _reconnect(self):
+        """Try reconnecting if the circuit is open and the delay over."""
+
+        if (not self._sock and self._retry_at is not None and
+                time.time() >= self._retry_at):
+            self._connect()
 
     @sock.deleter
     def sock(self):
@@ -202,57 +1135,247 @@ class SocketNotifier(BaseNotifier):
             self._sock = None
 
 
+# Characters allowed in Graphite and statsd metric names
+_metric_name_re = re.compile(r'[^\w.\-]')
+
+
 class GraphiteNotifier(SocketNotifier):
-    """Simple Graphite notifier."""
+    """Simple Graphite notifier.
+
+    The timestamp is updated once a second by the ticker, rather than
+    for each metric.
+    """
+
+    label_re = _metric_name_re
+    wire_format = 'graphite'
+
+    def __init__(self, config):
+        """Initialize a GraphiteNotifier."""
+
+        super(GraphiteNotifier, self).__init__(config)
+        self._stamp = None
+
+    def _update_stamp(self):
+        """Update the timestamp ending each line."""
+
+        self._stamp = ' %d\n' % int(time.time())
+
+    def formatter(self, vtype, label, tags=None):
+        """Return a function formatting values for a label.
+
+        Graphite has no notion of metric types; all values are
+        formatted the same way.  Tags use the tagged series syntax,
+        "label;key=value".
+        """
+
+        # Start updating the timestamp
+        if self._stamp is None:
+            self._update_stamp()
+            utils.ticker.every(1, self._update_stamp)
+
+        if tags:
+            label += ''.join(';%s=%s' % (self.sanitize(key),
+                                         self.sanitize(value))
+                             for key, value in tags)
+
+        prefix = label + ' '
+        return lambda value: prefix + str(value) + self._stamp
 
     def default(self, value, label):
         """Format metric submission."""
 
-        return "%s %s %d\n" % (label, value, int(time.time()))
+        return self.format(value, 'default', label)
+
+    gauge = default
 
 
 class StatsDNotifier(SocketNotifier):
     """Simple statsd notifier."""
 
     sock_type = 'udp'
+    label_re = _metric_name_re
+    wire_format = 'statsd'
+    batch_separator = '\n'
+
+    # The suffix for each metric type
+    _types = {
+        'exec_time': '|ms',
+        'increment': '|c',
+        'gauge': '|g',
+        }
+
+    def formatter(self, vtype, label, tags=None):
+        """Return a function formatting values for a label and type.
+
+        Tags use the DogStatsD syntax, "|#key:value,key:value".
+        """
+
+        suffix = self._types.get(vtype)
+        if suffix is None:
+            return super(StatsDNotifier, self).formatter(vtype, label,
+                                                         tags)
+        if tags:
+            suffix += '|#' + ','.join('%s:%s' % (self.sanitize(key),
+                                                 self.sanitize(value))
+                                      for key, value in tags)
+
+        prefix = label + ':'
+        if vtype == 'exec_time':
+            # Execution times are reported in milliseconds
+            return lambda value: prefix + str(value * 1000.0) + suffix
+        return lambda value: prefix + str(value) + suffix
 
     def exec_time(self, value, label):
         """Format execution time."""
 
-        return "%s:%s|ms" % (label, value * 1000.0)
+        return self.format(value, 'exec_time', label)
 
     def increment(self, value, label):
         """Format increment/decrement."""
 
-        return "%s:%s|c" % (label, value)
+        return self.format(value, 'increment', label)
+
+    def gauge(self, value, label):
+        """Format gauge."""
+
+        return self.format(value, 'gauge', label)
 
 
 class WebServiceNotifier(BaseNotifier):
-    """Base class for notifiers that talk to web services."""
+    """Base class for notifiers that talk to web services.
+
+    Each body is posted as is.  Bodies that can't be sent because of
+    a network error or a server error are spooled if the "spool"
+    option names a directory; bodies the server rejects are dropped.
+    Requests time out after "timeout" seconds (default 5).  After a
+    failure, no request is attempted for "retry_min" seconds (default
+    0.5), doubling after each failure up to "retry_max" seconds
+    (default 30), so an unreachable service doesn't hold up each
+    caller for the timeout.
+    """
+
+    # urllib2 uses whatever sockets the process was patched with
+    native_io = False
+
+    # The content type of the bodies, if any
+    content_type = None
 
     def __init__(self, config):
         """Initialize the urllib2 connection."""
 
         super(WebServiceNotifier, self).__init__(config)
         self.url = config['url']
+        self.timeout = float(config.get('timeout', 5))
+        self.dropped = 0
+
+        # Set up the backoff; while _retry_at is set, the circuit is
+        # open until then
+        self.retry_min = float(config.get('retry_min', 0.5))
+        self.retry_max = float(config.get('retry_max', 30))
+        self._failures = 0
+        self._retry_at = None
+
+        self._setup_spool(config)
+        self._resume_spool()
 
     def send(self, body):
+        """Send a body, dropping or spooling it on failure."""
+
+        if not self.deliver(body):
+            self.dropped += 1
+            self._spool_body(body)
+
+    def deliver(self, body):
+        """Post a body to the web service.
+
+        Returns False if the body wasn't sent but may be later, and
+        True otherwise; bodies the server rejects are counted as
+        dropped.
+        """
+
+        if self._retry_at is not None and time.time() < self._retry_at:
+            return False
+
+        headers = {}
+        if self.content_type:
+            headers['Content-Type'] = self.content_type
+
+        # Keep the instrumentation packs out of our own requests
+        entered = context.enter_internal()
         try:
-            cooked_data = urllib.urlencode(body)
-            req = urllib2.Request(self.url, cooked_data)
-            response = urllib2.urlopen(req)
-            return response.read()
-        except Exception, e:
-            LOG.debug("****** EXCEPTION %s" % e)
-            return None
+            req = urllib2.Request(self.url, body, headers)
+            response = urllib2.urlopen(req, timeout=self.timeout)
+            response.read()
+        except urllib2.HTTPError as e:
+            if e.code >= 500:
+                self._fail(e)
+                return False
+            LOG.error("%s: Body rejected by %s: %s" %
+                      (self.__class__.__name__, self.url, e))
+            self.dropped += 1
+            return True
+        except (urllib2.URLError, httplib.HTTPException, socket.error) as e:
+            self._fail(e)
+            return False
+        except Exception as e:
+            # Retrying won't help
+            LOG.error("%s: Error posting to %s: %s" %
+                      (self.__class__.__name__, self.url, e))
+            self.dropped += 1
+            return True
+        finally:
+            if entered:
+                context.leave_internal()
+
+        # Close the circuit
+        self._failures = 0
+        self._retry_at = None
+        return True
+
+    def _fail(self, error):
+        """Open the circuit, backing off exponentially."""
+
+        # Only log the first failure of an outage
+        if not self._failures:
+            LOG.error("%s: Error posting to %s: %s" %
+                      (self.__class__.__name__, self.url, error))
+
+        self._failures += 1
+        delay = min(self.retry_min * 2 ** (self._failures - 1),
+                    self.retry_max)
+        self._retry_at = time.time() + delay
 
 
 class StackTachNotifier(WebServiceNotifier):
     """Talk to the StackTach web service."""
 
+    wire_format = 'stacktach'
+    content_type = 'application/json'
+
+    def formatter(self, vtype, label, tags=None):
+        """Return a function formatting values for a label and type.
+
+        The routing key is encoded once; only the transaction ID, if
+        the label contains "{%TX_ID%}", and the value are encoded for
+        each metric.  Tag values are appended to the routing key as
+        dotted components.
+        """
+
+        if vtype != 'exec_time':
+            return super(StackTachNotifier, self).formatter(vtype, label,
+                                                            tags)
+        if tags:
+            label += ''.join('.' + value for _key, value in tags)
+
+        parts = json.dumps(label).split("{%TX_ID%}")
+        if len(parts) == 1:
+            prefix = '[' + parts[0] + ', '
+            return lambda value: prefix + json.dumps(value) + ']'
+
+        return lambda value: ('[' + str(self.transaction_id).join(parts) +
+                              ', ' + json.dumps(value) + ']')
+
     def exec_time(self, value, label):
         """Format execution time."""
 
-        routing_key = label.replace("{%TX_ID%}", str(self.transaction_id))
-        payload = (routing_key, value)
-        return json.dumps(payload)
+        return self.format(value, 'exec_time', label)
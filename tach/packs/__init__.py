@@ -0,0 +1,104 @@
+from tach import utils
+
+
+# The built-in packs, by section name
+PACKS = {
+    'dbapi': 'tach.packs.dbapi.DBAPIPack',
+    'http': 'tach.packs.net.HTTPPack',
+    'locks': 'tach.packs.locks.LockPack',
+    'socket': 'tach.packs.net.SocketPack',
+    }
+
+
+def load(config, label, items):
+    """Load an instrumentation pack from a configuration section.
+
+    :param config: The global configuration.
+    :param label: The section name, "pack:<name>".  The name selects
+                  a built-in pack, unless a "driver" option names the
+                  pack class.
+    :param items: A list of key, value pairs giving the
+                  configuration of the pack.
+
+    :returns: The attached pack.
+    """
+
+    name = label.partition(':')[-1]
+    options = dict(items)
+    driver = options.pop('driver', None) or PACKS.get(name)
+    if not driver:
+        raise Exception("Unknown instrumentation pack: %s" % name)
+
+    cls = utils.import_class_or_module(driver)
+    pack = cls(config, name, options)
+    pack.attach()
+    return pack
+
+
+class Pack(object):
+    """Instrument a library as a whole.
+
+    A pack reports through a Method that wraps nothing, so blocks it
+    times get the metric, notifier and options of the section, and
+    their labels are bounded by max_labels.  Subclasses override
+    attach(), replacing library functions with patch().
+    """
+
+    def __init__(self, config, name, options):
+        """Initialize the pack.
+
+        :param config: The global configuration.
+        :param name: The name of the pack.
+        :param options: A dictionary of the pack options.  The
+                        "label" option is the label prefix, defaulting
+                        to the name; "metric" defaults to
+                        tach.metrics.ExecTime.  The rest are method
+                        options.
+        """
+
+        self.config = config
+        self.name = name
+        self.options = dict(options)
+        self._patches = []
+
+        items = dict(options)
+        label = items.pop('label', name)
+        items.setdefault('metric', 'tach.metrics.ExecTime')
+        self.method = config.add_method(label, items.items(), function=None)
+
+    def attach(self):
+        """Instrument the library.
+
+        The base pack instruments nothing.
+        """
+
+        pass
+
+    def patch(self, obj, attr, replacement):
+        """Replace an attribute, remembering the original.
+
+        The original remains available to tach through
+        utils.uninstrumented().
+
+        :returns: The original value.
+        """
+
+        # Keep static and class methods as they are
+        try:
+            original = vars(obj)[attr]
+        except KeyError:
+            original = getattr(obj, attr)
+        self._patches.append((obj, attr, original))
+        utils.instrumented.setdefault((obj, attr), original)
+        setattr(obj, attr, replacement)
+        return original
+
+    def detach(self):
+        """Remove the instrumentation."""
+
+        while self._patches:
+            obj, attr, original = self._patches.pop()
+            setattr(obj, attr, original)
+            if utils.instrumented.get((obj, attr)) is original:
+                del utils.instrumented[(obj, attr)]
+        self.method.detach()
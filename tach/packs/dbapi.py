@@ -0,0 +1,260 @@
+import hashlib
+import logging
+import re
+
+from tach import packs
+from tach import utils
+
+
+LOG = logging.getLogger(__name__)
+
+# Normalization of SQL statements, in order: comments, literals and
+# placeholders become "?", then lists of them collapse.  Double-quoted
+# strings are literals too, except right after a keyword naming a
+# table
+_comment_re = re.compile(r'/\*.*?\*/|--[^\n]*', re.S)
+_dquote_re = re.compile(r'(\b(?:from|into|update|join|table)\s+)?'
+                        r'"(?:[^"]|"")*"', re.I)
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b0x[0-9a-f]+\b|"
+                         r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[-+]?\d+)?\b|"
+                         r"%\(\w+\)s|%s|:\w+|\$\d+", re.I)
+_list_re = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_values_re = re.compile(r'(\(\?\))(?:\s*,\s*\(\?\))+')
+_space_re = re.compile(r'\s+')
+
+# The table a statement is about
+_table_re = re.compile(r'\b(?:from|into|update|join|table)\s+'
+                       r'[`"\[]?([\w.]+)', re.I)
+_name_re = re.compile(r'\W+')
+
+
+def _dquote(match):
+    """Replace a double-quoted string, unless it names a table."""
+
+    return match.group(0) if match.group(1) else '?'
+
+
+def fingerprint(statement):
+    """Normalize a SQL statement, stripping its literals.
+
+    Statements differing only in their literals, placeholders,
+    comments, whitespace or the length of IN lists get the same
+    fingerprint.
+    """
+
+    statement = _comment_re.sub(' ', statement)
+    statement = _literal_re.sub('?', statement)
+    statement = _dquote_re.sub(_dquote, statement)
+    statement = _list_re.sub('(?)', statement)
+    statement = _values_re.sub(r'\1', statement)
+    return _space_re.sub(' ', statement).strip().lower()
+
+
+def statement_label(prefix, normalized):
+    """Build the label of a normalized statement.
+
+    The label is "<prefix>.<verb>.<table>.<hash>", the hash telling
+    apart statements of the same verb and table.
+    """
+
+    if isinstance(normalized, unicode):
+        normalized = normalized.encode('utf-8')
+    verb = (normalized.split(None, 1) or ['unknown'])[0]
+    match = _table_re.search(normalized)
+    table = match.group(1) if match else 'none'
+    digest = hashlib.md5(normalized).hexdigest()[:8]
+    return '%s.%s.%s.%s' % (prefix, _name_re.sub('_', verb),
+                            _name_re.sub('_', table), digest)
+
+
+class DBAPIPack(packs.Pack):
+    """Instrument DB-API 2 database drivers.
+
+    The connect() function of each driver module in the "modules"
+    option (default "sqlite3") is timed under "<label>.connect", and
+    returns a proxy whose cursors time execute() and executemany()
+    under a label derived from the statement fingerprint; see
+    statement_label().  Rows fetched, or affected by statements
+    without results, are counted under "<label>.rows".
+
+    Fingerprint labels are cached by statement text, up to
+    "statement_cache_size" statements (default 1000), and the number
+    of distinct labels is bounded by the usual max_labels option.
+    The normalized statement of each label is kept in statements.
+    """
+
+    def __init__(self, config, name, options):
+        super(DBAPIPack, self).__init__(config, name, options)
+
+        self.modules = [module.strip() for module in
+                        self.options.get('modules', 'sqlite3').split(',')
+                        if module.strip()]
+        self.statement_cache_size = int(
+            self.options.get('statement_cache_size', 1000))
+        self.rows_suffix = self.options.get('rows_suffix', '.rows')
+        self.connect_label = self.method.label + '.connect'
+        self.statements = {}
+        self._labels = {}
+
+    def attach(self):
+        """Instrument the connect() function of the driver modules."""
+
+        for name in self.modules:
+            module = utils.import_class_or_module(name)
+            self.patch(module, 'connect', self._wrap_connect(module.connect))
+
+    def _wrap_connect(self, connect):
+        """Wrap a connect() function to time it and proxy connections."""
+
+        def wrapper(*args, **kwargs):
+            with self.method.block(self.connect_label):
+                connection = connect(*args, **kwargs)
+            return ConnectionProxy(connection, self)
+
+        wrapper.tach_function = connect
+        return wrapper
+
+    def label(self, statement):
+        """Return the label of a statement.
+
+        Statements seen before cost one dictionary lookup.
+        """
+
+        try:
+            return self._labels[statement]
+        except KeyError:
+            pass
+
+        normalized = fingerprint(statement)
+        label = statement_label(self.method.label, normalized)
+        if label not in self.statements:
+            if len(self.statements) < self.statement_cache_size:
+                self.statements[label] = normalized
+            LOG.debug("%s: %s", label, normalized)
+
+        if len(self._labels) >= self.statement_cache_size:
+            self._labels.clear()
+        self._labels[statement] = label
+        return label
+
+    def rows(self, label, count):
+        """Count rows against a statement label."""
+
+        if count > 0 and label:
+            self.method.notifier(count, 'increment', label + self.rows_suffix)
+
+
+class ConnectionProxy(object):
+    """Proxy a DB-API connection, instrumenting its cursors."""
+
+    __slots__ = ('_connection', '_pack')
+
+    def __init__(self, connection, pack):
+        object.__setattr__(self, '_connection', connection)
+        object.__setattr__(self, '_pack', pack)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        if name in self.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._connection, name, value)
+
+    def __enter__(self):
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return self._connection.__exit__(exc_type, exc_value, tb)
+
+    def cursor(self, *args, **kwargs):
+        """Return an instrumented cursor."""
+
+        return CursorProxy(self._connection.cursor(*args, **kwargs),
+                           self._pack)
+
+    def execute(self, operation, *args):
+        """Execute a statement on a new cursor, as sqlite3 allows."""
+
+        return self.cursor().execute(operation, *args)
+
+    def executemany(self, operation, *args):
+        """Execute a statement on a new cursor, as sqlite3 allows."""
+
+        return self.cursor().executemany(operation, *args)
+
+
+class CursorProxy(object):
+    """Proxy a DB-API cursor, timing statements and counting rows."""
+
+    __slots__ = ('_cursor', '_pack', '_label')
+
+    def __init__(self, cursor, pack):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_pack', pack)
+        object.__setattr__(self, '_label', None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        if name in self.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        count = 0
+        for row in self._cursor:
+            count += 1
+            yield row
+        self._pack.rows(self._label, count)
+
+    def _execute(self, func, operation, args):
+        """Time a statement."""
+
+        pack = self._pack
+        cursor = self._cursor
+        with pack.method.block(pack.label(operation)) as block:
+            result = func(operation, *args)
+        self._label = block.label
+
+        # Count the rows affected by statements without results
+        if cursor.description is None:
+            pack.rows(block.label, cursor.rowcount)
+
+        return self if result is cursor else result
+
+    def execute(self, operation, *args):
+        """Execute a statement."""
+
+        return self._execute(self._cursor.execute, operation, args)
+
+    def executemany(self, operation, *args):
+        """Execute a statement against a sequence of parameters."""
+
+        return self._execute(self._cursor.executemany, operation, args)
+
+    def fetchone(self):
+        """Fetch the next row."""
+
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._pack.rows(self._label, 1)
+        return row
+
+    def fetchmany(self, *args):
+        """Fetch the next rows."""
+
+        rows = self._cursor.fetchmany(*args)
+        self._pack.rows(self._label, len(rows))
+        return rows
+
+    def fetchall(self):
+        """Fetch the remaining rows."""
+
+        rows = self._cursor.fetchall()
+        self._pack.rows(self._label, len(rows))
+        return rows
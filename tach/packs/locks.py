@@ -0,0 +1,213 @@
+import functools
+import os
+import sys
+import threading
+import time
+
+from tach import context
+from tach import packs
+from tach import utils
+
+
+# Frames in these files are lock machinery, not call sites
+_machinery = set(os.path.splitext(path)[0]
+                 for path in (__file__, threading.__file__))
+
+# Nor are frames of the standard library, such as Queue.get()
+_stdlib = os.path.join(os.path.dirname(os.__file__), '')
+_third_party = ('site-packages', 'dist-packages')
+
+
+def _is_machinery(filename):
+    """Determine if a frame in a file can't be a call site."""
+
+    if os.path.splitext(filename)[0] in _machinery:
+        return True
+    return (filename.startswith(_stdlib) and
+            not any(part in filename for part in _third_party))
+
+
+def _non_blocking(args, kwargs):
+    """Determine if acquire() arguments ask not to block."""
+
+    return (args and not args[0]) or not kwargs.get('blocking', True)
+
+
+class LockWaits(object):
+    """Waits for locks at one label since the last report."""
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class LockPack(packs.Pack):
+    """Measure time spent waiting to acquire locks.
+
+    Locks and semaphores made through threading.Lock, RLock,
+    Semaphore and BoundedSemaphore after the pack is attached, and
+    eventlet semaphores if eventlet is loaded, first try to acquire
+    without blocking; only if that fails is the wait timed.  Waits
+    of at least "threshold" seconds (default 0.001) are aggregated by
+    the instrumented call in progress, when spans are on and "by" is
+    "span" (the default), and otherwise by the acquiring call site,
+    "<module>.<function>".  Every report_interval seconds, each
+    "<label>.<key>" gets the number of waits as an increment under
+    ".waits", and the total and longest waits, in seconds, as gauges
+    under ".wait" and ".wait_max".  Keys count against max_labels.
+    Waits of tach's own threads are not measured.
+    """
+
+    def __init__(self, config, name, options):
+        super(LockPack, self).__init__(config, name, options)
+
+        self.threshold = float(self.options.get('threshold', 0.001))
+        self.by_span = self.options.get('by', 'span') == 'span'
+        self._waits = {}
+
+    def attach(self):
+        """Instrument the lock factories."""
+
+        utils.ticker.every(self.method.report_interval, self.report)
+
+        for name in ('Lock', 'RLock', 'Semaphore', 'BoundedSemaphore'):
+            self.patch(threading, name, self._factory(getattr(threading,
+                                                              name)))
+
+        for module_name in ('eventlet.semaphore', 'eventlet'):
+            module = sys.modules.get(module_name)
+            for name in ('Semaphore', 'BoundedSemaphore'):
+                cls = getattr(module, name, None)
+                if isinstance(cls, type):
+                    self.patch(module, name, self._subclass(cls))
+
+    def detach(self):
+        """Remove the instrumentation."""
+
+        utils.ticker.cancel(self.report)
+        super(LockPack, self).detach()
+
+    def _factory(self, factory):
+        """Wrap a lock factory to make instrumented locks."""
+
+        @functools.wraps(factory)
+        def wrapper(*args, **kwargs):
+            return InstrumentedLock(factory(*args, **kwargs), self)
+
+        wrapper.tach_function = factory
+        return wrapper
+
+    def _subclass(self, cls):
+        """Make an instrumented subclass of a semaphore class."""
+
+        pack = self
+
+        class Instrumented(cls):
+            def acquire(self, *args, **kwargs):
+                if cls.acquire(self, False):
+                    return True
+                if _non_blocking(args, kwargs):
+                    return False
+                return pack.wait(functools.partial(cls.acquire, self),
+                                 args, kwargs)
+
+            def __enter__(self):
+                return self.acquire()
+
+        Instrumented.__name__ = cls.__name__
+        Instrumented.__module__ = cls.__module__
+        return Instrumented
+
+    def wait(self, acquire, args, kwargs):
+        """Acquire a contended lock, timing the wait.
+
+        Waits of tach's own threads are not timed.
+        """
+
+        if context.internal():
+            return acquire(*args, **kwargs)
+
+        start = time.time()
+        result = acquire(*args, **kwargs)
+        waited = time.time() - start
+        if waited >= self.threshold:
+            self._record(waited)
+        return result
+
+    def _record(self, waited):
+        """Aggregate a wait."""
+
+        span = context.current_span() if self.by_span else None
+        if span is not None:
+            key = span.label
+        else:
+            key = self.call_site()
+        label = self.method.labels.intern('%s.%s' % (self.method.label, key))
+
+        try:
+            waits = self._waits[label]
+        except KeyError:
+            waits = self._waits.setdefault(label, LockWaits())
+        waits.count += 1
+        waits.total += waited
+        waits.max = max(waits.max, waited)
+
+    @staticmethod
+    def call_site():
+        """Return the function acquiring a lock, as "module.function".
+
+        Frames of the standard library are skipped, so a wait in
+        Queue.get() is attributed to the caller of get().
+        """
+
+        frame = sys._getframe(1)
+        while frame is not None:
+            code = frame.f_code
+            if not _is_machinery(code.co_filename):
+                return '%s.%s' % (frame.f_globals.get('__name__', 'unknown'),
+                                  code.co_name)
+            frame = frame.f_back
+        return 'unknown'
+
+    def report(self):
+        """Report the waits since the last report."""
+
+        waits, self._waits = self._waits, {}
+        notifier = self.method.nonblocking_notifier
+        for label, stats in waits.iteritems():
+            notifier(stats.count, 'increment', label + '.waits')
+            notifier(stats.total, 'gauge', label + '.wait')
+            notifier(stats.max, 'gauge', label + '.wait_max')
+
+
+class InstrumentedLock(object):
+    """Time contended acquisitions of a lock or semaphore."""
+
+    __slots__ = ('_lock', '_pack')
+
+    def __init__(self, lock, pack):
+        self._lock = lock
+        self._pack = pack
+
+    def __getattr__(self, name):
+        return getattr(self._lock, name)
+
+    def acquire(self, *args, **kwargs):
+        lock = self._lock
+        if lock.acquire(False):
+            return True
+        if _non_blocking(args, kwargs):
+            return False
+        return self._pack.wait(lock.acquire, args, kwargs)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._lock.release()
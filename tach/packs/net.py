@@ -0,0 +1,342 @@
+import errno
+import httplib
+import re
+import socket
+import sys
+
+from tach import config
+from tach import context
+from tach import packs
+from tach import utils
+
+
+# Errors that are part of normal non-blocking I/O
+_transient = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+_name_re = re.compile(r'\W+')
+
+
+class Traffic(object):
+    """Count the bytes and errors of a destination.
+
+    The counts are updated without a lock, relying on the GIL; an
+    update racing with another one for the same destination may be
+    lost, which is an acceptable price for keeping I/O fast.
+    """
+
+    __slots__ = ('sent', 'received', 'errors', '_last')
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self._last = (0, 0, 0)
+
+    def tick(self):
+        """Return the bytes sent, received and errors since the last tick."""
+
+        counts = (self.sent, self.received, self.errors)
+        deltas = [count - last for count, last in zip(counts, self._last)]
+        self._last = counts
+        return deltas
+
+
+class NetPack(packs.Pack):
+    """Base class of the network packs.
+
+    Destinations are labeled "<label>.<host>_<port>", and count
+    against max_labels.  Their traffic is accumulated and reported
+    every report_interval seconds, as increments under
+    "<destination>.bytes_sent", "<destination>.bytes_received" and
+    "<destination>.errors".  I/O done by tach itself, such as sending
+    metrics, is never counted.
+    """
+
+    def __init__(self, config, name, options):
+        super(NetPack, self).__init__(config, name, options)
+
+        self.destination_cache_size = int(
+            self.options.get('destination_cache_size', 1000))
+        self._destinations = {}
+        self._traffic = {}
+
+    def attach(self):
+        """Start reporting traffic."""
+
+        utils.ticker.every(self.method.report_interval, self.report)
+
+    def detach(self):
+        """Remove the instrumentation."""
+
+        utils.ticker.cancel(self.report)
+        super(NetPack, self).detach()
+
+    def destination(self, host, port):
+        """Return the label of a destination."""
+
+        key = (host, port)
+        try:
+            return self._destinations[key]
+        except KeyError:
+            pass
+
+        label = self.method.labels.intern('%s.%s_%s' % (
+                self.method.label, _name_re.sub('_', str(host)), port))
+        if len(self._destinations) >= self.destination_cache_size:
+            self._destinations.clear()
+        self._destinations[key] = label
+        return label
+
+    def traffic(self, label):
+        """Return the traffic counts of a destination label."""
+
+        try:
+            return self._traffic[label]
+        except KeyError:
+            return self._traffic.setdefault(label, Traffic())
+
+    def report(self):
+        """Report the traffic since the last report."""
+
+        notifier = self.method.nonblocking_notifier
+        for label, traffic in self._traffic.items():
+            sent, received, errors = traffic.tick()
+            if sent:
+                notifier(sent, 'increment', label + '.bytes_sent')
+            if received:
+                notifier(received, 'increment', label + '.bytes_received')
+            if errors:
+                notifier(errors, 'increment', label + '.errors')
+
+    def finish(self, block, exc_info=(None, None, None)):
+        """Finish a block, without instrumenting the reporting I/O."""
+
+        entered = context.enter_internal()
+        try:
+            block.__exit__(*exc_info)
+        finally:
+            if entered:
+                context.leave_internal()
+
+
+def _count_error(traffic, exc):
+    """Count a socket error, unless it's part of non-blocking I/O."""
+
+    if (isinstance(exc, socket.timeout) or
+            getattr(exc, 'errno', None) not in _transient):
+        traffic.errors += 1
+
+
+class SocketPack(NetPack):
+    """Instrument outbound TCP connections made with socket.socket.
+
+    connect() is timed under "<destination>.connect"; the bytes sent
+    and received over the connection, including through makefile(),
+    and errors are counted.  Sockets made by tach are never
+    instrumented.
+    """
+
+    def attach(self):
+        """Replace socket.socket with an instrumented subclass."""
+
+        super(SocketPack, self).attach()
+
+        pack = self
+        original = socket.socket
+
+        class InstrumentedSocket(original):
+            __doc__ = original.__doc__
+
+            def connect(self, address):
+                pack._connect(self, original.connect, address)
+
+            def makefile(self, mode='r', bufsize=-1):
+                traffic = self.__dict__.get('_tach_traffic')
+                sock = getattr(self, '_sock', None)
+                if traffic is None or sock is None:
+                    return original.makefile(self, mode, bufsize)
+                return socket._fileobject(CountedSocket(sock, traffic),
+                                          mode, bufsize)
+
+        self.patch(socket, 'socket', InstrumentedSocket)
+
+    def _connect(self, sock, connect, address):
+        """Connect a socket, instrumenting it if it's outbound TCP."""
+
+        if (context.internal() or not isinstance(address, tuple) or
+                sock.type != socket.SOCK_STREAM):
+            return connect(sock, address)
+
+        label = self.destination(address[0], address[1])
+        block = config.Block(self.method, label + '.connect').__enter__()
+        try:
+            connect(sock, address)
+        except BaseException:
+            exc_info = sys.exc_info()
+            self.finish(block, exc_info)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self.finish(block)
+
+        self._instrument(sock, self.traffic(label))
+
+    def _instrument(self, sock, traffic):
+        """Count the bytes moved over a connected socket."""
+
+        send, sendall = sock.send, sock.sendall
+        recv, recv_into = sock.recv, sock.recv_into
+
+        def counted_send(data, *args):
+            try:
+                sent = send(data, *args)
+            except socket.error as e:
+                _count_error(traffic, e)
+                raise
+            traffic.sent += sent
+            return sent
+
+        def counted_sendall(data, *args):
+            try:
+                sendall(data, *args)
+            except socket.error as e:
+                _count_error(traffic, e)
+                raise
+            traffic.sent += len(data)
+
+        def counted_recv(*args):
+            try:
+                data = recv(*args)
+            except socket.error as e:
+                _count_error(traffic, e)
+                raise
+            traffic.received += len(data)
+            return data
+
+        def counted_recv_into(*args):
+            try:
+                received = recv_into(*args)
+            except socket.error as e:
+                _count_error(traffic, e)
+                raise
+            traffic.received += received
+            return received
+
+        sock.send = counted_send
+        sock.sendall = counted_sendall
+        sock.recv = counted_recv
+        sock.recv_into = counted_recv_into
+        sock._tach_traffic = traffic
+
+
+class CountedSocket(object):
+    """Count the bytes moved by the file object of a socket."""
+
+    __slots__ = ('_sock', '_traffic')
+
+    def __init__(self, sock, traffic):
+        self._sock = sock
+        self._traffic = traffic
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def recv(self, *args):
+        data = self._sock.recv(*args)
+        self._traffic.received += len(data)
+        return data
+
+    def sendall(self, data, *args):
+        self._sock.sendall(data, *args)
+        self._traffic.sent += len(data)
+
+
+class HTTPPack(NetPack):
+    """Instrument outbound HTTP requests made with httplib.
+
+    The time from sending a request to receiving the response headers
+    is reported under the destination label, and responses are
+    counted under "<destination>.status.<N>xx".  Request bodies and
+    response bodies of known length are counted as bytes sent and
+    received.  Failed requests are reported like failed calls.
+    Spans are never tracked, since a request may be abandoned before
+    its response; a request whose connection is closed, or reused,
+    before its response is read is not reported.
+    """
+
+    def __init__(self, config, name, options):
+        options = dict(options, spans='0')
+        super(HTTPPack, self).__init__(config, name, options)
+
+    def attach(self):
+        """Instrument httplib.HTTPConnection, and so HTTPSConnection."""
+
+        super(HTTPPack, self).attach()
+
+        pack = self
+        request = httplib.HTTPConnection.request
+        getresponse = httplib.HTTPConnection.getresponse
+        close = httplib.HTTPConnection.close
+
+        def instrumented_request(conn, method, url, body=None, headers={}):
+            pack.discard(conn)
+            if context.internal():
+                return request(conn, method, url, body, headers)
+
+            label = pack.destination(conn.host, conn.port)
+            block = config.Block(pack.method, label).__enter__()
+            try:
+                request(conn, method, url, body, headers)
+            except BaseException:
+                exc_info = sys.exc_info()
+                pack.finish(block, exc_info)
+                raise exc_info[0], exc_info[1], exc_info[2]
+            conn._tach_block = block
+            if isinstance(body, str):
+                pack.traffic(label).sent += len(body)
+
+        def instrumented_getresponse(conn, *args, **kwargs):
+            block = conn.__dict__.pop('_tach_block', None)
+            if block is None:
+                return getresponse(conn, *args, **kwargs)
+
+            try:
+                response = getresponse(conn, *args, **kwargs)
+            except BaseException:
+                exc_info = sys.exc_info()
+                pack.finish(block, exc_info)
+                raise exc_info[0], exc_info[1], exc_info[2]
+            pack.finish(block)
+            pack.responded(block.label, response)
+            return response
+
+        def instrumented_close(conn):
+            pack.discard(conn)
+            close(conn)
+
+        instrumented_request.tach_function = request
+        instrumented_getresponse.tach_function = getresponse
+        instrumented_close.tach_function = close
+        self.patch(httplib.HTTPConnection, 'request', instrumented_request)
+        self.patch(httplib.HTTPConnection, 'getresponse',
+                   instrumented_getresponse)
+        self.patch(httplib.HTTPConnection, 'close', instrumented_close)
+
+    def discard(self, conn):
+        """Abandon the request of a connection awaiting its response."""
+
+        block = conn.__dict__.pop('_tach_block', None)
+        if block is not None and self.method.meter:
+            self.method.meter.exit()
+
+    def responded(self, label, response):
+        """Count a response."""
+
+        if response.length:
+            self.traffic(label).received += response.length
+
+        entered = context.enter_internal()
+        try:
+            self.method.notifier(1, 'increment', '%s.status.%dxx' %
+                                 (label, response.status // 100))
+        finally:
+            if entered:
+                context.leave_internal()
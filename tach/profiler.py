@@ -0,0 +1,132 @@
+import os
+import sys
+import thread
+import time
+
+from tach import utils
+
+
+def _frame_name(frame):
+    """Name a frame for a collapsed stack."""
+
+    code = frame.f_code
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+class SamplingProfiler(object):
+    """Sample the stacks of threads running an instrumented method.
+
+    While running, a background thread takes a snapshot of the stack
+    of every thread "hz" times a second.  Only stacks with the
+    method's code on them are kept, and only the part of the stack
+    from the method inward, so the cost and output are proportional
+    to the method rather than the whole process.  When the capture
+    ends, the stacks are written in the collapsed format used by
+    flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, label, code, path, hz=100, duration=10,
+                 threshold=0, cooldown=300):
+        """Initialize the profiler.
+
+        :param label: The label of the method, used as the root of
+                      the stacks.
+        :param code: The code object of the method.
+        :param path: The file to write the stacks to; "{label}" and
+                     "{time}" are replaced by the label and the start
+                     time of the capture.
+        :param hz: The number of samples per second.
+        :param duration: How long, in seconds, each capture lasts.
+        :param threshold: Calls taking at least this many seconds
+                          trigger a capture; 0 to disable.
+        :param cooldown: The minimum time, in seconds, between the
+                         start of captures triggered by slow calls.
+        """
+
+        self.label = label
+        self.code = code
+        self.path = path
+        self.interval = 1.0 / hz
+        self.duration = duration
+        self.threshold = threshold or float('inf')
+        self.cooldown = cooldown
+
+        self.running = False
+        self.stacks = {}
+        self._start_time = None
+        self._stop_time = 0
+        self._next_trigger = 0
+
+    def trigger(self):
+        """Start a capture because of a slow call, unless cooling down."""
+
+        now = time.time()
+        if self.running or now < self._next_trigger:
+            return
+
+        self._next_trigger = now + self.cooldown
+        self.start()
+
+    def start(self, duration=None):
+        """Start a capture, or extend the one running."""
+
+        self._stop_time = time.time() + (duration or self.duration)
+        if self.running:
+            return
+
+        self.running = True
+        self._start_time = time.time()
+        self.stacks = {}
+        utils.spawn(self._run, utils.sleeper())
+
+    def stop(self):
+        """Stop the capture at the next sample."""
+
+        self._stop_time = 0
+
+    def sample(self, exclude=None):
+        """Take one sample of the threads running the method."""
+
+        for ident, frame in sys._current_frames().items():
+            if ident == exclude:
+                continue
+
+            # Walk outward until we find the method
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                if frame.f_code is self.code:
+                    break
+                frame = frame.f_back
+            else:
+                continue
+
+            names.append(self.label)
+            stack = ';'.join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def write(self):
+        """Write the collapsed stacks of the capture.
+
+        Returns the path written to.
+        """
+
+        path = self.path.format(label=self.label,
+                                time=int(self._start_time))
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (stack, count))
+
+        return path
+
+    def _run(self, sleep):
+        """Sampler thread loop."""
+
+        ident = thread.get_ident()
+        try:
+            while time.time() < self._stop_time:
+                self.sample(exclude=ident)
+                sleep(self.interval)
+            self.write()
+        finally:
+            self.running = False
@@ -0,0 +1,297 @@
+import bisect
+import errno
+import logging
+import os
+import re
+import socket
+
+from tach import utils
+
+
+LOG = logging.getLogger(__name__)
+
+# The default histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Characters not allowed in metric and label names
+_name_re = re.compile(r'[^a-zA-Z0-9_:]')
+
+_response = ('HTTP/1.0 %s\r\n'
+             'Content-Type: text/plain; version=0.0.4\r\n'
+             'Content-Length: %d\r\n'
+             'Connection: close\r\n'
+             '\r\n%s')
+
+
+def _escape(value):
+    """Escape a label value."""
+
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _number(value):
+    """Format a sample value."""
+
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter(object):
+    """A counter, accumulating increments."""
+
+    kind = 'counter'
+    suffix = '_total'
+
+    def __init__(self, name, labels, buckets):
+        """Initialize the series.
+
+        :param name: The metric name.
+        :param labels: The rendered label set, or ''.
+        :param buckets: The histogram buckets; unused.
+        """
+
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def observe(self, value):
+        """Record a value."""
+
+        self.value += value
+
+    def lines(self):
+        """Return the sample lines."""
+
+        return ['%s%s %s' % (self.name, self.labels, _number(self.value))]
+
+
+class Gauge(Counter):
+    """A gauge, keeping the last value."""
+
+    kind = 'gauge'
+    suffix = ''
+
+    def observe(self, value):
+        """Record a value."""
+
+        self.value = value
+
+
+class Histogram(object):
+    """A histogram of execution times."""
+
+    kind = 'histogram'
+    suffix = '_seconds'
+
+    def __init__(self, name, labels, buckets):
+        """Initialize the series.
+
+        :param name: The metric name.
+        :param labels: The rendered label set, or ''.
+        :param buckets: The sorted upper bounds of the buckets.
+        """
+
+        self.name = name
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+        # Pre-render the label text of each bucket
+        inner = labels[1:-1] + ',' if labels else ''
+        self.labels = labels
+        self._bucket_labels = ['{%sle="%s"}' % (inner, _number(bound))
+                               for bound in buckets + (float('inf'),)]
+
+    def observe(self, value):
+        """Record a value."""
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self):
+        """Return the sample lines, with cumulative bucket counts."""
+
+        lines = []
+        total = 0
+        for labels, count in zip(self._bucket_labels, self.counts):
+            total += count
+            lines.append('%s_bucket%s %d' % (self.name, labels, total))
+        lines.append('%s_sum%s %s' % (self.name, self.labels,
+                                      _number(self.sum)))
+        lines.append('%s_count%s %d' % (self.name, self.labels, self.count))
+        return lines
+
+
+# The kind of series for each value type; others are gauges
+KINDS = {
+    'exec_time': Histogram,
+    'increment': Counter,
+    }
+
+
+class Registry(object):
+    """Collect metrics in memory, for scraping in the text format.
+
+    Execution times are kept as histograms, increments as counters,
+    and everything else as gauges; None values are ignored.  Each
+    label and tag set is a series; beyond max_series series, new ones
+    are dropped.  Series whose names and labels are the same once
+    sanitized are merged, unless they are of different kinds, in
+    which case the later name gets a numeric suffix.  The text is
+    rendered again only if a metric changed since the last scrape.
+    """
+
+    def __init__(self, namespace='tach', buckets=BUCKETS, max_series=10000):
+        """Initialize the registry.
+
+        :param namespace: The prefix of the metric names.
+        :param buckets: The upper bounds of the histogram buckets.
+        :param max_series: The maximum number of series.
+        """
+
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self.max_series = max_series
+        self.dropped = 0
+
+        self._series = {}
+        self._by_name = {}
+        self._kinds = {}
+        self._lock = utils.original('thread', 'allocate_lock')()
+        self._dirty = False
+        self._text = ''
+
+    def observe(self, value, vtype, label, tags=None):
+        """Record a metric."""
+
+        if value is None:
+            return
+
+        key = (label, vtype, tags)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                if len(self._series) >= self.max_series:
+                    self.dropped += 1
+                    return
+                series = self._series[key] = self._new_series(vtype, label,
+                                                              tags)
+            series.observe(value)
+            self._dirty = True
+
+    def _new_series(self, vtype, label, tags):
+        """Build a new series."""
+
+        cls = KINDS.get(vtype, Gauge)
+        base = _name_re.sub('_', '%s_%s' % (self.namespace, label))
+        labels = ''
+        if tags:
+            labels = '{%s}' % ','.join('%s="%s"' % (_name_re.sub('_', key),
+                                                    _escape(value))
+                                       for key, value in tags)
+
+        # A name belongs to one kind of series
+        name = base + cls.suffix
+        count = 1
+        while self._kinds.setdefault(name, cls.kind) != cls.kind:
+            count += 1
+            name = '%s_%d%s' % (base, count, cls.suffix)
+
+        series = self._by_name.get((name, labels))
+        if series is None:
+            series = self._by_name[(name, labels)] = cls(name, labels,
+                                                         self.buckets)
+        return series
+
+    def render(self):
+        """Return the metrics in the Prometheus text format."""
+
+        if not self._dirty:
+            return self._text
+
+        with self._lock:
+            self._dirty = False
+            samples = sorted((series.name, series.labels, series.kind,
+                              series.lines())
+                             for series in self._by_name.values())
+
+        lines = []
+        last_name = None
+        for name, _labels, kind, series_lines in samples:
+            if name != last_name:
+                lines.append('# TYPE %s %s' % (name, kind))
+                last_name = name
+            lines.extend(series_lines)
+        self._text = ''.join(line + '\n' for line in lines)
+
+        return self._text
+
+
+def listen(port=None, host='127.0.0.1', unix_socket=None):
+    """Return a listening socket for the scrape endpoint.
+
+    The socket is never a green socket, since it is served from a
+    native thread.
+    """
+
+    factory = utils.original('socket', 'socket')
+    if unix_socket:
+        try:
+            os.unlink(unix_socket)
+        except OSError:
+            pass
+        sock = factory(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(unix_socket)
+    else:
+        sock = factory(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+    sock.listen(16)
+    return sock
+
+
+def serve(sock, registry):
+    """Serve scrapes of a registry until the socket is closed."""
+
+    while True:
+        try:
+            conn, _address = sock.accept()
+        except socket.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            return
+
+        try:
+            handle(conn, registry)
+        except Exception:
+            LOG.exception("Error serving a scrape")
+        finally:
+            conn.close()
+
+
+def handle(conn, registry):
+    """Answer one HTTP request."""
+
+    conn.settimeout(5)
+    request = ''
+    while '\r\n\r\n' not in request and '\n\n' not in request:
+        data = conn.recv(4096)
+        if not data or len(request) > 65536:
+            break
+        request += data
+
+    parts = request.split(None, 2)
+    if len(parts) >= 2 and parts[0] in ('GET', 'HEAD') and (
+            parts[1].split('?')[0] in ('/', '/metrics')):
+        status, body = '200 OK', registry.render()
+    else:
+        status, body = '404 Not Found', 'Not found\n'
+
+    if parts and parts[0] == 'HEAD':
+        conn.sendall(_response % (status, len(body), ''))
+    else:
+        conn.sendall(_response % (status, len(body), body))
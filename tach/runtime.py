@@ -0,0 +1,173 @@
+import gc
+import os
+import threading
+import time
+
+from tach import context
+from tach import utils
+
+
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss():
+    """Return the resident set size of the process, in bytes, or None."""
+
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * _page_size
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+def threads():
+    """Return the number of threads of the process.
+
+    Read from /proc where available, since threading.active_count()
+    misses threads not started through threading, such as those of
+    thread.start_new_thread().
+    """
+
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except (IOError, IndexError, ValueError):
+        pass
+    return threading.active_count()
+
+
+def open_fds():
+    """Return the number of open file descriptors, or None."""
+
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+class GCStats(object):
+    """Garbage collections of one generation since the last report."""
+
+    __slots__ = ('collections', 'collected', 'pause', 'pause_max')
+
+    def __init__(self):
+        self.collections = 0
+        self.collected = 0
+        self.pause = 0.0
+        self.pause_max = 0.0
+
+
+class RuntimeCollector(object):
+    """Report interpreter and process metrics periodically.
+
+    Every interval seconds, reports gauges under the label: rss
+    (bytes), threads, fds, and gc.gen<N>.count, the counts of
+    gc.get_count(): for generation 0, allocations less deallocations
+    since it was last collected, and for older generations, the
+    collections of the next younger generation since then; they are
+    the counts compared to gc.get_threshold().  Where the interpreter
+    has gc.callbacks, each generation's collections are also timed,
+    reporting increments under gc.gen<N>.collections and
+    gc.gen<N>.collected, and gauges under gc.gen<N>.pause (the total
+    pause, in seconds) and gc.gen<N>.pause_max.  A pause during an
+    instrumented call, with spans enabled, is also added to the
+    "<span label>.gc_pause" gauge.
+    """
+
+    def __init__(self, config, options):
+        """Initialize the collector.
+
+        :param config: The global configuration; needed for the
+                       notifier.
+        :param options: A dictionary of the [global] options: the
+                        "runtime_interval" (default 10 seconds),
+                        "runtime_label" (default "tach.runtime") and
+                        "runtime_notifier" (default notifier).
+        """
+
+        self.config = config
+        self.interval = float(options.get('runtime_interval', 10))
+        self.label = options.get('runtime_label', 'tach.runtime')
+        self._notifier = options.get('runtime_notifier')
+        self.max_pause_labels = int(options.get('max_labels', 1000))
+
+        self._generations = [GCStats() for _i in range(3)]
+        self._pauses = {}
+        self._start = None
+        self._span = None
+
+    def start(self):
+        """Start collecting."""
+
+        if hasattr(gc, 'callbacks'):
+            gc.callbacks.append(self._gc_callback)
+        utils.ticker.every(self.interval, self.report)
+
+    def stop(self):
+        """Stop collecting."""
+
+        if hasattr(gc, 'callbacks') and self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+        utils.ticker.cancel(self.report)
+
+    def _gc_callback(self, phase, info):
+        """Time a garbage collection.
+
+        Collections run in the thread that triggered them, so the
+        current span is the call that was paused.
+        """
+
+        if phase == 'start':
+            self._start = time.time()
+            self._span = context.current_span()
+            return
+
+        if self._start is None:
+            return
+        pause = time.time() - self._start
+        self._start = None
+
+        stats = self._generations[info['generation']]
+        stats.collections += 1
+        stats.collected += info.get('collected', 0)
+        stats.pause += pause
+        stats.pause_max = max(stats.pause_max, pause)
+
+        # Attribute the pause to the call it interrupted
+        span, self._span = self._span, None
+        if span is not None:
+            if (span.label in self._pauses or
+                    len(self._pauses) < self.max_pause_labels):
+                self._pauses[span.label] = (
+                    self._pauses.get(span.label, 0.0) + pause)
+
+    def report(self):
+        """Report the metrics collected since the last report."""
+
+        notifier = self.config.notifier(self._notifier, nonblocking=True)
+        label = self.label
+
+        for name, value in (('rss', rss()),
+                            ('threads', threads()),
+                            ('fds', open_fds())):
+            if value is not None:
+                notifier(value, 'gauge', '%s.%s' % (label, name))
+
+        generations = self._generations
+        self._generations = [GCStats() for _i in generations]
+        for gen, (count, stats) in enumerate(zip(gc.get_count(),
+                                                 generations)):
+            prefix = '%s.gc.gen%d' % (label, gen)
+            notifier(count, 'gauge', prefix + '.count')
+            if stats.collections:
+                notifier(stats.collections, 'increment',
+                         prefix + '.collections')
+                notifier(stats.collected, 'increment', prefix + '.collected')
+                notifier(stats.pause, 'gauge', prefix + '.pause')
+                notifier(stats.pause_max, 'gauge', prefix + '.pause_max')
+
+        pauses, self._pauses = self._pauses, {}
+        for span_label, pause in pauses.iteritems():
+            notifier(pause, 'gauge', span_label + '.gc_pause')
@@ -0,0 +1,264 @@
+import json
+import os
+import struct
+import sys
+import time
+
+from tach import utils
+
+
+# Each record is its length, as a 4-byte big-endian integer, followed
+# by the formatted metric
+_header = struct.Struct('>I')
+
+_suffix = '.seg'
+
+
+class Spool(object):
+    """Append-only log of formatted metrics that couldn't be sent.
+
+    The log is a directory of segment files, each holding
+    length-prefixed records.  Records are appended to the newest
+    segment, which is rotated once it reaches segment_size bytes;
+    beyond max_bytes, the oldest segments are discarded.  Records are
+    replayed oldest first, and a segment is removed once it has been
+    replayed.  Replay is at least once: a record may be replayed again
+    if the process stops in the middle of a segment.
+    """
+
+    def __init__(self, path, segment_size=1048576, max_bytes=67108864,
+                 meta=None):
+        """Initialize the spool.
+
+        :param path: The spool directory, created if necessary.
+        :param segment_size: The size, in bytes, of each segment.
+        :param max_bytes: The size, in bytes, of all the segments.
+        :param meta: An optional dict describing the notifier the
+                     records are formatted for, saved as meta.json so
+                     "tach replay" can replay them.
+        """
+
+        self.path = path
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.discarded = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if meta is not None:
+            with open(os.path.join(path, 'meta.json'), 'w') as fp:
+                json.dump(meta, fp)
+
+        # Pick up segments left by earlier runs
+        self._total = sum(os.path.getsize(segment)
+                          for segment in self.segments())
+        self._seq = max([int(os.path.basename(segment)[:-len(_suffix)])
+                         for segment in self.segments()] or [0])
+        self._file = None
+        self._size = 0
+
+        # Where the replay stopped
+        self._replay_segment = None
+        self._replay_offset = 0
+
+        allocate_lock = utils.original('thread', 'allocate_lock')
+        self._lock = allocate_lock()
+        self._replay_lock = allocate_lock()
+
+    def segments(self):
+        """Return the paths of the segments, oldest first."""
+
+        return sorted(os.path.join(self.path, name)
+                      for name in os.listdir(self.path)
+                      if name.endswith(_suffix))
+
+    def __len__(self):
+        """Return the number of bytes spooled."""
+
+        return self._total
+
+    def append(self, body):
+        """Append a record."""
+
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        record = _header.pack(len(body)) + body
+
+        with self._lock:
+            if not self._file:
+                self._seq += 1
+                self._file = open(os.path.join(
+                        self.path, '%016d%s' % (self._seq, _suffix)), 'ab')
+                self._size = 0
+
+            self._file.write(record)
+            self._size += len(record)
+            self._total += len(record)
+
+            if self._size >= self.segment_size:
+                self._close()
+            if self._total > self.max_bytes:
+                self._discard()
+
+    def flush(self):
+        """Flush the newest segment to disk."""
+
+        with self._lock:
+            if self._file:
+                self._file.flush()
+
+    def _close(self):
+        """Close the newest segment, without locking."""
+
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _discard(self):
+        """Discard the oldest segments to honor max_bytes."""
+
+        for segment in self.segments():
+            if self._total <= self.max_bytes:
+                break
+            if self._file and segment == self._file.name:
+                break
+            self._remove(segment)
+            self.discarded += 1
+
+    def _remove(self, segment):
+        """Remove a segment, accounting for its size."""
+
+        try:
+            size = os.path.getsize(segment)
+            os.remove(segment)
+        except OSError:
+            # Already removed
+            return
+        self._total -= size
+        if segment == self._replay_segment:
+            self._replay_segment = None
+            self._replay_offset = 0
+
+    def replay(self, deliver, limit=None):
+        """Replay records, oldest first.
+
+        Stops at the first record deliver() fails on, which is kept
+        for the next replay.
+
+        :param deliver: A function sending a record, returning True
+                        if it was sent.
+        :param limit: The maximum number of records to replay.
+
+        :returns: The number of records replayed.
+        """
+
+        count = 0
+        with self._replay_lock:
+            while limit is None or count < limit:
+                segments = self.segments()
+                if not segments:
+                    break
+
+                # Make the newest segment replayable
+                with self._lock:
+                    if self._file and segments[0] == self._file.name:
+                        self._close()
+
+                segment = segments[0]
+                if segment != self._replay_segment:
+                    self._replay_segment = segment
+                    self._replay_offset = 0
+
+                replayed, done = self._replay_segment_records(
+                    segment, deliver, None if limit is None
+                    else limit - count)
+                count += replayed
+                if not done:
+                    break
+                with self._lock:
+                    self._remove(segment)
+
+        return count
+
+    def _replay_segment_records(self, segment, deliver, limit):
+        """Replay records from one segment.
+
+        :returns: The number of records replayed, and whether the
+                  segment is done with.
+        """
+
+        count = 0
+        try:
+            fp = open(segment, 'rb')
+        except IOError:
+            # Discarded in the meantime
+            return count, True
+
+        with fp:
+            fp.seek(self._replay_offset)
+            for body in read_records(fp):
+                if limit is not None and count >= limit:
+                    return count, False
+                if not deliver(body):
+                    return count, False
+                count += 1
+                self._replay_offset = fp.tell()
+
+        return count, True
+
+
+def read_records(fp):
+    """Read the records of a segment file.
+
+    A truncated record, left by a crash while writing, ends the
+    segment.
+    """
+
+    while True:
+        header = fp.read(_header.size)
+        if len(header) < _header.size:
+            return
+        length, = _header.unpack(header)
+        body = fp.read(length)
+        if len(body) < length:
+            return
+        yield body
+
+
+def replay(path, rate=1000, retries=10, out=sys.stdout):
+    """Replay a spool to the notifier it was written for.
+
+    Records are sent at most rate per second.  If the server can't
+    be reached, delivery is retried with exponential backoff, up to
+    retries times in a row.
+
+    :returns: The number of records replayed.
+    """
+
+    with open(os.path.join(path, 'meta.json')) as fp:
+        meta = json.load(fp)
+    cls = utils.import_class_or_module(meta['driver'])
+    driver = cls(meta['options'])
+    spool = Spool(path)
+
+    total = failures = 0
+    while spool.segments():
+        start = time.time()
+        count = spool.replay(driver.deliver, rate)
+        total += count
+
+        if count < rate and spool.segments():
+            # Delivery failed
+            failures += 1
+            if failures > retries:
+                print >>out, ("Giving up after %d records; the rest are "
+                              "left in %s" % (total, path))
+                break
+            time.sleep(min(0.5 * 2 ** (failures - 1), 30))
+            continue
+
+        failures = 0
+        print >>out, "Replayed %d records" % total
+        time.sleep(max(1.0 - (time.time() - start), 0))
+
+    return total
@@ -0,0 +1,114 @@
+import inspect
+import sys
+import time
+
+
+def is_stream(obj):
+    """Determine whether a return value is produced lazily.
+
+    Generators and iterables with a close() method, such as WSGI
+    application iterables, qualify; strings and containers do not,
+    since they are fully built by the time they are returned, and
+    neither do other iterators, which may be anything from a cursor to
+    a file.
+    """
+
+    if isinstance(obj, (basestring, list, tuple, dict, set)):
+        return False
+
+    return (inspect.isgenerator(obj) or
+            (hasattr(obj, '__iter__') and hasattr(obj, 'close')))
+
+
+class TimedIterable(object):
+    """Wrap an iterable to time its consumption.
+
+    Items are passed through one at a time, never buffered.  Once the
+    iterable is exhausted or closed, the finish callback is called
+    with the time from the start of the call to the first item (None
+    if there was none), the number of items, and the number of bytes
+    in string items, unicode items counting as UTF-8.  If iteration
+    raises an exception, the error callback is called with the
+    exception class instead.  Other attributes are those of the
+    wrapped iterable.
+    """
+
+    def __init__(self, iterable, start, finish, error=None):
+        """Initialize the wrapper.
+
+        :param iterable: The iterable to wrap.
+        :param start: The time the call producing the iterable
+                      started.
+        :param finish: A callable to invoke when iteration is over.
+        :param error: An optional callable to invoke when iteration
+                      fails.
+        """
+
+        self._iterable = iterable
+        self._iterator = None
+        self._start = start
+        self._finish = finish
+        self._error = error
+        self._first = None
+        self._items = 0
+        self._bytes = 0
+        self._done = False
+
+    def __iter__(self):
+        """Start iterating."""
+
+        if self._iterator is None:
+            self._iterator = iter(self._iterable)
+
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._iterable, name)
+
+    def next(self):
+        """Return the next item."""
+
+        if self._iterator is None:
+            self._iterator = iter(self._iterable)
+
+        try:
+            item = next(self._iterator)
+        except StopIteration:
+            self._complete()
+            raise
+        except BaseException:
+            exc_info = sys.exc_info()
+            if not self._done:
+                self._done = True
+                if self._error:
+                    self._error(exc_info[0])
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        if self._first is None:
+            self._first = time.time() - self._start
+        self._items += 1
+        if isinstance(item, str):
+            self._bytes += len(item)
+        elif isinstance(item, unicode):
+            self._bytes += len(item.encode('utf-8'))
+
+        return item
+
+    __next__ = next
+
+    def close(self):
+        """Close the underlying iterable, as WSGI requires."""
+
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close:
+                close()
+        finally:
+            self._complete()
+
+    def _complete(self):
+        """Report the statistics, once."""
+
+        if not self._done:
+            self._done = True
+            self._finish(self._first, self._items, self._bytes)
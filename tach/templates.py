@@ -0,0 +1,192 @@
+import re
+
+
+# A field names a value reachable from the call arguments, such as
+# "args[1].environ[PATH_INFO]", optionally followed by filters, such
+# as ":seg(2):lower"
+_field_re = re.compile(r'\{([^{}]*)\}')
+_root_re = re.compile(r'(args|kwargs)')
+_accessor_re = re.compile(r'\[([^\[\]]+)\]|\.([A-Za-z_]\w*)')
+_filter_re = re.compile(r'^([A-Za-z_]\w*)(?:\((.*)\))?$')
+
+
+def _seg(value, index):
+    """Return a segment of a slash-separated path, or ''."""
+
+    try:
+        return value.split('/')[index]
+    except IndexError:
+        return ''
+
+
+def _default(value, default):
+    """Return the value, or a default if it is empty."""
+
+    return value or default
+
+
+# Filters take the value, as a string, and their argument, if any
+FILTERS = {
+    'seg': _seg,
+    'lower': lambda value: value.lower(),
+    'upper': lambda value: value.upper(),
+    'default': _default,
+}
+
+# How the arguments of the filters taking one are converted, when the
+# template is compiled
+FILTER_ARGS = {
+    'seg': int,
+    'default': str,
+}
+
+
+def _to_str(value):
+    """Convert a raw value to a string, encoding unicode as UTF-8."""
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _compile_expression(expr):
+    """Translate a field expression into Python source."""
+
+    match = _root_re.match(expr)
+    if not match:
+        raise ValueError("Field %r must start with args or kwargs" % expr)
+
+    source = [match.group(1)]
+    pos = match.end()
+    while pos < len(expr):
+        match = _accessor_re.match(expr, pos)
+        if not match:
+            raise ValueError("Cannot parse field %r at %r" %
+                             (expr, expr[pos:]))
+        index, attr = match.groups()
+        if attr:
+            source.append('.' + attr)
+        elif re.match(r'^-?\d+$', index):
+            source.append('[%d]' % int(index))
+        else:
+            source.append('[%r]' % index.strip('\'"'))
+        pos = match.end()
+
+    return ''.join(source)
+
+
+def _compile_filter(spec):
+    """Translate a filter specification into a callable."""
+
+    match = _filter_re.match(spec.strip())
+    if not match or match.group(1) not in FILTERS:
+        raise ValueError("Unknown filter %r" % spec)
+
+    name = match.group(1)
+    func = FILTERS[name]
+    if (match.group(2) is None) != (name not in FILTER_ARGS):
+        raise ValueError("Filter %r takes %s argument" %
+                         (spec, 'one' if name in FILTER_ARGS else 'no'))
+    if match.group(2) is None:
+        return func
+
+    try:
+        arg = FILTER_ARGS[name](match.group(2).strip('\'"'))
+    except ValueError:
+        raise ValueError("Invalid argument to filter %r" % spec)
+    return lambda value: func(value, arg)
+
+
+class LabelTemplate(object):
+    """Build labels from call arguments without an app helper.
+
+    A template such as
+
+        nova.api.{args[1].environ[PATH_INFO]:seg(2)}.{kwargs[action]}
+
+    is parsed once.  The field expressions are compiled into a single
+    function extracting the raw values from the arguments, and the
+    label rendered for each distinct tuple of values, as strings, is
+    memoized, so a repeated label costs one extraction, one string
+    conversion per field and one dictionary lookup.  At most
+    cache_size labels are memoized; no argument objects are kept.
+    """
+
+    def __init__(self, template, cache_size=1000):
+        """Parse and compile the template.
+
+        Raises ValueError if the template cannot be parsed, or a
+        filter is given an invalid argument.
+        """
+
+        self.template = template
+        self.cache_size = cache_size
+        self._cache = {}
+
+        # Split the template into literals and fields
+        self._parts = []
+        exprs = []
+        pos = 0
+        for match in _field_re.finditer(template):
+            if match.start() > pos:
+                self._parts.append(template[pos:match.start()])
+
+            spec = match.group(1).split(':')
+            exprs.append(_compile_expression(spec[0].strip()))
+            filters = [_compile_filter(f) for f in spec[1:]]
+            self._parts.append((len(exprs) - 1, filters))
+            pos = match.end()
+        if pos < len(template):
+            self._parts.append(template[pos:])
+
+        # Compile the extractor
+        source = 'lambda args, kwargs: (%s)' % ''.join(
+            expr + ', ' for expr in exprs)
+        self._extract = eval(compile(source, '<label_template>', 'eval'),
+                             {})
+
+    def render(self, args, kwargs):
+        """Render the label for a call.
+
+        Returns None if a value cannot be extracted from the
+        arguments, or the label cannot be rendered from it, so the
+        caller falls back to its own label.
+        """
+
+        try:
+            values = tuple(_to_str(value)
+                           for value in self._extract(args, kwargs))
+        except Exception:
+            return None
+
+        try:
+            return self._cache[values]
+        except KeyError:
+            pass
+
+        try:
+            label = self._render(values)
+        except Exception:
+            return None
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[values] = label
+
+        return label
+
+    def _render(self, values):
+        """Render the label from the values, as strings."""
+
+        parts = []
+        for part in self._parts:
+            if isinstance(part, basestring):
+                parts.append(part)
+                continue
+
+            index, filters = part
+            value = values[index]
+            for func in filters:
+                value = func(value)
+            parts.append(value)
+
+        return ''.join(parts)
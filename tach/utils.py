@@ -1,8 +1,17 @@
+import bisect
+import hashlib
 import imp
+import logging
 import os
 import sys
+import time
 import traceback
 
+from tach import context
+
+
+LOG = logging.getLogger(__name__)
+
 
 def import_class_or_module(klass_str):
     """Import a named class or module."""
@@ -25,3 +34,203 @@ def import_class_or_module(klass_str):
             except (ImportError, ValueError, AttributeError), exc:
                 raise Exception("Could not load class %s\n%s" % (klass,
                                                 traceback.format_exc(exc)))
+
+
+def green_library():
+    """Identify the green thread library in control of the process.
+
+    Returns "eventlet" or "gevent" if that library has monkey-patched
+    the threading machinery, or None if threads are native.
+    """
+
+    patcher = sys.modules.get('eventlet.patcher')
+    if patcher and patcher.is_monkey_patched('thread'):
+        return 'eventlet'
+
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey and monkey.is_module_patched('threading'):
+        return 'gevent'
+
+    return None
+
+
+# Attributes replaced by instrumentation packs, by object and
+# attribute name, with their original values
+instrumented = {}
+
+
+def uninstrumented(obj, attr):
+    """Retrieve an attribute as it was before tach instrumented it."""
+
+    try:
+        return instrumented[(obj, attr)]
+    except KeyError:
+        return getattr(obj, attr)
+
+
+def original(module, attr):
+    """Retrieve a module attribute as it was before monkey-patching.
+
+    Returns the attribute unchanged if no green thread library is
+    active, except for tach's own instrumentation.
+    """
+
+    library = green_library()
+    if library == 'eventlet':
+        from eventlet import patcher
+        return getattr(patcher.original(module), attr)
+    elif library == 'gevent':
+        from gevent import monkey
+        return monkey.get_original(module, attr)
+
+    __import__(module)
+    return uninstrumented(sys.modules[module], attr)
+
+
+def spawn(func, *args, **kwargs):
+    """Run a function in the background.
+
+    By default, the function runs in a native OS thread, even if the
+    process has been monkey-patched, so it can neither stall nor be
+    stalled by the green thread hub.  Pass green=True to run it in a
+    green thread instead, when a green thread library is active.  The
+    thread is marked as doing tach's own work.
+    """
+
+    library = green_library() if kwargs.get('green') else None
+    if library == 'eventlet':
+        import eventlet
+        eventlet.spawn_n(_run_internal, func, args)
+    elif library == 'gevent':
+        import gevent
+        gevent.spawn(_run_internal, func, args)
+    else:
+        original('thread', 'start_new_thread')(_run_internal, (func, args))
+
+
+def _run_internal(func, args):
+    """Run a function, marked as doing tach's own work."""
+
+    context.enter_internal()
+    try:
+        func(*args)
+    finally:
+        context.leave_internal()
+
+
+def sleeper(green=False):
+    """Return the sleep function matching spawn()."""
+
+    library = green_library() if green else None
+    if library == 'eventlet':
+        import eventlet
+        return eventlet.sleep
+    elif library == 'gevent':
+        import gevent
+        return gevent.sleep
+
+    return original('time', 'sleep')
+
+
+class Ticker(object):
+    """Run periodic tasks from a single background thread.
+
+    The thread is started when the first task is registered.
+    """
+
+    def __init__(self, resolution=0.1):
+        """Initialize the ticker.
+
+        :param resolution: How often, in seconds, to check for due
+                           tasks.
+        """
+
+        self.resolution = resolution
+        self._tasks = []
+        self._started = False
+
+    def every(self, interval, func):
+        """Call func every interval seconds."""
+
+        self._tasks.append([interval, time.time() + interval, func])
+
+        if not self._started:
+            self.start()
+
+    def cancel(self, func):
+        """Stop calling func."""
+
+        self._tasks = [task for task in self._tasks if task[2] != func]
+
+    def start(self):
+        """Start the background thread."""
+
+        self._started = True
+        spawn(self._run, sleeper())
+
+    def tick(self, now=None):
+        """Run all the tasks that are due."""
+
+        if now is None:
+            now = time.time()
+
+        for task in self._tasks:
+            interval, due, func = task
+            if now < due:
+                continue
+
+            task[1] = now + interval
+            try:
+                func()
+            except Exception:
+                LOG.exception("Ticker: Error running periodic task %r" %
+                              func)
+
+    def _run(self, sleep):
+        """Background thread loop."""
+
+        while True:
+            sleep(self.resolution)
+            self.tick()
+
+
+# The ticker shared by all of tach's periodic tasks
+ticker = Ticker()
+
+
+class HashRing(object):
+    """Map keys to nodes by consistent hashing.
+
+    Each node is placed on the ring at several points, so keys spread
+    evenly, and adding or removing a node only moves the keys mapped
+    to that node.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        """Initialize the ring.
+
+        :param nodes: A list of name, node pairs.  The name places
+                      the node on the ring, so the same names give
+                      the same mapping.
+        :param replicas: The number of points for each node.
+        """
+
+        points = sorted((self._hash('%s-%d' % (name, i)), idx)
+                        for idx, (name, _node) in enumerate(nodes)
+                        for i in range(replicas))
+        self._hashes = [point for point, _idx in points]
+        self._nodes = [nodes[idx][1] for _point, idx in points]
+
+    @staticmethod
+    def _hash(key):
+        """Hash a key to a point on the ring."""
+
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+    def get(self, key):
+        """Return the node a key maps to."""
+
+        idx = bisect.bisect(self._hashes, self._hash(key))
+        return self._nodes[idx % len(self._nodes)]
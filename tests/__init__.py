@@ -1,8 +1,10 @@
+import itertools
 import logging
 import unittest2 as unittest
 
 import stubout
 
+from tach import context
 from tach import utils
 
 
@@ -17,6 +19,10 @@ class TestCase(unittest.TestCase):
 
         self.stubs.Set(utils, 'import_class_or_module', fake_import)
 
+        # Start every test with a fresh transaction context
+        self.stubs.Set(context, '_transaction_ids', itertools.count(1))
+        context.set_transaction_id(None)
+
     def tearDown(self):
         self.stubs.UnsetAll()
 
@@ -1,2 +1,15 @@
 def function(*args, **kwargs):
     return 'function', dict(args=args, kwargs=kwargs)
+
+
+def generator(*args, **kwargs):
+    for arg in args:
+        yield arg
+
+
+def failure(exc):
+    raise exc
+
+
+def outer(*args, **kwargs):
+    return function(*args, **kwargs)
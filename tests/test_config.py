@@ -1,10 +1,15 @@
 import ConfigParser
 import inspect
+import itertools
 import StringIO
+import threading
 
 from tach import config
+from tach import exemplars
+from tach import labels
 from tach import metrics
 from tach import notifiers
+from tach import utils
 
 import tests
 from tests import fake_module
@@ -13,7 +18,7 @@ from tests import fake_module
 class FakeConfig(object):
     _notifier = None
 
-    def notifier(self, name):
+    def notifier(self, name, nonblocking=False):
         if not self._notifier:
             self._notifier = FakeNotifier(self)
         return self._notifier
@@ -68,6 +73,10 @@ class FakeHelper(object):
         new_args = [kwargs[k] for k in sorted(kwargs)]
         return new_args, new_kwargs, 'fake_label'
 
+    @staticmethod
+    def fake_summary(*args, **kwargs):
+        return 'summary of %d args' % len(args)
+
 
 class FakeSubConfig(object):
     def __init__(self, cfg, label, items, **kwargs):
@@ -82,6 +91,10 @@ class FakeSubConfig(object):
             self.driver = self.items.get('driver', '__default__')
         else:
             self.label = label
+        self.kwargs = kwargs
+
+    def get(self, key, default=None):
+        return self.items.get(key, default)
 
 
 class TestConfig(tests.TestCase):
@@ -111,6 +124,40 @@ driver=default_driver
 driver=foo_driver
 """,
         'blank_config': "",
+        'global_config': """
+[global]
+app_helper=helper
+spans=1
+runtime_interval=30
+exemplar_path=/tmp/exemplars
+
+[foo.bar]
+desc=a typical method
+""",
+        'runtime_config': """
+[global]
+runtime=1
+runtime_interval=30
+""",
+        'nomethod_config': """
+[fake]
+module=FakeClass
+metric=FakeMetric
+""",
+        'signal_config': """
+[global]
+profile_signal=sigusr2
+""",
+        'pack_config': """
+[pack:dbapi]
+modules=sqlite3
+""",
+        'pattern_config': """
+[fake]
+module=FakeClass
+method=*_method
+metric=FakeMetric
+""",
         }
 
     def setUp(self):
@@ -185,6 +232,76 @@ driver=foo_driver
         self.assertEqual(cfg.notifiers[None].label, '')
         self.assertEqual(cfg.notifiers[None].items, {})
 
+    def test_init_global(self):
+        cfg = config.Config('global_config')
+
+        self.assertEqual(cfg.methods['foo.bar'].kwargs, dict(
+                app_helper='helper',
+                defaults=dict(spans='1'),
+                label_budget=cfg.label_budget))
+        self.assertEqual(cfg.label_budget.limit, 10000)
+
+    def test_init_pattern(self):
+        self.stubs.Set(config, '_expansions', {})
+        self.imports = {'FakeClass': FakeClass}
+        cfg = config.Config('pattern_config')
+
+        self.assertEqual(sorted(cfg.methods), [
+                'fake.class_method', 'fake.instance_method',
+                'fake.static_method'])
+        method = cfg.methods['fake.class_method']
+        self.assertEqual(method.items, dict(
+                module='FakeClass', method='class_method',
+                metric='FakeMetric'))
+        self.assertIs(method.kwargs['shared'],
+                      cfg.methods['fake.static_method'].kwargs['shared'])
+
+    def test_init_missing_method(self):
+        # Method reports the missing option
+        cfg = config.Config('nomethod_config')
+
+        self.assertEqual(cfg.methods['fake'].items, dict(
+                module='FakeClass', metric='FakeMetric'))
+
+    def test_init_signal_thread(self):
+        logged = []
+        self.stubs.Set(config.LOG, 'error', logged.append)
+        thread = threading.Thread(target=config.Config,
+                                  args=('signal_config',))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(len(logged), 1)
+        self.assertTrue(logged[0].startswith(
+                "Could not handle signal sigusr2: "))
+
+    def test_init_runtime(self):
+        started = []
+        self.stubs.Set(config.runtime.RuntimeCollector, 'start',
+                       lambda collector: started.append(collector))
+        cfg = config.Config('runtime_config')
+
+        self.assertEqual(started, [cfg.runtime])
+        self.assertEqual(cfg.runtime.interval, 30.0)
+        self.assertIs(cfg.runtime.config, cfg)
+        self.assertIsNone(config.Config('blank_config').runtime)
+
+    def test_init_pack(self):
+        loaded = []
+
+        def fake_load(cfg, label, items):
+            loaded.append((label, items))
+            pack = FakeSubConfig(cfg, label, items)
+            pack.name = 'dbapi'
+            return pack
+
+        self.stubs.Set(config.packs, 'load', fake_load)
+        cfg = config.Config('pack_config')
+
+        self.assertEqual(loaded, [('pack:dbapi', [('modules', 'sqlite3')])])
+        self.assertEqual(cfg.packs.keys(), ['dbapi'])
+        self.assertEqual(cfg.methods, {})
+
     def test_notifier(self):
         cfg = config.Config('notifier_config')
         result = cfg.notifier('foo')
@@ -203,6 +320,57 @@ driver=foo_driver
 
         self.assertEqual(result, '__default__')
 
+    def test_notifier_fanout(self):
+        cfg = config.Config('blank_config')
+        cfg.notifiers = {
+            'foo': FakeSubConfig(cfg, 'notifier:foo', []),
+            None: FakeSubConfig(cfg, 'notifier', []),
+            }
+        for notifier in cfg.notifiers.values():
+            notifier.driver = FakeNotifier(cfg)
+        result = cfg.notifier('foo, bar')
+
+        self.assertIsInstance(result, notifiers.AsyncNotifier)
+        self.assertIsInstance(result.driver, notifiers.FanoutNotifier)
+        self.assertEqual(result.driver.drivers, [
+                cfg.notifiers['foo'].driver, cfg.notifiers[None].driver])
+        self.assertIs(cfg.notifier('foo, bar', nonblocking=True), result)
+
+    def test_notifier_fanout_inline(self):
+        cfg = config.Config('blank_config')
+        cfg.notifiers = {
+            'trace': FakeSubConfig(cfg, 'notifier:trace', []),
+            None: FakeSubConfig(cfg, 'notifier', []),
+            }
+        trace = notifiers.TraceNotifier(dict(path='unused'))
+        cfg.notifiers['trace'].driver = trace
+        cfg.notifiers[None].driver = FakeNotifier(cfg)
+        result = cfg.notifier('foo, trace')
+
+        # Only the blocking notifier is queued
+        self.assertIsInstance(result, notifiers.FanoutNotifier)
+        self.assertIs(result.drivers[0], trace)
+        queued = result.drivers[1]
+        self.assertIsInstance(queued, notifiers.AsyncNotifier)
+        self.assertEqual(queued.driver.drivers,
+                         [cfg.notifiers[None].driver])
+        self.assertFalse(result.blocking)
+        self.assertIs(cfg.notifier('trace,'), trace)
+
+    def test_dump_exemplars(self):
+        cfg = config.Config('blank_config')
+        method = FakeSubConfig(cfg, 'foo.bar', [])
+        method.exemplars = exemplars.ExemplarRecorder(threshold=1.0)
+        method.exemplars.offer('foo.bar', 1.5, (), {})
+        other = FakeSubConfig(cfg, 'bar.foo', [])
+        other.exemplars = None
+        cfg.methods = {'foo.bar': method, 'bar.foo': other}
+
+        fp = StringIO.StringIO()
+        cfg.dump_exemplars(fp)
+
+        self.assertEqual(len(fp.getvalue().splitlines()), 1)
+
     def test_all_methods(self):
         cfg = config.Config('init_config')
         result = sorted([meth.label for meth in cfg._methods(())])
@@ -306,6 +474,51 @@ class TestGetMethod(tests.TestCase):
         self.assertEqual(kind, 'static method')
 
 
+class FakeDict(dict):
+    def lookup(self, key):
+        return self[key]
+
+
+class TestExpandMethods(tests.TestCase):
+    imports = {
+        'FakeClass': FakeClass,
+        'FakeDict': FakeDict,
+        'fake_module': fake_module,
+        }
+
+    def setUp(self):
+        super(TestExpandMethods, self).setUp()
+        self.stubs.Set(config, '_expansions', {})
+
+    def test_glob_class(self):
+        self.assertEqual(config.expand_methods('FakeClass', '*'), [
+                'class_method', 'instance_method', 'static_method'])
+
+    def test_glob_module(self):
+        self.assertEqual(config.expand_methods('fake_module', '*n*'), [
+                'function', 'generator'])
+
+    def test_regex(self):
+        self.assertEqual(config.expand_methods('FakeClass', 're:(class|st)'),
+                         [])
+        self.assertEqual(
+            config.expand_methods('FakeClass', 're:(class|static)_.*'),
+            ['class_method', 'static_method'])
+
+    def test_builtin_base(self):
+        self.assertEqual(config.expand_methods('FakeDict', '*'), ['lookup'])
+
+    def test_dunder(self):
+        self.assertNotIn('__init__', config.expand_methods('FakeClass', '*'))
+        self.assertEqual(config.expand_methods('FakeClass', '__*'), [])
+
+    def test_cached(self):
+        result = config.expand_methods('FakeClass', '*')
+        self.imports = {}
+
+        self.assertIs(config.expand_methods('FakeClass', '*'), result)
+
+
 class TestMethod(tests.TestCase):
     imports = {
         'FakeMetric': FakeMetric,
@@ -414,6 +627,22 @@ class TestMethod(tests.TestCase):
         method.detach()
         self.assertEqual(method._method_orig, fake_module.function)
 
+    def test_metric_shared(self):
+        shared = {}
+        method = self.method = config.Method(None, 'label', [
+                ('module', 'FakeClass'),
+                ('method', 'class_method'),
+                ('metric', 'FakeMetric')], shared=shared)
+        other = config.Method(None, 'other', [
+                ('module', 'FakeClass'),
+                ('method', 'static_method'),
+                ('metric', 'FakeMetric')], shared=shared)
+        try:
+            self.assertIsInstance(method.metric, FakeMetric)
+            self.assertIs(other.metric, method.metric)
+        finally:
+            other.detach()
+
     def test_additional_config(self):
         method = self.method = config.Method(None, 'label', [
                 ('module', 'FakeClass'),
@@ -459,6 +688,360 @@ class TestMethod(tests.TestCase):
         self.assertEqual(method.notifier.sent_msgs,
                          ["default/'started/ended'/'fake_label'"])
 
+    def test_wrapper_template(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'function'),
+                ('metric', 'FakeMetric'),
+                ('label_template', 'fake.{args[0]}.{kwargs[a]}')])
+
+        method._method_wrapper('x', a='y')
+        method._method_wrapper('x')
+
+        self.assertEqual(method.notifier.sent_msgs, [
+                "default/'started/ended'/'fake.x.y'",
+                "default/'started/ended'/'label'"])
+
+    def test_wrapper_tags(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'function'),
+                ('metric', 'FakeMetric'),
+                ('tags', 'first={args[0]}, missing={args[5]}, b=static')])
+
+        method._method_wrapper('x')
+
+        self.assertEqual(method.notifier.sent_msgs,
+                         ["default/'started/ended'/'label.static.x'"])
+
+    def test_wrapper_app_tags(self):
+        self.stubs.Set(FakeHelper, 'fake_helper', staticmethod(
+                lambda *args, **kwargs: (args, kwargs, 'fake_label',
+                                         dict(a=args[0]))))
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'failure'),
+                ('metric', 'FakeMetric'),
+                ('app_helper', 'FakeHelper'),
+                ('app', 'fake_helper')])
+
+        with self.assertRaises(ValueError):
+            method._method_wrapper(ValueError('boom'))
+
+        self.assertEqual(method.notifier.sent_msgs, [
+                "default/'started/ended'/'fake_label.error.boom'",
+                "default/1/'fake_label.errors.ValueError.boom'"])
+
+    def test_wrapper_max_labels(self):
+        ticker = self.stub_ticker()
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'function'),
+                ('metric', 'FakeMetric'),
+                ('label_template', 'fake.{args[0]}'),
+                ('max_labels', '2')])
+
+        for arg in ('a', 'b', 'c', 'a', 'd'):
+            method._method_wrapper(arg)
+
+        self.assertEqual(method.notifier.sent_msgs, [
+                "default/'started/ended'/'fake.a'",
+                "default/'started/ended'/'fake.b'",
+                "default/'started/ended'/'label.other'",
+                "default/'started/ended'/'fake.a'",
+                "default/'started/ended'/'label.other'"])
+        self.assertEqual(len(method.labels), 2)
+        self.assertEqual(ticker._tasks[0][2], method.report_labels)
+
+        del method.notifier.sent_msgs[:]
+        method.report_labels()
+        method.report_labels()
+        self.assertEqual(method.notifier.sent_msgs,
+                         ["default/2/'label.labels_overflow'"])
+
+        method.detach()
+        self.method = None
+        self.assertEqual(ticker._tasks, [])
+
+    def test_wrapper_label_budget(self):
+        budget = labels.LabelBudget(1)
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'function'),
+                ('metric', 'FakeMetric'),
+                ('label_template', 'fake.{args[0]}')], label_budget=budget)
+        other = config.Method(FakeConfig(), 'other', [
+                ('module', 'fake_module'),
+                ('method', 'generator'),
+                ('metric', 'FakeMetric'),
+                ('label_template', 'other.{args[0]}')], label_budget=budget)
+        self.stub_ticker()
+        try:
+            other._method_wrapper('a')
+        finally:
+            other.detach()
+        method._method_wrapper('b')
+
+        self.assertEqual(other.notifier.sent_msgs,
+                         ["default/'started/ended'/'other.a'"])
+        self.assertEqual(method.notifier.sent_msgs,
+                         ["default/'started/ended'/'label.other'"])
+
+    def test_wrapper_error(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'failure'),
+                ('metric', 'FakeMetric')])
+
+        with self.assertRaises(ValueError):
+            method._method_wrapper(ValueError('boom'))
+
+        self.assertEqual(method.notifier.sent_msgs, [
+                "default/'started/ended'/'label.error'",
+                "default/1/'label.errors.ValueError'"])
+
+    def test_wrapper_error_notify_fails(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'failure'),
+                ('metric', 'FakeMetric')])
+        logged = []
+        self.stubs.Set(config.LOG, 'exception', logged.append)
+
+        def failing_notifier(value, vtype, label, tags=None):
+            raise IOError('notifier down')
+
+        method._notifier_cache = failing_notifier
+        with self.assertRaises(ValueError):
+            method._method_wrapper(ValueError('boom'))
+
+        self.assertEqual(logged, ["label: Error reporting a failed call"])
+
+    def test_wrapper_error_span_fails(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'failure'),
+                ('metric', 'FakeMetric'),
+                ('spans', '1')])
+        logged = []
+        self.stubs.Set(config.LOG, 'exception', logged.append)
+
+        def failing_notifier(value, vtype, label, tags=None):
+            raise IOError('notifier down')
+
+        method._notifier_cache = failing_notifier
+        with self.assertRaises(ValueError):
+            method._method_wrapper(ValueError('boom'))
+        with self.assertRaises(KeyError):
+            with method.block():
+                raise KeyError('boom')
+
+        self.assertEqual(logged, ["label: Error reporting a failed call"] * 4)
+
+    def test_wrapper_error_classes_bounded(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'failure'),
+                ('metric', 'FakeMetric'),
+                ('error_suffix', '.failed'),
+                ('max_error_classes', '1')])
+
+        for exc in (ValueError, KeyError, ValueError):
+            with self.assertRaises(exc):
+                method._method_wrapper(exc())
+
+        self.assertEqual(method.notifier.sent_msgs[1::2], [
+                "default/1/'label.errors.ValueError'",
+                "default/1/'label.errors.other'",
+                "default/1/'label.errors.ValueError'"])
+        self.assertEqual(method.notifier.sent_msgs[0],
+                         "default/'started/ended'/'label.failed'")
+
+    def stub_ticker(self):
+        ticker = utils.Ticker()
+        self.stubs.Set(ticker, 'start', lambda: None)
+        self.stubs.Set(utils, 'ticker', ticker)
+        return ticker
+
+    def test_wrapper_meter(self):
+        ticker = self.stub_ticker()
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'function'),
+                ('metric', 'FakeMetric'),
+                ('meter', '1'),
+                ('report_interval', '10')])
+
+        self.assertEqual(ticker._tasks[0][0], 10.0)
+        self.assertEqual(ticker._tasks[0][2], method.report)
+
+        method._method_wrapper()
+        method.meter.enter()
+        self.assertEqual(method.meter.inflight, 1)
+
+        del method.notifier.sent_msgs[:]
+        method.report()
+        self.assertEqual(method.notifier.sent_msgs, [
+                "default/1/'label.inflight'",
+                "default/1/'label.inflight_peak'",
+                "default/0.2/'label.rate_1m'",
+                "default/0.2/'label.rate_5m'",
+                "default/0.2/'label.rate_15m'"])
+
+        method.detach()
+        self.method = None
+        self.assertEqual(ticker._tasks, [])
+
+    def test_report_nonblocking(self):
+        self.stub_ticker()
+        cfg = FakeConfig()
+        requested = []
+
+        def notifier(name, nonblocking=False):
+            requested.append(nonblocking)
+            return FakeNotifier(cfg)
+
+        self.stubs.Set(cfg, 'notifier', notifier)
+        method = self.method = config.Method(cfg, 'label', [
+                ('module', 'fake_module'),
+                ('method', 'function'),
+                ('metric', 'FakeMetric'),
+                ('meter', '1')])
+
+        method.report()
+        self.assertEqual(requested, [True])
+
+    def test_wrapper_meter_error(self):
+        self.stub_ticker()
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'failure'),
+                ('metric', 'FakeMetric'),
+                ('meter', '1')])
+
+        with self.assertRaises(ValueError):
+            method._method_wrapper(ValueError())
+        self.assertEqual(method.meter.inflight, 0)
+        self.assertEqual(method.meter.peak, 1)
+
+    def test_wrapper_spans(self):
+        ticker = self.stub_ticker()
+        inner = self.method = config.Method(FakeConfig(), 'inner', [
+                ('module', 'fake_module'),
+                ('method', 'function'),
+                ('metric', 'FakeMetric')], defaults=dict(spans='1'))
+        outer = config.Method(inner.config, 'outer', [
+                ('module', 'fake_module'),
+                ('method', 'outer'),
+                ('metric', 'FakeMetric')], defaults=dict(spans='1'))
+
+        try:
+            self.assertEqual(len(ticker._tasks), 2)
+            result = outer._method_wrapper(1, 2)
+        finally:
+            outer.detach()
+
+        self.assertEqual(result[1]['args'], (1, 2))
+        sent = inner.notifier.sent_msgs
+        self.assertEqual(len(sent), 4)
+        self.assertTrue(sent[0].endswith("/'inner.self'"))
+        self.assertEqual(sent[1], "default/'started/ended'/'inner'")
+        self.assertTrue(sent[2].endswith("/'outer.self'"))
+        self.assertEqual(sent[3], "default/'started/ended'/'outer'")
+
+        self.assertEqual(outer._calls, {})
+        self.assertEqual(inner._calls, {('outer', 'inner'): 1})
+        del sent[:]
+        inner.report_calls()
+        self.assertEqual(sent, ["default/1/'outer.calls.inner'"])
+        self.assertEqual(inner._calls, {})
+
+    def test_wrapper_exemplars(self):
+        ticker = self.stub_ticker()
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'function'),
+                ('metric', 'FakeMetric'),
+                ('slow_top', '2')])
+
+        self.assertEqual(ticker._tasks[0][2], method.exemplars.close_window)
+        for i in range(3):
+            method._method_wrapper(i, password='secret')
+
+        result = method.exemplars.exemplars()
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0]['label'], 'label')
+        self.assertNotIn('secret', result[0]['summary'])
+
+    def test_wrapper_exemplars_error(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'failure'),
+                ('metric', 'FakeMetric'),
+                ('slow_threshold', '0.000001'),
+                ('app_helper', 'FakeHelper'),
+                ('exemplar_app', 'fake_summary')])
+
+        with self.assertRaises(ValueError):
+            method._method_wrapper(ValueError())
+
+        result = method.exemplars.exemplars()
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['label'], 'label.error')
+        self.assertEqual(result[0]['summary'], 'summary of 1 args')
+
+    def test_wrapper_profile(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'function'),
+                ('metric', 'FakeMetric'),
+                ('profile', '1'),
+                ('profile_threshold', '0.5')])
+        triggered = []
+        self.stubs.Set(method.profiler, 'trigger',
+                       lambda: triggered.append(True))
+
+        # Each call takes a second
+        clock = itertools.count(100)
+        self.stubs.Set(config.time, 'time', lambda: float(next(clock)))
+
+        self.assertEqual(method.profiler.code, method.method.func_code)
+        method._method_wrapper()
+        self.assertEqual(triggered, [True])
+
+    def test_wrapper_stream(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'generator'),
+                ('metric', 'FakeMetric'),
+                ('stream', '1')])
+
+        result = method._method_wrapper('ab', 'cde')
+
+        self.assertEqual(method.notifier.sent_msgs, [])
+        self.assertEqual(list(result), ['ab', 'cde'])
+        self.assertEqual(method.notifier.sent_msgs[0],
+                         "default/'started/ended'/'label'")
+        self.assertTrue(method.notifier.sent_msgs[1].startswith(
+                "default/"))
+        self.assertTrue(method.notifier.sent_msgs[1].endswith(
+                "/'label.first_item'"))
+        self.assertEqual(method.notifier.sent_msgs[2:], [
+                "default/2/'label.items'",
+                "default/5/'label.bytes'"])
+
+    def test_wrapper_no_stream(self):
+        method = self.method = config.Method(FakeConfig(), 'label', [
+                ('module', 'fake_module'),
+                ('method', 'generator'),
+                ('metric', 'FakeMetric')])
+
+        result = method._method_wrapper('ab', 'cde')
+
+        self.assertEqual(method.notifier.sent_msgs,
+                         ["default/'started/ended'/'label'"])
+        self.assertEqual(list(result), ['ab', 'cde'])
+
     def test_get_app(self):
         method = self.method = config.Method(None, 'label', [
                 ('module', 'FakeClass'),
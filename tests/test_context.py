@@ -0,0 +1,105 @@
+import threading
+
+from tach import context
+
+import tests
+
+
+class TestSpans(tests.TestCase):
+    def test_push_pop(self):
+        self.assertEqual(context.current_span(), None)
+
+        span = context.push_span('label', 10.0)
+        self.assertEqual(context.current_span(), span)
+        self.assertEqual(span.parent, None)
+
+        self.assertEqual(context.pop_span(span, 12.5), (2.5, 2.5))
+        self.assertEqual(context.current_span(), None)
+
+    def test_nested(self):
+        outer = context.push_span('outer', 10.0)
+        inner = context.push_span('inner', 11.0)
+        self.assertEqual(inner.parent, outer)
+
+        self.assertEqual(context.pop_span(inner, 12.0), (1.0, 1.0))
+        self.assertEqual(context.current_span(), outer)
+        self.assertEqual(outer.child_time, 1.0)
+        self.assertEqual(context.pop_span(outer, 14.0), (4.0, 3.0))
+
+    def test_per_thread(self):
+        span = context.push_span('label', 10.0)
+        seen = []
+
+        thread = threading.Thread(
+            target=lambda: seen.append(context.current_span()))
+        thread.start()
+        thread.join()
+
+        context.pop_span(span, 11.0)
+        self.assertEqual(seen, [None])
+
+
+class TestTransactionId(tests.TestCase):
+    def test_assigned_on_demand(self):
+        self.assertEqual(context.transaction_id(), 1)
+        self.assertEqual(context.transaction_id(), 1)
+
+    def test_new(self):
+        self.assertEqual(context.new_transaction_id(), 1)
+        self.assertEqual(context.new_transaction_id(), 2)
+        self.assertEqual(context.transaction_id(), 2)
+
+    def test_set(self):
+        context.set_transaction_id(42)
+
+        self.assertEqual(context.transaction_id(), 42)
+
+    def test_per_thread(self):
+        context.new_transaction_id()
+        seen = []
+
+        def run():
+            seen.append(context.transaction_id())
+            seen.append(context.new_transaction_id())
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(seen, [2, 3])
+        self.assertEqual(context.transaction_id(), 1)
+
+    def test_follows_patched_local(self):
+        context.set_transaction_id(42)
+
+        class PatchedLocal(threading.local):
+            pass
+
+        self.stubs.Set(threading, 'local', PatchedLocal)
+        self.assertEqual(context.transaction_id(), 1)
+
+
+class TestInternal(tests.TestCase):
+    def test_enter_leave(self):
+        self.assertFalse(context.internal())
+        self.assertTrue(context.enter_internal())
+        try:
+            self.assertTrue(context.internal())
+            self.assertFalse(context.enter_internal())
+        finally:
+            context.leave_internal()
+
+        self.assertFalse(context.internal())
+
+    def test_per_thread(self):
+        seen = []
+        self.assertTrue(context.enter_internal())
+        try:
+            thread = threading.Thread(
+                target=lambda: seen.append(context.internal()))
+            thread.start()
+            thread.join()
+        finally:
+            context.leave_internal()
+
+        self.assertEqual(seen, [False])
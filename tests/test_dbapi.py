@@ -0,0 +1,170 @@
+import sqlite3
+
+from tach import config
+from tach import metrics
+from tach.packs import dbapi
+
+import tests
+
+
+class TestFingerprint(tests.TestCase):
+    def test_literals(self):
+        self.assertEqual(
+            dbapi.fingerprint("SELECT * FROM instances  WHERE id = 42 "
+                              "AND name = 'it''s' AND x > -1.5e3"),
+            "select * from instances where id = ? and name = ? and x > ?")
+
+    def test_double_quotes(self):
+        self.assertEqual(
+            dbapi.fingerprint('SELECT a FROM "t" WHERE b = "x" AND c = "y"'),
+            'select a from "t" where b = ? and c = ?')
+
+    def test_placeholders(self):
+        for statement in ("SELECT a FROM t WHERE b = %s",
+                          "SELECT a FROM t WHERE b = %(b)s",
+                          "SELECT a FROM t WHERE b = :b",
+                          "SELECT a FROM t WHERE b = ?"):
+            self.assertEqual(dbapi.fingerprint(statement),
+                             "select a from t where b = ?")
+
+    def test_lists(self):
+        self.assertEqual(
+            dbapi.fingerprint("SELECT a FROM t1 WHERE b IN (1, 2, 3)"),
+            dbapi.fingerprint("select a from t1 where b in (4)"))
+        self.assertEqual(
+            dbapi.fingerprint("INSERT INTO t (a, b) VALUES (1, 'x'), "
+                              "(2, 'y') -- batch"),
+            "insert into t (a, b) values (?)")
+
+    def test_statement_label(self):
+        label = dbapi.statement_label('db', 'select a from nova.t where b = ?')
+
+        self.assertRegexpMatches(label, r'^db\.select\.nova_t\.[0-9a-f]{8}$')
+        self.assertRegexpMatches(dbapi.statement_label('db', 'begin'),
+                                 r'^db\.begin\.none\.[0-9a-f]{8}$')
+
+    def test_statement_label_unicode(self):
+        label = dbapi.statement_label('db', u'select a from caf\xe9')
+
+        self.assertRegexpMatches(label, r'^db\.select\.caf\.[0-9a-f]{8}$')
+        self.assertIsInstance(label, str)
+
+
+class TestDBAPIPack(tests.TestCase):
+    imports = {
+        'sqlite3': sqlite3,
+        'tach.metrics.ExecTime': metrics.ExecTime,
+        }
+
+    def setUp(self):
+        super(TestDBAPIPack, self).setUp()
+
+        self.notified = []
+        self.cfg = config.Config(None)
+        self.stubs.Set(self.cfg, 'notifier',
+                       lambda name, nonblocking=False: self.notify)
+
+        self.pack = dbapi.DBAPIPack(self.cfg, 'dbapi', dict(label='db'))
+        self.pack.attach()
+
+    def tearDown(self):
+        self.pack.detach()
+        super(TestDBAPIPack, self).tearDown()
+
+    def notify(self, value, vtype, label, tags=None):
+        self.notified.append((vtype, label, value))
+
+    def labels(self):
+        return [(vtype, label) for vtype, label, value in self.notified]
+
+    def test_attach(self):
+        self.assertEqual(sqlite3.connect.tach_function,
+                         self.pack._patches[0][2])
+        self.pack.detach()
+
+        self.assertFalse(hasattr(sqlite3.connect, 'tach_function'))
+        self.pack.attach()
+
+    def test_queries(self):
+        conn = sqlite3.connect(':memory:')
+        self.assertIsInstance(conn, dbapi.ConnectionProxy)
+        cursor = conn.cursor()
+        cursor.execute("CREATE TABLE t (a INTEGER)")
+        cursor.executemany("INSERT INTO t VALUES (?)", [(1,), (2,), (3,)])
+        self.assertIs(cursor.execute("SELECT a FROM t WHERE a > 1"), cursor)
+        self.assertEqual(cursor.fetchall(), [(2,), (3,)])
+        cursor.execute("SELECT a FROM t WHERE a > 2")
+        self.assertEqual(cursor.fetchone(), (3,))
+        self.assertEqual(cursor.fetchone(), None)
+        conn.close()
+
+        create = self.pack.label("CREATE TABLE t (a INTEGER)")
+        insert = self.pack.label("INSERT INTO t VALUES (?)")
+        select = self.pack.label("SELECT a FROM t WHERE a > 1")
+        self.assertEqual(self.pack.label("SELECT a FROM t WHERE a > 2"),
+                         select)
+        self.assertEqual(self.pack.statements[select],
+                         "select a from t where a > ?")
+        self.assertEqual(self.labels(), [
+                ('exec_time', 'db.connect'),
+                ('exec_time', create),
+                ('exec_time', insert),
+                ('increment', insert + '.rows'),
+                ('exec_time', select),
+                ('increment', select + '.rows'),
+                ('exec_time', select),
+                ('increment', select + '.rows')])
+        self.assertEqual(self.notified[3][2], 3)
+        self.assertEqual(self.notified[5][2], 2)
+        self.assertEqual(self.notified[7][2], 1)
+
+    def test_connection_execute(self):
+        conn = sqlite3.connect(':memory:')
+        with conn:
+            rows = list(conn.execute("SELECT 1 UNION SELECT 2"))
+        conn.close()
+
+        self.assertEqual(rows, [(1,), (2,)])
+        label = self.pack.label("SELECT 1 UNION SELECT 2")
+        self.assertEqual(self.notified[-1], ('increment', label + '.rows', 2))
+
+    def test_connection_attributes(self):
+        conn = sqlite3.connect(':memory:')
+        conn.row_factory = sqlite3.Row
+        conn.isolation_level = None
+        row = conn.execute("SELECT 1 AS a").fetchone()
+        conn.close()
+
+        self.assertEqual(row['a'], 1)
+        self.assertEqual(conn._connection.isolation_level, None)
+
+    def test_error(self):
+        conn = sqlite3.connect(':memory:')
+        cursor = conn.cursor()
+        self.assertRaises(sqlite3.OperationalError, cursor.execute,
+                          "SELECT * FROM missing")
+        conn.close()
+
+        label = self.pack.label("SELECT * FROM missing")
+        self.assertEqual(self.labels()[1:], [
+                ('exec_time', label + '.error'),
+                ('increment', label + '.errors.OperationalError')])
+
+    def test_label_cache(self):
+        self.pack.statement_cache_size = 2
+        first = self.pack.label("SELECT 1")
+
+        self.assertIs(self.pack.label("SELECT 1"), first)
+        self.pack.label("SELECT 2")
+        self.pack.label("SELECT 'a'")
+        self.assertEqual(len(self.pack._labels), 1)
+        self.assertEqual(len(self.pack.statements), 1)
+
+    def test_max_labels(self):
+        self.pack.method.labels.limit = 1
+        conn = sqlite3.connect(':memory:')
+        conn.execute("SELECT 1")
+        conn.execute("SELECT 1 FROM sqlite_master")
+        conn.close()
+
+        self.assertEqual(self.labels()[-1], ('exec_time', 'db.other'))
@@ -0,0 +1,96 @@
+import StringIO
+import json
+
+from tach import exemplars
+
+import tests
+
+
+class TestSummarize(tests.TestCase):
+    def test_basic(self):
+        self.assertEqual(exemplars.summarize((1, 'a'), {'b': 2}),
+                         "(1, 'a'), {'b': 2}")
+
+    def test_bounded(self):
+        summary = exemplars.summarize(('x' * 1000, range(1000)), {})
+
+        self.assertLess(len(summary), 200)
+
+    def test_max_len(self):
+        self.assertEqual(len(exemplars.summarize((1, 2, 3), {}, max_len=4)),
+                         4)
+
+    def test_redact(self):
+        summary = exemplars.summarize(
+            ({'password': 'hunter2', 'name': 'x'},),
+            {'auth_token': 'abc123'})
+
+        self.assertNotIn('hunter2', summary)
+        self.assertNotIn('abc123', summary)
+        self.assertIn("'password': ***", summary)
+        self.assertIn("'name': 'x'", summary)
+
+
+class TestExemplarRecorder(tests.TestCase):
+    def test_disabled(self):
+        recorder = exemplars.ExemplarRecorder()
+
+        self.assertEqual(recorder.floor, float('inf'))
+
+    def test_threshold(self):
+        recorder = exemplars.ExemplarRecorder(threshold=1.0)
+        self.assertEqual(recorder.floor, 1.0)
+
+        recorder.offer('label', 0.5, (), {})
+        recorder.offer('label', 1.5, (1,), {})
+
+        result = recorder.exemplars()
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['label'], 'label')
+        self.assertEqual(result[0]['duration'], 1.5)
+        self.assertEqual(result[0]['transaction_id'], 1)
+        self.assertEqual(result[0]['summary'], '(1,), {}')
+
+    def test_top(self):
+        recorder = exemplars.ExemplarRecorder(top=2)
+        for duration in (0.3, 0.1, 0.5, 0.2):
+            recorder.offer('label', duration, (), {})
+
+        self.assertEqual(recorder.floor, 0.3)
+        self.assertEqual([e['duration'] for e in recorder.exemplars()],
+                         [0.3, 0.5])
+
+        recorder.close_window()
+        self.assertEqual(recorder.floor, 0)
+        recorder.offer('label', 0.1, (), {})
+        self.assertEqual([e['duration'] for e in recorder.exemplars()],
+                         [0.3, 0.5, 0.1])
+
+    def test_ring_size(self):
+        recorder = exemplars.ExemplarRecorder(threshold=1.0, size=2)
+        for duration in (1.1, 1.2, 1.3):
+            recorder.offer('label', duration, (), {})
+
+        self.assertEqual([e['duration'] for e in recorder.exemplars()],
+                         [1.2, 1.3])
+
+    def test_summarizer_error(self):
+        def summarizer(args, kwargs):
+            raise ValueError('boom')
+
+        recorder = exemplars.ExemplarRecorder(threshold=1.0,
+                                              summarizer=summarizer)
+        recorder.offer('label', 1.5, (), {})
+
+        self.assertEqual(recorder.exemplars()[0]['summary'],
+                         '<unavailable: ValueError>')
+
+    def test_dump(self):
+        recorder = exemplars.ExemplarRecorder(threshold=1.0)
+        recorder.offer('label', 1.5, (), {})
+        fp = StringIO.StringIO()
+        recorder.dump(fp)
+
+        lines = fp.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['label'], 'label')
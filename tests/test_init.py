@@ -1,5 +1,8 @@
+import sys
+
 import tach
 from tach import config
+from tach import metrics
 
 import tests
 
@@ -14,8 +17,137 @@ class TestPatch(tests.TestCase):
         super(TestPatch, self).setUp()
 
         self.stubs.Set(config, 'Config', FakeConfig)
+        self.stubs.Set(tach, '_config', None)
 
     def test_patch(self):
         cfg = tach.patch('foobar')
 
         self.assertEqual(cfg.path, 'foobar')
+        self.assertIs(tach._get_config(), cfg)
+
+
+class FakeClass(object):
+    def method(self, arg):
+        return arg * 2
+
+    @classmethod
+    def class_method(cls, arg):
+        return arg * 3
+
+    @staticmethod
+    def static_method(arg):
+        return arg * 4
+
+
+def function(arg):
+    return arg + 1
+
+
+class TestInstrument(tests.TestCase):
+    imports = {
+        'tach.metrics.Increment': metrics.Increment,
+        'tests.test_init.FakeClass': FakeClass,
+        'tests.test_init': sys.modules[__name__],
+        }
+
+    def setUp(self):
+        super(TestInstrument, self).setUp()
+
+        self.notified = []
+        self.cfg = config.Config(None)
+        self.stubs.Set(self.cfg, 'notifier',
+                       lambda name, nonblocking=False: self.notify)
+        self.stubs.Set(tach, '_config', self.cfg)
+
+    def notify(self, value, vtype, label, tags=None):
+        self.notified.append((value, vtype, label, tags))
+
+    def test_get_config(self):
+        self.stubs.Set(tach, '_config', None)
+        cfg = tach._get_config()
+
+        self.assertIsInstance(cfg, config.Config)
+        self.assertIs(tach._get_config(), cfg)
+        self.assertIs(tach._get_config('cfg'), 'cfg')
+
+    def test_instrument_method(self):
+        method = tach.instrument(FakeClass.method,
+                                 metric='tach.metrics.Increment')
+        try:
+            self.assertEqual(FakeClass().method(2), 4)
+        finally:
+            method.detach()
+
+        self.assertEqual(FakeClass().method(2), 4)
+        self.assertEqual(self.notified, [
+                (1, 'increment', 'tests.test_init.FakeClass.method', None)])
+        self.assertIs(self.cfg.methods['tests.test_init.FakeClass.method'],
+                      method)
+
+    def test_instrument_class_method(self):
+        method = tach.instrument(FakeClass.class_method,
+                                 metric='tach.metrics.Increment')
+        try:
+            self.assertEqual(FakeClass.class_method(2), 6)
+        finally:
+            method.detach()
+
+        self.assertEqual(self.notified, [
+                (1, 'increment', 'tests.test_init.FakeClass.class_method',
+                 None)])
+
+    def test_instrument_static_method(self):
+        self.assertRaises(ValueError, tach.instrument,
+                          FakeClass.static_method)
+
+    def test_instrument_function(self):
+        method = tach.instrument(function, metric='tach.metrics.Increment')
+        try:
+            self.assertEqual(sys.modules[__name__].function(1), 2)
+        finally:
+            method.detach()
+
+        self.assertEqual(self.notified, [
+                (1, 'increment', 'tests.test_init.function', None)])
+
+    def test_instrument_name(self):
+        method = tach.instrument('tests.test_init.function',
+                                 metric='tach.metrics.Increment',
+                                 label='function')
+        try:
+            self.assertEqual(sys.modules[__name__].function(1), 2)
+        finally:
+            method.detach()
+
+        self.assertEqual(self.notified, [(1, 'increment', 'function', None)])
+
+    def test_timed(self):
+        @tach.timed('decorated', metric='tach.metrics.Increment')
+        def decorated(arg):
+            return arg
+
+        self.assertEqual(decorated(5), 5)
+        self.assertEqual(self.notified, [
+                (1, 'increment', 'decorated', None)])
+        self.assertIs(decorated.tach_descriptor,
+                      self.cfg.methods['decorated'])
+
+    def test_timer(self):
+        with tach.timer('block', metric='tach.metrics.Increment'):
+            pass
+        with tach.timer('block', tags=dict(kind='fast')):
+            pass
+
+        self.assertEqual(self.notified, [
+                (1, 'increment', 'block', None),
+                (1, 'increment', 'block', (('kind', 'fast'),))])
+
+    def test_timer_error(self):
+        def fail():
+            with tach.timer('block', metric='tach.metrics.Increment'):
+                raise ValueError('boom')
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.notified, [
+                (1, 'increment', 'block.error', None),
+                (1, 'increment', 'block.errors.ValueError', None)])
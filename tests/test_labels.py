@@ -0,0 +1,77 @@
+from tach import labels
+
+import tests
+
+
+class TestLabelBudget(tests.TestCase):
+    def test_admit(self):
+        budget = labels.LabelBudget(2)
+
+        self.assertEqual([budget.admit() for i in range(3)],
+                         [True, True, False])
+
+    def test_unlimited(self):
+        budget = labels.LabelBudget(0)
+
+        self.assertTrue(all(budget.admit() for i in range(10)))
+
+
+class TestLabelSet(tests.TestCase):
+    def test_intern(self):
+        label_set = labels.LabelSet(10, 'other')
+        first = label_set.intern(''.join(['a', 'b']))
+
+        self.assertEqual(first, 'ab')
+        self.assertIs(label_set.intern(''.join(['a', 'b'])), first)
+        self.assertEqual(len(label_set), 1)
+
+    def test_overflow(self):
+        overflows = []
+        label_set = labels.LabelSet(2, 'other',
+                                    on_overflow=lambda: overflows.append(1))
+
+        result = [label_set.intern(label) for label in 'abcad']
+
+        self.assertEqual(result, ['a', 'b', 'other', 'a', 'other'])
+        self.assertEqual(label_set.overflow, 2)
+        self.assertEqual(overflows, [1])
+
+    def test_budget(self):
+        budget = labels.LabelBudget(1)
+        first = labels.LabelSet(10, 'first', budget=budget)
+        second = labels.LabelSet(10, 'second', budget=budget)
+
+        self.assertEqual(first.intern('a'), 'a')
+        self.assertEqual(second.intern('a'), 'second')
+        self.assertEqual(first.intern('a'), 'a')
+
+    def test_tick(self):
+        label_set = labels.LabelSet(1, 'other')
+        for label in 'abc':
+            label_set.intern(label)
+
+        self.assertEqual(label_set.tick(), 2)
+        self.assertEqual(label_set.tick(), 0)
+
+
+class TestInternTags(tests.TestCase):
+    def test_intern(self):
+        tags = labels.intern_tags(dict(b=2, a='1'))
+
+        self.assertEqual(tags, (('a', '1'), ('b', '2')))
+        self.assertIs(labels.intern_tags([('a', 1), ('b', 2)]), tags)
+
+    def test_unicode(self):
+        self.assertEqual(labels.intern_tags({u'caf\xe9': u'cr\xe8me'}),
+                         (('caf\xc3\xa9', 'cr\xc3\xa8me'),))
+
+    def test_empty(self):
+        self.assertEqual(labels.intern_tags({}), None)
+        self.assertEqual(labels.intern_tags(None), None)
+
+    def test_limit(self):
+        self.stubs.Set(labels, '_tag_sets', {})
+        self.stubs.Set(labels, 'max_tag_sets', 0)
+
+        self.assertEqual(labels.intern_tags(dict(a='b')), (('a', 'b'),))
+        self.assertEqual(labels._tag_sets, {})
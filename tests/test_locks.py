@@ -0,0 +1,207 @@
+import Queue
+import sys
+import threading
+
+from tach import config
+from tach import context
+from tach import metrics
+from tach import utils
+from tach.packs import locks
+
+import tests
+
+
+class FakeLock(object):
+    def __init__(self, waits):
+        self.waits = waits
+        self.calls = []
+
+    def acquire(self, blocking=True):
+        self.calls.append(blocking)
+        if not blocking:
+            return False
+        locks.time.time.now += self.waits
+        return True
+
+    def release(self):
+        self.calls.append('release')
+
+
+class FakeSemaphore(object):
+    def __init__(self, free=True):
+        self.free = free
+
+    def acquire(self, blocking=True, timeout=None):
+        if self.free or blocking:
+            return True
+        return False
+
+    def __enter__(self):
+        return 'base'
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLockPack(tests.TestCase):
+    imports = {
+        'tach.metrics.ExecTime': metrics.ExecTime,
+        }
+
+    def setUp(self):
+        super(TestLockPack, self).setUp()
+
+        self.ticker = utils.Ticker()
+        self.stubs.Set(self.ticker, 'start', lambda: None)
+        self.stubs.Set(utils, 'ticker', self.ticker)
+        self.stubs.Set(locks.time, 'time', FakeClock())
+
+        self.notified = []
+        self.cfg = config.Config(None)
+        self.stubs.Set(self.cfg, 'notifier',
+                       lambda name, nonblocking=False: self.notify)
+
+        self.pack = locks.LockPack(self.cfg, 'locks', dict(threshold='0.5'))
+        self.pack.attach()
+
+    def tearDown(self):
+        self.pack.detach()
+        super(TestLockPack, self).tearDown()
+
+    def notify(self, value, vtype, label, tags=None):
+        self.notified.append((value, vtype, label))
+
+    def report(self):
+        self.ticker.tick(self.ticker._tasks[0][1])
+
+    def test_attach(self):
+        lock = threading.Lock()
+        self.assertIsInstance(lock, locks.InstrumentedLock)
+        self.assertIsInstance(threading.RLock(), locks.InstrumentedLock)
+        self.assertIsInstance(threading.Semaphore(2), locks.InstrumentedLock)
+        with lock:
+            self.assertTrue(lock.locked())
+        self.assertFalse(lock.locked())
+
+        self.pack.detach()
+        self.assertNotIsInstance(threading.Lock(), locks.InstrumentedLock)
+        self.pack.attach()
+
+    def test_uncontended(self):
+        lock = threading.Lock()
+        self.assertTrue(lock.acquire())
+        self.assertFalse(lock.acquire(False))
+        lock.release()
+        self.report()
+
+        self.assertEqual(self.notified, [])
+
+    def test_contended(self):
+        lock = locks.InstrumentedLock(FakeLock(0.75), self.pack)
+        with lock:
+            pass
+        self.report()
+
+        self.assertEqual(lock._lock.calls, [False, True, 'release'])
+        label = 'locks.tests.test_locks.test_contended'
+        self.assertEqual(self.notified, [
+                (1, 'increment', label + '.waits'),
+                (0.75, 'gauge', label + '.wait'),
+                (0.75, 'gauge', label + '.wait_max')])
+
+    def test_internal(self):
+        lock = locks.InstrumentedLock(FakeLock(0.75), self.pack)
+        entered = context.enter_internal()
+        try:
+            self.assertTrue(lock.acquire())
+        finally:
+            if entered:
+                context.leave_internal()
+        self.report()
+
+        self.assertEqual(lock._lock.calls, [False, True])
+        self.assertEqual(self.notified, [])
+
+    def test_stdlib_site(self):
+        self.pack.by_span = False
+        lock = locks.InstrumentedLock(FakeLock(1.0), self.pack)
+        queue = Queue.Queue()
+        queue.not_empty = queue.not_full = threading.Condition(lock)
+        queue.put(1)
+        self.report()
+
+        self.assertEqual(self.notified[0], (
+                1, 'increment',
+                'locks.tests.test_locks.test_stdlib_site.waits'))
+
+    def test_below_threshold(self):
+        lock = locks.InstrumentedLock(FakeLock(0.25), self.pack)
+        lock.acquire()
+        self.report()
+
+        self.assertEqual(self.notified, [])
+
+    def test_non_blocking(self):
+        lock = locks.InstrumentedLock(FakeLock(0.75), self.pack)
+
+        self.assertFalse(lock.acquire(False))
+        self.assertFalse(lock.acquire(blocking=False))
+        self.assertEqual(lock._lock.calls, [False, False])
+
+    def test_by_span(self):
+        lock = locks.InstrumentedLock(FakeLock(1.0), self.pack)
+        span = context.push_span('nova.compute.build', 0.0)
+        try:
+            lock.acquire()
+            lock.acquire()
+        finally:
+            context.pop_span(span, 0.0)
+        self.report()
+
+        self.assertEqual(self.notified, [
+                (2, 'increment', 'locks.nova.compute.build.waits'),
+                (2.0, 'gauge', 'locks.nova.compute.build.wait'),
+                (1.0, 'gauge', 'locks.nova.compute.build.wait_max')])
+
+    def test_by_site(self):
+        self.pack.by_span = False
+        lock = locks.InstrumentedLock(FakeLock(1.0), self.pack)
+        span = context.push_span('nova.compute.build', 0.0)
+        try:
+            lock.acquire()
+        finally:
+            context.pop_span(span, 0.0)
+        self.report()
+
+        self.assertEqual(self.notified[0], (
+                1, 'increment', 'locks.tests.test_locks.test_by_site.waits'))
+
+    def test_subclass(self):
+        cls = self.pack._subclass(FakeSemaphore)
+        self.assertEqual(cls.__name__, 'FakeSemaphore')
+        self.assertTrue(issubclass(cls, FakeSemaphore))
+
+        self.assertTrue(cls().acquire())
+        busy = cls(free=False)
+        self.assertFalse(busy.acquire(blocking=False))
+        self.assertTrue(busy.acquire())
+        self.assertTrue(busy.__enter__())
+
+    def test_eventlet(self):
+        self.pack.detach()
+        module = type(sys)('eventlet.semaphore')
+        module.Semaphore = FakeSemaphore
+        self.stubs.Set(sys, 'modules', dict(sys.modules))
+        sys.modules['eventlet.semaphore'] = module
+        self.pack.attach()
+
+        self.assertTrue(issubclass(module.Semaphore, FakeSemaphore))
+        self.assertIsNot(module.Semaphore, FakeSemaphore)
+        self.pack.detach()
+        self.assertIs(module.Semaphore, FakeSemaphore)
+        self.pack.attach()
@@ -0,0 +1,53 @@
+from tach import meters
+
+import tests
+
+
+class TestEWMA(tests.TestCase):
+    def test_first_update(self):
+        ewma = meters.EWMA(1, 5)
+        ewma.update(50)
+
+        self.assertEqual(ewma.rate, 10.0)
+
+    def test_decay(self):
+        ewma = meters.EWMA(1, 5)
+        ewma.update(50)
+        ewma.update(0)
+
+        self.assertAlmostEqual(ewma.rate, 10.0 * (1 - ewma.alpha))
+
+    def test_longer_period_decays_slower(self):
+        short = meters.EWMA(1, 5)
+        long = meters.EWMA(15, 5)
+        for ewma in (short, long):
+            ewma.update(50)
+            ewma.update(0)
+
+        self.assertLess(short.rate, long.rate)
+
+
+class TestCallMeter(tests.TestCase):
+    def test_inflight(self):
+        meter = meters.CallMeter(5)
+        meter.enter()
+        meter.enter()
+        meter.exit()
+
+        self.assertEqual(meter.inflight, 1)
+        self.assertEqual(meter.peak, 2)
+
+    def test_tick(self):
+        meter = meters.CallMeter(5)
+        meter.enter()
+        meter.enter()
+        meter.exit()
+
+        self.assertEqual(meter.tick(), 2)
+        self.assertEqual([rate.rate for rate in meter.rates], [0.4] * 3)
+
+        # The peak is reset to the current value
+        self.assertEqual(meter.tick(), 1)
+        meter.exit()
+        self.assertEqual(meter.tick(), 1)
+        self.assertEqual(meter.tick(), 0)
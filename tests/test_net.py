@@ -0,0 +1,247 @@
+import errno
+import httplib
+import socket
+
+from tach import config
+from tach import context
+from tach import metrics
+from tach import utils
+from tach.packs import net
+
+import tests
+
+
+class FakeResponse(object):
+    def __init__(self, status, length):
+        self.status = status
+        self.length = length
+
+
+class TestNetPackBase(tests.TestCase):
+    imports = {
+        'tach.metrics.ExecTime': metrics.ExecTime,
+        }
+
+    def setUp(self):
+        super(TestNetPackBase, self).setUp()
+
+        self.ticker = utils.Ticker()
+        self.stubs.Set(self.ticker, 'start', lambda: None)
+        self.stubs.Set(utils, 'ticker', self.ticker)
+
+        self.notified = []
+        self.cfg = config.Config(None)
+        self.stubs.Set(self.cfg, 'notifier',
+                       lambda name, nonblocking=False: self.notify)
+        self.pack = None
+
+    def tearDown(self):
+        if self.pack:
+            self.pack.detach()
+        super(TestNetPackBase, self).tearDown()
+
+    def notify(self, value, vtype, label, tags=None):
+        self.notified.append((vtype, label, value))
+
+    def labels(self):
+        return [(vtype, label) for vtype, label, value in self.notified]
+
+
+class TestNetPack(TestNetPackBase):
+    def setUp(self):
+        super(TestNetPack, self).setUp()
+
+        self.pack = net.NetPack(self.cfg, 'net', dict(max_labels='2'))
+        self.pack.attach()
+
+    def test_count_error(self):
+        traffic = net.Traffic()
+        net._count_error(traffic, socket.error())
+        net._count_error(traffic, socket.error(errno.EAGAIN, 'again'))
+        net._count_error(traffic, socket.error(errno.ECONNRESET, 'reset'))
+
+        self.assertEqual(traffic.errors, 2)
+
+    def test_destination(self):
+        label = self.pack.destination('10.0.0.1', 80)
+
+        self.assertEqual(label, 'net.10_0_0_1_80')
+        self.assertIs(self.pack.destination('10.0.0.1', 80), label)
+        self.pack.destination('glance', 9292)
+        self.assertEqual(self.pack.destination('neutron', 9696), 'net.other')
+
+    def test_report(self):
+        traffic = self.pack.traffic('net.glance_9292')
+        self.assertIs(self.pack.traffic('net.glance_9292'), traffic)
+        traffic.sent += 10
+        traffic.received += 20
+        self.ticker.tick(self.ticker._tasks[0][1])
+        traffic.errors += 1
+        self.ticker.tick(self.ticker._tasks[0][1])
+
+        self.assertEqual(self.notified, [
+                ('increment', 'net.glance_9292.bytes_sent', 10),
+                ('increment', 'net.glance_9292.bytes_received', 20),
+                ('increment', 'net.glance_9292.errors', 1)])
+
+    def test_detach(self):
+        self.pack.detach()
+        self.pack = None
+
+        self.assertEqual(self.ticker._tasks, [])
+
+
+class TestSocketPack(TestNetPackBase):
+    def setUp(self):
+        super(TestSocketPack, self).setUp()
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.label = 'net.127_0_0_1_%d' % self.port
+
+        self.pack = net.SocketPack(self.cfg, 'socket', dict(label='net'))
+        self.pack.attach()
+
+    def tearDown(self):
+        self.server.close()
+        super(TestSocketPack, self).tearDown()
+
+    def test_attach(self):
+        original = self.pack._patches[0][2]
+        self.assertIsNot(socket.socket, original)
+        self.assertIs(utils.uninstrumented(socket, 'socket'), original)
+
+        self.pack.detach()
+        self.pack = None
+        self.assertIs(socket.socket, original)
+        self.assertEqual(utils.instrumented, {})
+
+    def test_traffic(self):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', self.port))
+        conn, _address = self.server.accept()
+        client.sendall('hello')
+        client.send('!')
+        self.assertEqual(conn.recv(6), 'hello!')
+        conn.sendall('world')
+        self.assertEqual(client.recv(5), 'world')
+        conn.sendall('line\n')
+        fp = client.makefile('rb')
+        self.assertEqual(fp.readline(), 'line\n')
+        fp.close()
+        client.close()
+        conn.close()
+
+        traffic = self.pack.traffic(self.label)
+        self.assertEqual((traffic.sent, traffic.received, traffic.errors),
+                         (6, 10, 0))
+        self.assertEqual(self.labels(), [
+                ('exec_time', self.label + '.connect')])
+
+    def test_connect_error(self):
+        self.server.close()
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        self.assertRaises(socket.error, client.connect,
+                          ('127.0.0.1', self.port))
+        client.close()
+        self.assertEqual(self.labels(), [
+                ('exec_time', self.label + '.connect.error'),
+                ('increment', self.label + '.connect.errors.error')])
+
+    def test_recv_error(self):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', self.port))
+        client.settimeout(0.01)
+
+        self.assertRaises(socket.timeout, client.recv, 1)
+        client.close()
+        self.assertEqual(self.pack.traffic(self.label).errors, 1)
+
+    def test_internal(self):
+        self.assertTrue(context.enter_internal())
+        try:
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.connect(('127.0.0.1', self.port))
+            client.close()
+        finally:
+            context.leave_internal()
+
+        self.assertEqual(self.notified, [])
+
+
+class TestHTTPPack(TestNetPackBase):
+    def setUp(self):
+        super(TestHTTPPack, self).setUp()
+
+        self.requests = []
+        self.responses = []
+
+        def fake_request(conn, method, url, body=None, headers={}):
+            self.requests.append((method, url, body))
+            if url == '/fail':
+                raise socket.error('refused')
+
+        def fake_getresponse(conn):
+            return self.responses.pop(0)
+
+        self.stubs.Set(httplib.HTTPConnection, 'request', fake_request)
+        self.stubs.Set(httplib.HTTPConnection, 'getresponse',
+                       fake_getresponse)
+
+        self.pack = net.HTTPPack(self.cfg, 'http', dict(spans='1'))
+        self.pack.attach()
+
+    def test_request(self):
+        self.responses.append(FakeResponse(204, 12))
+        conn = httplib.HTTPConnection('glance', 9292)
+        conn.request('PUT', '/images', 'body')
+        self.assertIs(conn.getresponse().status, 204)
+
+        self.assertEqual(self.requests, [('PUT', '/images', 'body')])
+        self.assertEqual(self.labels(), [
+                ('exec_time', 'http.glance_9292'),
+                ('increment', 'http.glance_9292.status.2xx')])
+        traffic = self.pack.traffic('http.glance_9292')
+        self.assertEqual((traffic.sent, traffic.received), (4, 12))
+        self.assertFalse(self.pack.method.spans)
+
+    def test_abandoned(self):
+        self.pack.detach()
+        self.pack = net.HTTPPack(self.cfg, 'http', dict(meter='1'))
+        self.pack.attach()
+        self.responses.append(FakeResponse(200, None))
+        conn = httplib.HTTPConnection('glance', 9292)
+        conn.request('GET', '/first')
+        conn.request('GET', '/second')
+        conn.getresponse()
+        conn.request('GET', '/third')
+        conn.close()
+
+        self.assertEqual(self.labels(), [
+                ('exec_time', 'http.glance_9292'),
+                ('increment', 'http.glance_9292.status.2xx')])
+        self.assertEqual(self.pack.method.meter.inflight, 0)
+        self.assertNotIn('_tach_block', conn.__dict__)
+
+    def test_request_error(self):
+        conn = httplib.HTTPConnection('glance', 9292)
+
+        self.assertRaises(socket.error, conn.request, 'GET', '/fail')
+        self.assertEqual(self.labels(), [
+                ('exec_time', 'http.glance_9292.error'),
+                ('increment', 'http.glance_9292.errors.error')])
+
+    def test_internal(self):
+        self.responses.append(FakeResponse(200, None))
+        conn = httplib.HTTPConnection('glance', 9292)
+        self.assertTrue(context.enter_internal())
+        try:
+            conn.request('GET', '/')
+            conn.getresponse()
+        finally:
+            context.leave_internal()
+
+        self.assertEqual(self.notified, [])
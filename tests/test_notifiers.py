@@ -1,7 +1,17 @@
+import json
+import os
+import shutil
 import socket
+import tempfile
 import time
+import urllib2
 
+from tach import context
+from tach import labels
 from tach import notifiers
+from tach import prometheus
+from tach import spool
+from tach import utils
 
 import tests
 
@@ -41,15 +51,101 @@ class TestBaseNotifier(tests.TestCase):
 
         self.assertEqual(notifier.sent_msg, "test/'result'/'label'")
 
+    def test_format_cache(self):
+        notifier = NotifierTest({})
+        notifier.format('result', 'test', 'label')
+        formatter = notifier._formatters[('label', 'test', None)]
+        notifier.format('other', 'test', 'label')
+
+        self.assertIs(notifier._formatters[('label', 'test', None)], formatter)
+
+    def test_format_cache_bounded(self):
+        notifier = NotifierTest({})
+        notifier.format_cache_size = 2
+        for label in ('a', 'b', 'c'):
+            notifier.format('result', 'test', label)
+
+        self.assertEqual(notifier._formatters.keys(), [('c', 'test', None)])
+
+    def test_format_tags(self):
+        notifier = NotifierTest({})
+        tags = labels.intern_tags(dict(region='east', method='GET'))
+        result = notifier.format('result', 'test', 'label', tags)
+
+        self.assertEqual(result, "test/'result'/'label.GET.east'")
+
+    def test_call_tags(self):
+        notifier = NotifierTest({})
+        notifier('result', 'test', 'label', labels.intern_tags(dict(a='b')))
+
+        self.assertEqual(notifier.sent_msg, "test/'result'/'label.b'")
+
+    def test_sanitize(self):
+        notifier = NotifierTest({})
+        notifier.label_re = notifiers._metric_name_re
+        result = notifier.format('result', 'test', 'a b:c|d/e.f-g_h')
+
+        self.assertEqual(result, "test/'result'/'a_b_c_d_e.f-g_h'")
+
     def test_bump_transaction_id(self):
         notifier = NotifierTest({})
         self.assertEqual(notifier.transaction_id, 1)
         notifier.bump_transaction_id()
         self.assertEqual(notifier.transaction_id, 2)
 
+    def test_transaction_id_shared(self):
+        notifier = NotifierTest({})
+        other = NotifierTest({})
+        notifier.bump_transaction_id()
+
+        self.assertEqual(other.transaction_id, notifier.transaction_id)
+
+
+class TestAdapt(tests.TestCase):
+    def test_takes_tags(self):
+        self.assertIs(notifiers.adapt(NotifierTest), NotifierTest)
+        notifier = NotifierTest({})
+        self.assertIs(notifiers.adapt(notifier), notifier)
+        driver = lambda *args: None
+        self.assertIs(notifiers.adapt(driver), driver)
+
+    def test_tagless(self):
+        sent = []
+
+        class OldNotifier(object):
+            blocking = False
+
+            def __call__(self, value, vtype, label):
+                sent.append((value, vtype, label))
+
+        driver = notifiers.adapt(OldNotifier())
+        driver(1, 'increment', 'label', labels.intern_tags(dict(a='b')))
+
+        self.assertIsInstance(driver, notifiers.TaglessNotifier)
+        self.assertEqual(sent, [(1, 'increment', 'label')])
+        self.assertFalse(driver.blocking)
+
+    def test_tagless_socket_factory(self):
+        class OldNotifier(object):
+            socket_factory = None
+
+            def __call__(self, value, vtype, label):
+                pass
+
+        inner = OldNotifier()
+        driver = notifiers.adapt(inner)
+        driver.socket_factory = 'factory'
+
+        self.assertEqual(inner.socket_factory, 'factory')
+        self.assertEqual(driver.socket_factory, 'factory')
+        self.assertNotIn('socket_factory', vars(driver))
+
 
 class TestDebugNotifier(tests.LoggingTestCase):
-    imports = {'NotifierTest': NotifierTest}
+    imports = {
+        'NotifierTest': NotifierTest,
+        'StatsDNotifier': notifiers.StatsDNotifier,
+        }
 
     def test_initialize(self):
         notifier = notifiers.DebugNotifier({'real_driver': 'NotifierTest'})
@@ -69,6 +165,307 @@ class TestDebugNotifier(tests.LoggingTestCase):
         self.assertEqual(self.logmsg[2],
                          "DebugNotifier: Statistic label: 'label'")
 
+    def test_socket_factory(self):
+        notifier = notifiers.DebugNotifier(dict(
+                real_driver='StatsDNotifier', host='host', port='1'))
+        notifier.socket_factory = 'factory'
+
+        self.assertEqual(notifier.driver.socket_factory, 'factory')
+        self.assertEqual(notifier.socket_factory, 'factory')
+
+        # Drivers without sockets are left alone
+        notifier = notifiers.DebugNotifier({'real_driver': 'NotifierTest'})
+        notifier.socket_factory = 'factory'
+        self.assertIsNone(notifier.socket_factory)
+
+
+class SharedNotifier(NotifierTest):
+    wire_format = 'shared'
+
+    def __init__(self, config):
+        super(SharedNotifier, self).__init__(config)
+
+        self.formatted = 0
+
+    def default(self, value, label):
+        self.formatted += 1
+        return super(SharedNotifier, self).default(value, label)
+
+
+class TestFanoutNotifier(tests.LoggingTestCase):
+    def test_format_once(self):
+        drivers = [SharedNotifier({}), SharedNotifier({}), NotifierTest({})]
+        notifier = notifiers.FanoutNotifier({}, drivers)
+        notifier('result', 'spam', 'label')
+
+        self.assertEqual([driver.sent_msg for driver in drivers],
+                         ["default/'result'/'label'"] * 3)
+        self.assertEqual(drivers[0].formatted, 1)
+        self.assertEqual(drivers[1].formatted, 0)
+
+    def test_subclass_formats(self):
+        class UpperNotifier(SharedNotifier):
+            def default(self, value, label):
+                return 'upper/%r/%r' % (value, label.upper())
+
+        class PlainNotifier(SharedNotifier):
+            pass
+
+        drivers = [SharedNotifier({}), UpperNotifier({}), PlainNotifier({})]
+        notifier = notifiers.FanoutNotifier({}, drivers)
+        notifier('result', 'spam', 'label')
+
+        self.assertEqual([driver.sent_msg for driver in drivers], [
+                "default/'result'/'label'", "upper/'result'/'LABEL'",
+                "default/'result'/'label'"])
+        self.assertEqual(drivers[0].formatted, 1)
+        self.assertEqual(drivers[2].formatted, 0)
+
+    def test_blocking(self):
+        trace = notifiers.TraceNotifier(dict(path='unused'))
+
+        self.assertTrue(notifiers.FanoutNotifier(
+                {}, [trace, NotifierTest({})]).blocking)
+        self.assertFalse(notifiers.FanoutNotifier({}, [trace]).blocking)
+
+    def test_driver_error(self):
+        failing = NotifierTest({})
+        other = NotifierTest({})
+
+        def fail(body):
+            raise ValueError('boom')
+
+        self.stubs.Set(failing, 'send', fail)
+        self.stubs.Set(notifiers.LOG, 'exception',
+                       lambda msg: self.logmsg.append(msg))
+        notifier = notifiers.FanoutNotifier({}, [failing, other])
+        notifier('result', 'test', 'label')
+
+        self.assertEqual(other.sent_msg, "test/'result'/'label'")
+        self.assertEqual(self.logmsg, [
+                "FanoutNotifier: Error notifying 'NotifierTest'"])
+
+    def test_socket_factory(self):
+        drivers = [notifiers.StatsDNotifier(dict(host='host', port='1')),
+                   NotifierTest({})]
+        notifier = notifiers.FanoutNotifier({}, drivers)
+        notifier.socket_factory = 'factory'
+
+        self.assertEqual(drivers[0].socket_factory, 'factory')
+        self.assertEqual(notifier.socket_factory, 'factory')
+
+
+class TestAsyncNotifier(tests.LoggingTestCase):
+    imports = {'NotifierTest': NotifierTest}
+
+    def test_initialize(self):
+        notifier = notifiers.AsyncNotifier({'real_driver': 'NotifierTest'})
+
+        self.assertEqual(notifier.driver_name, 'NotifierTest')
+        self.assertIsInstance(notifier.driver, NotifierTest)
+        self.assertEqual(notifier.mode, 'thread')
+        self.assertEqual(notifier.queue_size, 10000)
+        self.assertFalse(notifier.blocking)
+
+    def test_wrap_driver(self):
+        driver = NotifierTest({})
+        notifier = notifiers.AsyncNotifier({}, driver=driver)
+
+        self.assertEqual(notifier.driver, driver)
+        self.assertEqual(notifier.format('result', 'test', 'label'),
+                         "test/'result'/'label'")
+
+    def test_call_queues(self):
+        notifier = notifiers.AsyncNotifier({'real_driver': 'NotifierTest'})
+        notifier._started = True
+        notifier('result', 'test', 'label')
+
+        self.assertEqual(notifier.driver.sent_msg, None)
+        self.assertTrue(notifier.flush())
+        self.assertEqual(notifier.driver.sent_msg, "test/'result'/'label'")
+        self.assertFalse(notifier.flush())
+
+    def test_call_tags(self):
+        notifier = notifiers.AsyncNotifier({'real_driver': 'NotifierTest'})
+        notifier._started = True
+        notifier('result', 'test', 'label', labels.intern_tags(dict(a='b')))
+        notifier.flush()
+
+        self.assertEqual(notifier.driver.sent_msg, "test/'result'/'label.b'")
+
+    def test_transaction_id(self):
+        notifier = notifiers.AsyncNotifier(
+            {'url': 'http://example.com:1234/data'},
+            driver=notifiers.StackTachNotifier(
+                {'url': 'http://example.com:1234/data'}))
+        notifier._started = True
+        sent = []
+        self.stubs.Set(notifier.driver, 'send', sent.append)
+
+        notifier.bump_transaction_id()
+        notifier(1.5, 'exec_time', 'label_{%TX_ID%}')
+        notifier.bump_transaction_id()
+        notifier.flush()
+
+        self.assertEqual(sent, ['["label_1", 1.5]'])
+        self.assertEqual(notifier.transaction_id, 2)
+
+    def test_queue_full(self):
+        notifier = notifiers.AsyncNotifier({'real_driver': 'NotifierTest',
+                                            'queue_size': '1'})
+        notifier._started = True
+        notifier('first', 'test', 'label')
+        notifier('second', 'test', 'label')
+
+        self.assertEqual(notifier.dropped, 1)
+        notifier.flush()
+        self.assertEqual(notifier.driver.sent_msg, "test/'first'/'label'")
+
+    def test_driver_error(self):
+        notifier = notifiers.AsyncNotifier({'real_driver': 'NotifierTest'})
+        notifier._started = True
+
+        def fail(body):
+            raise ValueError('boom')
+
+        self.stubs.Set(notifier.driver, 'send', fail)
+        self.stubs.Set(notifiers.LOG, 'exception',
+                       lambda msg: self.logmsg.append(msg))
+        notifier('result', 'test', 'label')
+        notifier.flush()
+
+        self.assertEqual(self.logmsg, [
+                "AsyncNotifier: Error notifying 'NotifierTest'"])
+
+    def test_start_once(self):
+        spawned = []
+        self.stubs.Set(utils, 'spawn',
+                       lambda func, *args, **kwargs: spawned.append(kwargs))
+        notifier = notifiers.AsyncNotifier({'real_driver': 'NotifierTest'})
+        notifier.start()
+        notifier.start()
+
+        self.assertEqual(spawned, [dict(green=False)])
+
+    def test_start_green_io(self):
+        spawned = []
+        self.stubs.Set(utils, 'spawn',
+                       lambda func, *args, **kwargs: spawned.append(kwargs))
+        notifier = notifiers.AsyncNotifier(
+            {'lag_interval': '0'},
+            driver=notifiers.StackTachNotifier({'url': 'http://example.com'}))
+        self.stubs.Set(utils, 'green_library', lambda: 'eventlet')
+        self.stubs.Set(utils, 'sleeper', lambda green=False: None)
+        notifier.start()
+
+        self.assertEqual(spawned, [dict(green=True)])
+
+    def test_native_io(self):
+        web = notifiers.StackTachNotifier({'url': 'http://example.com'})
+        sock = notifiers.StatsDNotifier({'host': 'localhost', 'port': '8125'})
+
+        self.assertFalse(web.native_io)
+        self.assertTrue(sock.native_io)
+        self.assertTrue(notifiers.FanoutNotifier({}, [sock]).native_io)
+        self.assertFalse(notifiers.FanoutNotifier({}, [sock, web]).native_io)
+
+    def test_background_sender(self):
+        notifier = notifiers.AsyncNotifier({'real_driver': 'NotifierTest',
+                                            'poll_interval': '0.01'})
+        notifier('result', 'test', 'label')
+
+        for _i in range(100):
+            if notifier.driver.sent_msg:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(notifier.driver.sent_msg, "test/'result'/'label'")
+
+
+class TestTraceNotifier(tests.TestCase):
+    def setUp(self):
+        super(TestTraceNotifier, self).setUp()
+
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'trace.json')
+        self.flushes = []
+        self.stubs.Set(utils.ticker, 'every',
+                       lambda interval, func: self.flushes.append(func))
+
+    def tearDown(self):
+        super(TestTraceNotifier, self).tearDown()
+        shutil.rmtree(self.tempdir)
+
+    def read(self, path=None):
+        with open(path or self.path) as f:
+            return json.load(f)
+
+    def test_exec_time(self):
+        notifier = notifiers.TraceNotifier(dict(path=self.path))
+        now = time.time()
+        notifier(0.5, 'exec_time', 'label')
+        notifier.close()
+
+        events = self.read()
+        self.assertEqual(len(events), 1)
+        event = events[0]
+        self.assertEqual(event['name'], 'label')
+        self.assertEqual(event['ph'], 'X')
+        self.assertEqual(event['pid'], os.getpid())
+        self.assertEqual(event['dur'], 500000)
+        self.assertAlmostEqual(event['ts'] / 1e6, now - 0.5, delta=0.1)
+        self.assertNotIn('args', event)
+        self.assertEqual(self.flushes, [notifier.flush])
+
+    def test_counter_and_depth(self):
+        notifier = notifiers.TraceNotifier(dict(path=self.path))
+        span = context.push_span('outer', time.time())
+        try:
+            notifier(0.5, 'exec_time', 'inner')
+            notifier(0.1, 'exec_time', 'inner.self')
+        finally:
+            context.pop_span(span, time.time())
+        notifier(3, 'increment', 'count')
+        notifier.close()
+
+        events = self.read()
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0]['args'], {'depth': 1})
+        self.assertEqual(events[1]['ph'], 'C')
+        self.assertEqual(events[1]['args'], {'value': 3})
+
+    def test_tags(self):
+        notifier = notifiers.TraceNotifier(dict(path=self.path))
+        notifier(0.5, 'exec_time', 'label', labels.intern_tags(dict(a='b')))
+        notifier.close()
+
+        self.assertEqual(self.read()[0]['args'], {'a': 'b'})
+
+    def test_rotate(self):
+        notifier = notifiers.TraceNotifier(dict(path=self.path,
+                                                max_bytes='10',
+                                                backup_count='1'))
+        for i in range(3):
+            notifier(0.5, 'exec_time', 'label%d' % i)
+        notifier.close()
+
+        self.assertEqual([e['name'] for e in self.read(self.path + '.1')],
+                         ['label2'])
+        self.assertEqual(self.read(), [])
+        self.assertFalse(os.path.exists(self.path + '.2'))
+        self.assertEqual(len(self.flushes), 1)
+
+    def test_duration(self):
+        notifier = notifiers.TraceNotifier(dict(path=self.path,
+                                                duration='60'))
+        notifier(0.5, 'exec_time', 'label')
+        notifier.stop_time = time.time()
+        notifier(0.5, 'exec_time', 'late')
+        notifier.flush()
+        notifier(0.5, 'exec_time', 'later')
+
+        self.assertEqual([e['name'] for e in self.read()], ['label'])
+
 
 class FakeSocket(object):
     throw = None
@@ -78,8 +475,12 @@ class FakeSocket(object):
         self.sock_type = sock_type
         self.host = None
         self.port = None
+        self.timeout = None
         self.buffer = []
 
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
     def connect(self, (host, port)):
         self.host = host
         self.port = port
@@ -97,12 +498,59 @@ class UdpSocketNotifier(notifiers.SocketNotifier):
     sock_type = 'udp'
 
 
+class TestPrometheusNotifier(tests.LoggingTestCase):
+    def setUp(self):
+        super(TestPrometheusNotifier, self).setUp()
+
+        self.spawned = []
+        self.stubs.Set(utils, 'spawn',
+                       lambda func, *args: self.spawned.append(func))
+
+    def test_call(self):
+        notifier = notifiers.PrometheusNotifier(dict(port='0',
+                                                     buckets='1, 0.5'))
+        self.addCleanup(lambda: notifier.sock.close())
+        notifier(0.25, 'exec_time', 'label')
+        notifier(2, 'increment', 'label')
+
+        self.assertEqual(self.spawned, [prometheus.serve])
+        self.assertEqual(notifier.registry.buckets, (0.5, 1.0))
+        self.assertIn('tach_label_seconds_count 1\n',
+                      notifier.registry.render())
+        self.assertIn('tach_label_total 2.0\n', notifier.registry.render())
+
+    def test_listen_error(self):
+        def fail(port, host, unix_socket):
+            raise socket.error(98, 'Address already in use')
+
+        self.stubs.Set(prometheus, 'listen', fail)
+        notifier = notifiers.PrometheusNotifier(dict(port='9999'))
+        notifier(1, 'increment', 'label')
+        notifier(1, 'increment', 'label')
+
+        self.assertEqual(self.spawned, [])
+        self.assertEqual(self.logmsg, [
+                "PrometheusNotifier: Error listening on 127.0.0.1:9999: "
+                "[Errno 98] Address already in use"])
+        self.assertIn('tach_label_total 2.0\n', notifier.registry.render())
+
+
 class TestSocketNotifierBase(tests.LoggingTestCase):
     def setUp(self):
         super(TestSocketNotifierBase, self).setUp()
 
         self.config = dict(host='test.example.com', port='12345')
 
+        def fake_getaddrinfo(host, port, family, sock_type):
+            self.resolved.append(host)
+            return [(family, sock_type, 0, '', (host, port))]
+
+        self.resolved = []
+        self.stubs.Set(socket, 'getaddrinfo', fake_getaddrinfo)
+        self.ticker = utils.Ticker()
+        self.stubs.Set(self.ticker, 'start', lambda: None)
+        self.stubs.Set(utils, 'ticker', self.ticker)
+
 
 class TestSocketNotifier(TestSocketNotifierBase):
     def setUp(self):
@@ -159,17 +607,70 @@ class TestSocketNotifier(TestSocketNotifierBase):
 
         self.assertEqual(notifier._sock.buffer, ['this is a test'])
 
+    def test_connect_timeout(self):
+        timeouts = []
+
+        def connect(sock, address):
+            timeouts.append(sock.timeout)
+
+        self.stubs.Set(FakeSocket, 'connect', connect)
+        notifier = notifiers.SocketNotifier(dict(self.config,
+                                                 connect_timeout='0.25'))
+
+        self.assertEqual(notifier.sock.timeout, None)
+        self.assertEqual(timeouts, [0.25])
+
     def test_send_reopen(self):
+        self.stubs.Set(time, 'time', lambda: 1000.0)
         notifier = notifiers.SocketNotifier(self.config)
         sock = notifier.sock
         sock.throw = socket.error(1, 2, 3)
-        notifier.send('this is a test')
+        notifier.send('dropped')
 
+        # The socket is reopened in the background, not by the caller
         self.assertEqual(sock.open, False)
-        self.assertEqual(self.logmsg, [])
+        self.assertEqual(notifier._sock, None)
+        self.assertEqual(notifier.dropped, 1)
+        self.assertEqual(len(self.logmsg), 1)
+
+        self.stubs.Set(time, 'time', lambda: 1000.5)
+        notifier._reconnect()
+        notifier.send('sent')
         self.assertNotEqual(notifier._sock, sock)
-        self.assertEqual(notifier._sock.open, True)
-        self.assertEqual(notifier._sock.buffer, ['this is a test'])
+        self.assertEqual(notifier._sock.buffer, ['sent'])
+
+    def test_report_dropped(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+        notifier._fail()
+        notifier(1, 'increment', 'label')
+        notifier(1, 'increment', 'label')
+
+        self.assertEqual(self.ticker._tasks[1][:3:2],
+                         [10.0, notifier.report_dropped])
+
+        notifier._retry_at = None
+        notifier.report_dropped()
+        notifier.report_dropped()
+        self.assertEqual(notifier._sock.buffer, ['tach.dropped:2|c'])
+
+    def test_report_dropped_outage(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+        notifier._fail()
+        notifier(1, 'increment', 'label')
+        notifier.report_dropped()
+        notifier.report_dropped()
+
+        self.assertEqual(notifier.dropped, 1)
+        self.assertEqual(notifier._sock, None)
+
+        # A failing report isn't counted in the next one
+        notifier._retry_at = None
+        notifier.sock.throw = socket.error(1, 2, 3)
+        notifier.report_dropped()
+        notifier._retry_at = None
+        notifier.report_dropped()
+        self.assertEqual(notifier.dropped, 2)
+        self.assertEqual(notifier._sock, None)
 
     def test_send_fail(self):
         self.stubs.Set(FakeSocket, 'throw', socket.error(1, 2, 3))
@@ -181,6 +682,259 @@ class TestSocketNotifier(TestSocketNotifierBase):
                 "(test.example.com, 12345): [Errno 1] 2: 3"])
         self.assertEqual(notifier._sock, None)
 
+    def test_circuit_open(self):
+        self.stubs.Set(FakeSocket, 'throw', socket.error(1, 2, 3))
+        self.stubs.Set(time, 'time', lambda: 1000.0)
+        notifier = notifiers.SocketNotifier(self.config)
+        notifier.send('first')
+        notifier.send('second')
+
+        # No more connection attempts until the backoff is over
+        self.assertEqual(notifier._retry_at, 1000.5)
+        self.assertEqual(notifier.dropped, 2)
+        self.assertEqual(notifier._sock, None)
+        self.assertEqual(self.ticker._tasks[0][2], notifier._reconnect)
+        self.assertEqual(len(self.logmsg), 1)
+
+    def test_connect_backoff(self):
+        def fail_connect(sock, address):
+            raise socket.error(111, 'Connection refused')
+
+        self.stubs.Set(FakeSocket, 'connect', fail_connect)
+        self.stubs.Set(time, 'time', lambda: 1000.0)
+        notifier = notifiers.SocketNotifier(self.config)
+        notifier.send('first')
+        notifier._reconnect()
+        self.stubs.Set(time, 'time', lambda: 1000.5)
+        notifier._reconnect()
+        self.stubs.Set(time, 'time', lambda: 1001.5)
+        notifier._reconnect()
+
+        self.assertEqual(notifier._failures, 3)
+        self.assertEqual(notifier._retry_at, 1003.5)
+        self.assertEqual(self.resolved, ['test.example.com'] * 3)
+        self.assertEqual(self.logmsg, [
+                "SocketNotifier: Error connecting to server "
+                "(test.example.com, 12345): [Errno 111] Connection refused"])
+
+    def test_connect_backoff_max(self):
+        notifier = notifiers.SocketNotifier(dict(self.config,
+                                                 reconnect_max='2'))
+        self.stubs.Set(time, 'time', lambda: 1000.0)
+        for i in range(5):
+            notifier._fail()
+
+        self.assertEqual(notifier._retry_at, 1002.0)
+        self.assertEqual(len(self.ticker._tasks), 1)
+
+    def test_reconnect(self):
+        self.stubs.Set(time, 'time', lambda: 1000.0)
+        notifier = notifiers.SocketNotifier(self.config)
+        notifier._fail()
+        notifier.send('dropped')
+        self.stubs.Set(time, 'time', lambda: 1000.5)
+        notifier._reconnect()
+        notifier.send('sent')
+
+        self.assertEqual(notifier._sock.buffer, ['sent'])
+        self.assertEqual(notifier._failures, 0)
+        self.assertEqual(notifier._retry_at, None)
+
+    def test_spool(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.config['spool'] = os.path.join(path, 'spool')
+        notifier = notifiers.SocketNotifier(self.config)
+        self.stubs.Set(time, 'time', lambda: 1000.0)
+        notifier._fail()
+        notifier.send('first')
+        notifier.send('second')
+
+        self.assertEqual(len(notifier._spool), 19)
+        self.assertEqual(self.ticker._tasks[1][2], notifier._replay_spool)
+        with open(os.path.join(path, 'spool', 'meta.json')) as fp:
+            self.assertEqual(json.load(fp), {
+                    'driver': 'tach.notifiers.SocketNotifier',
+                    'options': {'host': 'test.example.com',
+                                'port': '12345'}})
+
+        # Nothing is replayed while the circuit is open
+        notifier._replay_spool()
+        self.assertEqual(notifier._sock, None)
+
+        self.stubs.Set(time, 'time', lambda: 1000.5)
+        notifier._reconnect()
+        notifier._replay_spool()
+        self.assertEqual(notifier._sock.buffer, ['first', 'second'])
+        self.assertEqual(len(notifier._spool), 0)
+
+    def test_spool_resumed(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spool.Spool(path).append('left over')
+        self.config['spool'] = path
+        notifier = notifiers.SocketNotifier(self.config)
+        notifier._replay_spool()
+
+        self.assertEqual(notifier._sock.buffer, ['left over'])
+
+    def test_spool_shards(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.config.update(hosts='one:1, two:2', spool=path)
+        notifier = notifiers.SocketNotifier(self.config)
+
+        self.assertEqual([shard.spool_path for shard in notifier.shards],
+                         [os.path.join(path, 'one-1'),
+                          os.path.join(path, 'two-2')])
+        self.assertEqual(notifier.shards[0]._spool_options(), {
+                'host': 'one', 'port': '1'})
+
+    def test_spool_shards_fail(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.config.update(hosts='one:1, two:2', spool=path)
+        notifier = notifiers.StatsDNotifier(self.config)
+        shard = notifier.route('label')
+        shard._fail()
+        notifier(1, 'increment', 'label')
+
+        self.assertEqual(shard.dropped, 1)
+        self.assertEqual(len(shard._spool), 13)
+        self.assertTrue(os.path.isdir(shard.spool_path))
+
+    def test_address_cached(self):
+        notifier = notifiers.SocketNotifier(self.config)
+        notifier.sock
+        del notifier.sock
+        notifier.sock
+
+        self.assertEqual(self.resolved, ['test.example.com'])
+
+
+class TestShardedSocketNotifier(TestSocketNotifierBase):
+    def setUp(self):
+        super(TestShardedSocketNotifier, self).setUp()
+
+        self.config = dict(hosts='one:1, two, three:3', port='2')
+
+        def fake_socket(_family, sock_type):
+            return FakeSocket(sock_type)
+
+        self.stubs.Set(socket, 'socket', fake_socket)
+
+    def test_init(self):
+        notifier = notifiers.SocketNotifier(self.config)
+
+        self.assertEqual([(shard.host, shard.port)
+                          for shard in notifier.shards],
+                         [('one', 1), ('two', 2), ('three', 3)])
+        self.assertEqual((notifier.host, notifier.port), ('one', 1))
+        self.assertEqual(notifier.wire_format, None)
+
+    def test_single_host(self):
+        notifier = notifiers.SocketNotifier(dict(hosts='one:1'))
+
+        self.assertEqual((notifier.host, notifier.port), ('one', 1))
+        self.assertEqual(notifier.shards, None)
+
+    def test_route(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+        for i in range(20):
+            notifier(i, 'increment', 'label%d' % (i % 10))
+
+        sent = {}
+        for shard in notifier.shards:
+            self.assertNotEqual(shard._sock.buffer, [])
+            for body in shard._sock.buffer:
+                sent.setdefault(body.partition(':')[0], set()).add(shard)
+        self.assertEqual(len(sent), 10)
+        self.assertTrue(all(len(shards) == 1 for shards in sent.values()))
+
+    def test_socket_factory(self):
+        notifier = notifiers.SocketNotifier(self.config)
+        notifier.socket_factory = 'factory'
+
+        self.assertEqual([shard.socket_factory for shard in notifier.shards],
+                         ['factory'] * 3)
+
+    def test_shard_state(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+        notifier.format(1, 'increment', 'label')
+
+        for shard in notifier.shards:
+            self.assertIsNot(shard._formatters, notifier._formatters)
+            self.assertEqual(shard._formatters, {})
+
+    def test_shard_subclass(self):
+        self.stubs.Set(time, 'time', lambda: 1000.5)
+        notifier = notifiers.GraphiteNotifier(self.config)
+        shard = notifier.shards[1]
+        shard.dropped = 2
+        shard.report_dropped()
+
+        self.assertIsInstance(shard, notifiers.GraphiteNotifier)
+        self.assertEqual(shard.format(1, 'gauge', 'label'), 'label 1 1000\n')
+        self.assertEqual(shard._sock.buffer, ['tach.dropped 2 1000\n'])
+
+    def test_debug_routes(self):
+        self.imports = {'StatsDNotifier': notifiers.StatsDNotifier}
+        notifier = notifiers.DebugNotifier(dict(self.config,
+                                                real_driver='StatsDNotifier'))
+        for i in range(10):
+            notifier(i, 'increment', 'label%d' % i)
+
+        driver = notifier.driver
+        sent = 0
+        for shard in driver.shards:
+            for body in shard._sock.buffer:
+                self.assertIs(driver.route(body.partition(':')[0]), shard)
+                sent += 1
+        self.assertEqual(sent, 10)
+
+
+class TestSocketNotifierBatch(TestSocketNotifierBase):
+    def setUp(self):
+        super(TestSocketNotifierBatch, self).setUp()
+
+        def fake_socket(_family, sock_type):
+            return FakeSocket(sock_type)
+
+        self.stubs.Set(socket, 'socket', fake_socket)
+        self.config['batch_size'] = '20'
+
+    def test_batch_size(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+        notifier(1, 'increment', 'label')
+        notifier(2, 'increment', 'label')
+
+        self.assertEqual(notifier._sock, None)
+        self.assertEqual(self.ticker._tasks[0][2], notifier.flush)
+
+        notifier(3, 'increment', 'label')
+        self.assertEqual(notifier._sock.buffer,
+                         ['label:1|c\nlabel:2|c\nlabel:3|c'])
+
+    def test_flush(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+        notifier(1, 'increment', 'label')
+        self.ticker.tick(self.ticker._tasks[0][1])
+
+        self.assertEqual(notifier._sock.buffer, ['label:1|c'])
+        notifier.flush()
+        self.assertEqual(notifier._sock.buffer, ['label:1|c'])
+
+    def test_shard_buffers(self):
+        self.config.update(hosts='one, two')
+        notifier = notifiers.StatsDNotifier(self.config)
+        notifier(1, 'increment', 'label')
+        notifier.flush()
+
+        shard = notifier.route('label')
+        self.assertEqual(shard._sock.buffer, ['label:1|c'])
+        self.assertEqual([other._sock for other in notifier.shards
+                          if other is not shard], [None])
+
 
 class TestGraphiteNotifier(TestSocketNotifierBase):
     def test_default(self):
@@ -194,6 +948,42 @@ class TestGraphiteNotifier(TestSocketNotifierBase):
         self.assertEqual(parts[1], 'value')
         self.assertAlmostEqual(int(parts[2]), cur_time, delta=1)
 
+    def test_gauge(self):
+        notifier = notifiers.GraphiteNotifier(self.config)
+        result = notifier.format(3, 'gauge', 'label')
+
+        self.assertEqual(result.split()[:2], ['label', '3'])
+
+    def test_timestamp_ticks(self):
+        self.stubs.Set(time, 'time', lambda: 1000.5)
+        notifier = notifiers.GraphiteNotifier(self.config)
+
+        self.assertEqual(notifier.format(1, 'exec_time', 'label'),
+                         'label 1 1000\n')
+        self.assertEqual(self.ticker._tasks[0][1:],
+                         [1001.5, notifier._update_stamp])
+
+        self.stubs.Set(time, 'time', lambda: 1001.5)
+        self.assertEqual(notifier.format(1, 'exec_time', 'label'),
+                         'label 1 1000\n')
+        self.ticker.tick()
+        self.assertEqual(notifier.format(1, 'exec_time', 'label'),
+                         'label 1 1001\n')
+
+    def test_sanitize(self):
+        notifier = notifiers.GraphiteNotifier(self.config)
+        result = notifier.format(3, 'gauge', 'web /servers/1')
+
+        self.assertEqual(result.split()[:2], ['web__servers_1', '3'])
+
+    def test_tags(self):
+        notifier = notifiers.GraphiteNotifier(self.config)
+        tags = labels.intern_tags([('region', 'east'), ('method', 'GET')])
+        result = notifier.format(3, 'gauge', 'label', tags)
+
+        self.assertEqual(result.split()[:2],
+                         ['label;method=GET;region=east', '3'])
+
 
 class TestStatsDNotifier(TestSocketNotifierBase):
     def test_exec_time(self):
@@ -208,6 +998,100 @@ class TestStatsDNotifier(TestSocketNotifierBase):
 
         self.assertEqual(result, 'label:2|c')
 
+    def test_gauge(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+        result = notifier.gauge(3, 'label')
+
+        self.assertEqual(result, 'label:3|g')
+
+    def test_type_methods_cached(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+        notifier.exec_time(1, 'label')
+        notifier.increment(1, 'label')
+
+        self.assertEqual(sorted(notifier._formatters), [
+                ('label', 'exec_time', None), ('label', 'increment', None)])
+
+    def test_format(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+
+        self.assertEqual(notifier.format(0.5, 'exec_time', 'a:b|c'),
+                         'a_b_c:500.0|ms')
+        self.assertEqual(notifier.format(2, 'increment', 'a:b|c'),
+                         'a_b_c:2|c')
+        self.assertEqual(notifier.format(2, 'unknown', 'label'), None)
+
+    def test_tags(self):
+        notifier = notifiers.StatsDNotifier(self.config)
+        tags = labels.intern_tags(dict(region='east', method='GET'))
+
+        self.assertEqual(notifier.format(0.5, 'exec_time', 'label', tags),
+                         'label:500.0|ms|#method:GET,region:east')
+        self.assertEqual(notifier.format(2, 'increment', 'label', tags),
+                         'label:2|c|#method:GET,region:east')
+
+
+class FakeResponse(object):
+    def read(self):
+        return ''
+
+
+class TestWebServiceNotifier(tests.LoggingTestCase):
+    def setUp(self):
+        super(TestWebServiceNotifier, self).setUp()
+
+        self.requests = []
+        self.error = None
+
+        def fake_urlopen(req, timeout):
+            self.requests.append((req, timeout))
+            if self.error:
+                raise self.error
+            return FakeResponse()
+
+        self.stubs.Set(urllib2, 'urlopen', fake_urlopen)
+        self.stubs.Set(time, 'time', lambda: 1000.0)
+        self.notifier = notifiers.StackTachNotifier(
+            dict(url='http://example.com:1234/data'))
+
+    def test_deliver(self):
+        self.notifier(1, 'exec_time', 'label')
+
+        req, timeout = self.requests[0]
+        self.assertEqual(json.loads(req.get_data()), ['label', 1])
+        self.assertEqual(req.get_header('Content-type'), 'application/json')
+        self.assertEqual(timeout, 5.0)
+        self.assertEqual(self.notifier.dropped, 0)
+
+    def test_backoff(self):
+        self.error = urllib2.URLError('refused')
+        self.notifier.send('first')
+        self.notifier.send('second')
+
+        # No request is attempted until the backoff is over
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.notifier.dropped, 2)
+        self.assertEqual(self.notifier._retry_at, 1000.5)
+        self.assertEqual(len(self.logmsg), 1)
+
+        self.error = None
+        self.stubs.Set(time, 'time', lambda: 1000.5)
+        self.assertTrue(self.notifier.deliver('third'))
+        self.assertEqual(self.notifier._retry_at, None)
+
+    def test_server_error(self):
+        self.error = urllib2.HTTPError('url', 503, 'Unavailable', {}, None)
+
+        self.assertFalse(self.notifier.deliver('body'))
+        self.assertEqual(self.notifier._failures, 1)
+
+    def test_rejected(self):
+        self.error = urllib2.HTTPError('url', 400, 'Bad Request', {}, None)
+
+        self.assertTrue(self.notifier.deliver('body'))
+        self.assertEqual(self.notifier.dropped, 1)
+        self.assertEqual(self.notifier._retry_at, None)
+
 
 class TestStackTachNotifier(tests.TestCase):
     def test_exec_time(self):
@@ -225,3 +1109,12 @@ class TestStackTachNotifier(tests.TestCase):
         notifier.bump_transaction_id()
         payload = notifier.exec_time(12.3456789, "label_{%TX_ID%}")
         self.assertEqual(payload, '["label_2", 12.345678899999999]')
+
+    def test_format_with_txid(self):
+        notifier = notifiers.StackTachNotifier(
+                                    dict(url='http://example.com:1234/data'))
+        notifier.format(1, 'exec_time', 'label_{%TX_ID%}')
+        notifier.bump_transaction_id()
+        payload = notifier.format(1, 'exec_time', 'label_{%TX_ID%}')
+
+        self.assertEqual(json.loads(payload), ['label_2', 1])
@@ -0,0 +1,55 @@
+from tach import config
+from tach import metrics
+from tach import packs
+
+import tests
+from tests import fake_module
+
+
+class FakePack(packs.Pack):
+    def attach(self):
+        self.patch(fake_module, 'function', lambda arg: 'patched')
+
+
+class TestLoad(tests.TestCase):
+    imports = {
+        'FakePack': FakePack,
+        'tach.metrics.ExecTime': metrics.ExecTime,
+        }
+
+    def setUp(self):
+        super(TestLoad, self).setUp()
+
+        self.cfg = config.Config(None)
+
+    def test_load(self):
+        pack = packs.load(self.cfg, 'pack:fake', [
+                ('driver', 'FakePack'),
+                ('label', 'lib'),
+                ('notifier', 'statsd')])
+        try:
+            self.assertIsInstance(pack, FakePack)
+            self.assertEqual(pack.name, 'fake')
+            self.assertEqual(pack.options, dict(label='lib',
+                                                notifier='statsd'))
+            self.assertIs(self.cfg.methods['lib'], pack.method)
+            self.assertEqual(pack.method._notifier, 'statsd')
+            self.assertIsInstance(pack.method.metric, metrics.ExecTime)
+            self.assertEqual(fake_module.function(1), 'patched')
+        finally:
+            pack.detach()
+
+        self.assertEqual(fake_module.function(1),
+                         ('function', dict(args=(1,), kwargs={})))
+
+    def test_load_unknown(self):
+        self.assertRaisesRegexp(Exception,
+                                'Unknown instrumentation pack: fake',
+                                packs.load, self.cfg, 'pack:fake', [])
+
+    def test_base_attach(self):
+        pack = packs.Pack(self.cfg, 'base', {})
+        pack.attach()
+        pack.detach()
+
+        self.assertEqual(pack._patches, [])
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from tach import profiler
+
+import tests
+
+
+def target(started, finish):
+    started.set()
+    finish.wait()
+
+
+def other(started, finish):
+    started.set()
+    finish.wait()
+
+
+class TestSamplingProfiler(tests.TestCase):
+    def setUp(self):
+        super(TestSamplingProfiler, self).setUp()
+
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, '{label}-{time}.folded')
+        self.spawned = []
+        self.stubs.Set(profiler.utils, 'spawn',
+                       lambda *args: self.spawned.append(args))
+
+    def tearDown(self):
+        super(TestSamplingProfiler, self).tearDown()
+        shutil.rmtree(self.tempdir)
+
+    def make_profiler(self, **kwargs):
+        return profiler.SamplingProfiler('label', target.func_code,
+                                         self.path, **kwargs)
+
+    def run_threads(self, func):
+        finish = threading.Event()
+        threads = []
+        for func_ in (target, other):
+            started = threading.Event()
+            thread = threading.Thread(target=func_, args=(started, finish))
+            thread.start()
+            started.wait()
+            threads.append(thread)
+
+        try:
+            func()
+        finally:
+            finish.set()
+            for thread in threads:
+                thread.join()
+
+    def test_sample(self):
+        prof = self.make_profiler()
+        self.run_threads(prof.sample)
+
+        self.assertEqual(len(prof.stacks), 1)
+        stack, count = prof.stacks.items()[0]
+        frames = stack.split(';')
+        self.assertEqual(frames[0], 'label')
+        self.assertEqual(frames[1], 'test_profiler.py:target')
+        self.assertEqual(count, 1)
+
+    def test_write(self):
+        prof = self.make_profiler()
+        prof._start_time = 1234
+        prof.stacks = {'label;a.py:f': 3, 'label;a.py:f;b.py:g': 1}
+        path = prof.write()
+
+        self.assertEqual(os.path.basename(path), 'label-1234.folded')
+        with open(path) as f:
+            self.assertEqual(f.read(),
+                             'label;a.py:f 3\nlabel;a.py:f;b.py:g 1\n')
+
+    def test_trigger(self):
+        prof = self.make_profiler(threshold=1.0, cooldown=300)
+        self.assertEqual(prof.threshold, 1.0)
+
+        prof.trigger()
+        self.assertTrue(prof.running)
+        self.assertEqual(len(self.spawned), 1)
+
+        # Cooling down
+        prof.running = False
+        prof.trigger()
+        self.assertFalse(prof.running)
+
+    def test_no_threshold(self):
+        prof = self.make_profiler()
+
+        self.assertEqual(prof.threshold, float('inf'))
+
+    def test_run(self):
+        prof = self.make_profiler(duration=0.05, hz=1000)
+        prof.running = True
+        prof._start_time = 1234
+        prof._stop_time = 0
+        self.run_threads(lambda: prof._run(lambda interval: None))
+
+        self.assertFalse(prof.running)
+        self.assertTrue(os.path.exists(
+                os.path.join(self.tempdir, 'label-1234.folded')))
@@ -0,0 +1,157 @@
+import os
+import shutil
+import socket
+import tempfile
+
+from tach import labels
+from tach import prometheus
+
+import tests
+
+
+class TestRegistry(tests.TestCase):
+    def test_counter(self):
+        registry = prometheus.Registry()
+        registry.observe(1, 'increment', 'nova.api')
+        registry.observe(2, 'increment', 'nova.api')
+
+        self.assertEqual(registry.render(),
+                         '# TYPE tach_nova_api_total counter\n'
+                         'tach_nova_api_total 3.0\n')
+
+    def test_gauge(self):
+        registry = prometheus.Registry(namespace='app')
+        registry.observe(5, 'gauge', 'inflight')
+        registry.observe(2, 'gauge', 'inflight')
+
+        self.assertEqual(registry.render(),
+                         '# TYPE app_inflight gauge\n'
+                         'app_inflight 2.0\n')
+
+    def test_none_ignored(self):
+        registry = prometheus.Registry()
+        registry.observe(None, 'gauge', 'missing')
+        registry.observe(1, 'gauge', 'present')
+        registry.observe(None, 'gauge', 'present')
+
+        self.assertEqual(registry.render(),
+                         '# TYPE tach_present gauge\n'
+                         'tach_present 1.0\n')
+
+    def test_sanitized_collisions(self):
+        registry = prometheus.Registry()
+        registry.observe(1, 'increment', 'a.b')
+        registry.observe(2, 'increment', 'a-b')
+        registry.observe(3, 'gauge', 'a.b_total')
+
+        self.assertEqual(registry.render(),
+                         '# TYPE tach_a_b_total counter\n'
+                         'tach_a_b_total 3.0\n'
+                         '# TYPE tach_a_b_total_2 gauge\n'
+                         'tach_a_b_total_2 3.0\n')
+
+    def test_histogram(self):
+        registry = prometheus.Registry(buckets=(1, 0.1))
+        for value in (0.05, 0.5, 0.1, 5):
+            registry.observe(value, 'exec_time', 'call')
+
+        self.assertEqual(registry.render(),
+                         '# TYPE tach_call_seconds histogram\n'
+                         'tach_call_seconds_bucket{le="0.1"} 2\n'
+                         'tach_call_seconds_bucket{le="1.0"} 3\n'
+                         'tach_call_seconds_bucket{le="+Inf"} 4\n'
+                         'tach_call_seconds_sum 5.65\n'
+                         'tach_call_seconds_count 4\n')
+
+    def test_tags(self):
+        registry = prometheus.Registry(buckets=(1,))
+        registry.observe(0.5, 'exec_time', 'call',
+                         labels.intern_tags({'method': 'GET'}))
+        registry.observe(1, 'increment', 'call',
+                         labels.intern_tags({'path': 'a"b'}))
+        registry.observe(2, 'increment', 'call')
+
+        self.assertEqual(registry.render(),
+                         '# TYPE tach_call_seconds histogram\n'
+                         'tach_call_seconds_bucket{method="GET",le="1.0"} 1\n'
+                         'tach_call_seconds_bucket{method="GET",le="+Inf"} 1\n'
+                         'tach_call_seconds_sum{method="GET"} 0.5\n'
+                         'tach_call_seconds_count{method="GET"} 1\n'
+                         '# TYPE tach_call_total counter\n'
+                         'tach_call_total 2.0\n'
+                         'tach_call_total{path="a\\"b"} 1.0\n')
+
+    def test_render_cached(self):
+        registry = prometheus.Registry()
+        registry.observe(1, 'increment', 'call')
+        text = registry.render()
+
+        self.assertIs(registry.render(), text)
+        registry.observe(1, 'increment', 'call')
+        self.assertIsNot(registry.render(), text)
+
+    def test_max_series(self):
+        registry = prometheus.Registry(max_series=1)
+        registry.observe(1, 'increment', 'one')
+        registry.observe(1, 'increment', 'two')
+        registry.observe(1, 'increment', 'one')
+
+        self.assertEqual(registry.dropped, 1)
+        self.assertEqual(registry.render(),
+                         '# TYPE tach_one_total counter\n'
+                         'tach_one_total 2.0\n')
+
+
+class TestServer(tests.TestCase):
+    def setUp(self):
+        super(TestServer, self).setUp()
+
+        self.registry = prometheus.Registry()
+        self.registry.observe(1, 'increment', 'call')
+
+    def test_scrape(self):
+        sock = prometheus.listen(0)
+        self.addCleanup(sock.close)
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(client.close)
+        client.connect(sock.getsockname())
+        client.sendall('GET /metrics HTTP/1.1\r\n\r\n')
+        server, _address = sock.accept()
+        prometheus.handle(server, self.registry)
+        server.close()
+
+        response = client.recv(65536)
+        self.assertTrue(response.startswith('HTTP/1.0 200 OK\r\n'))
+        self.assertTrue(response.endswith(
+                '\r\n\r\n# TYPE tach_call_total counter\n'
+                'tach_call_total 1.0\n'))
+
+    def test_not_found(self):
+        sock = prometheus.listen(0)
+        self.addCleanup(sock.close)
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(client.close)
+        client.connect(sock.getsockname())
+        client.sendall('GET /other HTTP/1.1\r\n\r\n')
+        server, _address = sock.accept()
+        prometheus.handle(server, self.registry)
+        server.close()
+
+        self.assertTrue(client.recv(65536).startswith(
+                'HTTP/1.0 404 Not Found\r\n'))
+
+    def test_unix_socket(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        address = os.path.join(path, 'metrics.sock')
+        sock = prometheus.listen(unix_socket=address)
+        self.addCleanup(sock.close)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(client.close)
+        client.connect(address)
+        client.sendall('GET / HTTP/1.0\r\n\r\n')
+        server, _address = sock.accept()
+        prometheus.handle(server, self.registry)
+        server.close()
+
+        self.assertTrue(client.recv(65536).endswith('tach_call_total 1.0\n'))
@@ -0,0 +1,145 @@
+import gc
+import os
+import thread
+import threading
+
+from tach import context
+from tach import runtime
+from tach import utils
+
+import tests
+
+
+class FakeConfig(object):
+    def __init__(self):
+        self.notified = []
+        self.names = []
+
+    def notifier(self, name, nonblocking=False):
+        self.names.append(name)
+        return self.notify
+
+    def notify(self, value, vtype, label, tags=None):
+        self.notified.append((value, vtype, label))
+
+
+class TestRuntimeCollector(tests.TestCase):
+    def setUp(self):
+        super(TestRuntimeCollector, self).setUp()
+
+        self.ticker = utils.Ticker()
+        self.stubs.Set(self.ticker, 'start', lambda: None)
+        self.stubs.Set(utils, 'ticker', self.ticker)
+
+        self.now = 100.0
+        self.stubs.Set(runtime.time, 'time', lambda: self.now)
+        self.stubs.Set(runtime, 'rss', lambda: 4096)
+        self.stubs.Set(runtime, 'open_fds', lambda: 7)
+        self.stubs.Set(runtime, 'threads', lambda: 3)
+        self.stubs.Set(runtime.gc, 'get_count', lambda: (10, 2, 1))
+
+        self.config = FakeConfig()
+        self.collector = runtime.RuntimeCollector(self.config, dict(
+                runtime_interval='5', runtime_notifier='statsd'))
+
+    def collect(self, generation, pause, collected):
+        self.collector._gc_callback('start', dict(generation=generation))
+        self.now += pause
+        self.collector._gc_callback('stop', dict(generation=generation,
+                                                 collected=collected))
+
+    def test_start_stop(self):
+        self.collector.start()
+        self.assertEqual(self.ticker._tasks[0][0], 5.0)
+        if hasattr(gc, 'callbacks'):
+            self.assertIn(self.collector._gc_callback, gc.callbacks)
+
+        self.collector.stop()
+        self.assertEqual(self.ticker._tasks, [])
+        if hasattr(gc, 'callbacks'):
+            self.assertNotIn(self.collector._gc_callback, gc.callbacks)
+
+    def test_report_samples(self):
+        self.collector.report()
+
+        self.assertEqual(self.config.names, ['statsd'])
+        self.assertEqual(self.config.notified, [
+                (4096, 'gauge', 'tach.runtime.rss'),
+                (3, 'gauge', 'tach.runtime.threads'),
+                (7, 'gauge', 'tach.runtime.fds'),
+                (10, 'gauge', 'tach.runtime.gc.gen0.count'),
+                (2, 'gauge', 'tach.runtime.gc.gen1.count'),
+                (1, 'gauge', 'tach.runtime.gc.gen2.count')])
+
+    def test_report_collections(self):
+        self.stubs.Set(runtime, 'rss', lambda: None)
+        self.stubs.Set(runtime, 'open_fds', lambda: None)
+        self.collect(2, 0.5, 30)
+        self.collect(2, 0.25, 10)
+        self.collector.report()
+
+        self.assertEqual(self.config.notified[-4:], [
+                (2, 'increment', 'tach.runtime.gc.gen2.collections'),
+                (40, 'increment', 'tach.runtime.gc.gen2.collected'),
+                (0.75, 'gauge', 'tach.runtime.gc.gen2.pause'),
+                (0.5, 'gauge', 'tach.runtime.gc.gen2.pause_max')])
+
+        # Reset after each report
+        del self.config.notified[:]
+        self.collector.report()
+        self.assertEqual(len(self.config.notified), 4)
+
+    def test_report_attributed(self):
+        self.stubs.Set(runtime, 'rss', lambda: None)
+        self.stubs.Set(runtime, 'open_fds', lambda: None)
+        span = context.push_span('nova.compute.build', self.now)
+        try:
+            self.collect(0, 0.125, 3)
+        finally:
+            context.pop_span(span, self.now)
+        self.collect(0, 0.25, 3)
+        self.collector.report()
+
+        self.assertEqual(self.config.notified[-1],
+                         (0.125, 'gauge', 'nova.compute.build.gc_pause'))
+        self.assertIn((0.375, 'gauge', 'tach.runtime.gc.gen0.pause'),
+                      self.config.notified)
+
+    def test_stop_without_start(self):
+        self.collector._gc_callback('stop', dict(generation=0, collected=1))
+        self.collector.report()
+
+        self.assertNotIn('tach.runtime.gc.gen0.collections',
+                         [label for _v, _t, label in self.config.notified])
+
+
+class TestSamples(tests.TestCase):
+    def test_rss(self):
+        value = runtime.rss()
+
+        self.assertTrue(value is None or value > 0)
+
+    def test_threads(self):
+        self.assertTrue(runtime.threads() >= threading.active_count())
+
+    def test_threads_untracked(self):
+        started = threading.Event()
+        stop = threading.Event()
+
+        def run():
+            started.set()
+            stop.wait()
+
+        thread.start_new_thread(run, ())
+        try:
+            started.wait()
+            if os.path.exists('/proc/self/status'):
+                self.assertTrue(runtime.threads() >
+                                threading.active_count())
+        finally:
+            stop.set()
+
+    def test_open_fds(self):
+        value = runtime.open_fds()
+
+        self.assertTrue(value is None or value > 0)
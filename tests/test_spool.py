@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import time
+
+from tach import notifiers
+from tach import spool
+
+import tests
+
+
+class FakeDriver(notifiers.BaseNotifier):
+    delivered = []
+    fail_after = None
+
+    def deliver(self, body):
+        if (self.fail_after is not None and
+                len(self.delivered) >= self.fail_after):
+            return False
+        self.delivered.append(body)
+        return True
+
+
+class SpoolTestCase(tests.TestCase):
+    def setUp(self):
+        super(SpoolTestCase, self).setUp()
+
+        self.path = tempfile.mkdtemp()
+        self.delivered = []
+
+    def tearDown(self):
+        super(SpoolTestCase, self).tearDown()
+
+        shutil.rmtree(self.path)
+
+    def deliver(self, body):
+        self.delivered.append(body)
+        return True
+
+
+class TestSpool(SpoolTestCase):
+    def test_replay(self):
+        log = spool.Spool(self.path)
+        log.append('one')
+        log.append(u'two')
+
+        self.assertEqual(log.replay(self.deliver), 2)
+        self.assertEqual(self.delivered, ['one', 'two'])
+        self.assertEqual(log.segments(), [])
+        self.assertEqual(len(log), 0)
+
+    def test_replay_limit(self):
+        log = spool.Spool(self.path)
+        for body in ('one', 'two', 'three'):
+            log.append(body)
+
+        self.assertEqual(log.replay(self.deliver, 2), 2)
+        self.assertEqual(log.replay(self.deliver, 2), 1)
+        self.assertEqual(self.delivered, ['one', 'two', 'three'])
+
+    def test_replay_failure(self):
+        log = spool.Spool(self.path)
+        log.append('one')
+        log.append('two')
+        results = [True, False]
+
+        self.assertEqual(log.replay(lambda body: results.pop(0)), 1)
+        self.assertEqual(log.replay(self.deliver), 1)
+        self.assertEqual(self.delivered, ['two'])
+
+    def test_rotate(self):
+        log = spool.Spool(self.path, segment_size=10)
+        for body in ('one', 'two', 'three'):
+            log.append(body)
+
+        self.assertEqual(len(log.segments()), 2)
+        self.assertEqual(log.replay(self.deliver), 3)
+        self.assertEqual(self.delivered, ['one', 'two', 'three'])
+
+    def test_max_bytes(self):
+        log = spool.Spool(self.path, segment_size=7, max_bytes=20)
+        for body in ('one', 'two', 'three', 'four'):
+            log.append(body)
+
+        self.assertEqual(log.discarded, 2)
+        log.replay(self.deliver)
+        self.assertEqual(self.delivered, ['three', 'four'])
+
+    def test_resume(self):
+        log = spool.Spool(self.path)
+        log.append('one')
+        log.flush()
+        log = spool.Spool(self.path)
+        log.append('two')
+
+        self.assertEqual(len(log), 14)
+        self.assertEqual(log.replay(self.deliver), 2)
+        self.assertEqual(self.delivered, ['one', 'two'])
+
+    def test_truncated(self):
+        log = spool.Spool(self.path)
+        log.append('one')
+        log.append('two')
+        log.flush()
+        segment = log.segments()[0]
+        with open(segment, 'r+b') as fp:
+            fp.truncate(os.path.getsize(segment) - 1)
+
+        log.replay(self.deliver)
+        self.assertEqual(self.delivered, ['one'])
+
+
+class TestReplayCommand(SpoolTestCase):
+    def setUp(self):
+        super(TestReplayCommand, self).setUp()
+
+        self.imports = {'FakeDriver': FakeDriver}
+        self.stubs.Set(FakeDriver, 'delivered', [])
+        self.stubs.Set(time, 'sleep', lambda secs: None)
+
+    def test_replay(self):
+        log = spool.Spool(self.path, meta=dict(driver='FakeDriver',
+                                               options={}))
+        log.append('one')
+        log.append('two')
+        log.flush()
+        out = StringIO.StringIO()
+
+        self.assertEqual(spool.replay(self.path, out=out), 2)
+        self.assertEqual(FakeDriver.delivered, ['one', 'two'])
+        self.assertEqual(out.getvalue(), "Replayed 2 records\n")
+
+    def test_give_up(self):
+        self.stubs.Set(FakeDriver, 'fail_after', 1)
+        log = spool.Spool(self.path, meta=dict(driver='FakeDriver',
+                                               options={}))
+        log.append('one')
+        log.append('two')
+        log.flush()
+        out = StringIO.StringIO()
+
+        self.assertEqual(spool.replay(self.path, retries=2, out=out), 1)
+        self.assertEqual(out.getvalue(), "Giving up after 1 records; "
+                         "the rest are left in %s\n" % self.path)
+        with open(os.path.join(self.path, 'meta.json')) as fp:
+            self.assertEqual(json.load(fp)['driver'], 'FakeDriver')
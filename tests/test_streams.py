@@ -0,0 +1,112 @@
+import time
+
+from tach import streams
+
+import tests
+
+
+class FakeAppIter(object):
+    def __init__(self, items):
+        self.items = items
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def close(self):
+        self.closed = True
+
+
+class TestIsStream(tests.TestCase):
+    def test_generator(self):
+        self.assertTrue(streams.is_stream(x for x in 'abc'))
+
+    def test_iterator(self):
+        self.assertFalse(streams.is_stream(iter([1, 2, 3])))
+
+    def test_app_iter(self):
+        self.assertTrue(streams.is_stream(FakeAppIter([])))
+
+    def test_containers(self):
+        self.assertFalse(streams.is_stream('abc'))
+        self.assertFalse(streams.is_stream([1, 2, 3]))
+        self.assertFalse(streams.is_stream({}))
+        self.assertFalse(streams.is_stream(None))
+
+
+class TestTimedIterable(tests.TestCase):
+    def setUp(self):
+        super(TestTimedIterable, self).setUp()
+
+        self.finished = []
+
+    def finish(self, first, items, nbytes):
+        self.finished.append((first, items, nbytes))
+
+    def error(self, exc_type):
+        self.finished.append(exc_type)
+
+    def test_exhaust(self):
+        start = time.time() - 1
+        timed = streams.TimedIterable(iter(['ab', 'cde', 3]), start,
+                                      self.finish)
+
+        self.assertEqual(list(timed), ['ab', 'cde', 3])
+        self.assertEqual(len(self.finished), 1)
+        first, items, nbytes = self.finished[0]
+        self.assertAlmostEqual(first, 1, delta=0.1)
+        self.assertEqual(items, 3)
+        self.assertEqual(nbytes, 5)
+
+    def test_lazy(self):
+        timed = streams.TimedIterable(iter(['ab', 'cde']), time.time(),
+                                      self.finish)
+
+        self.assertEqual(timed.next(), 'ab')
+        self.assertEqual(self.finished, [])
+
+    def test_close(self):
+        app_iter = FakeAppIter(['ab', 'cde'])
+        timed = streams.TimedIterable(app_iter, time.time(), self.finish)
+
+        self.assertEqual(iter(timed).next(), 'ab')
+        timed.close()
+        timed.close()
+
+        self.assertTrue(app_iter.closed)
+        self.assertEqual(len(self.finished), 1)
+        self.assertEqual(self.finished[0][1:], (1, 2))
+
+    def test_unicode(self):
+        timed = streams.TimedIterable(iter([u'caf\xe9', 'ab']), time.time(),
+                                      self.finish)
+
+        list(timed)
+        self.assertEqual(self.finished[0][1:], (2, 7))
+
+    def test_attributes(self):
+        app_iter = FakeAppIter(['ab'])
+        timed = streams.TimedIterable(app_iter, time.time(), self.finish)
+
+        self.assertEqual(timed.items, ['ab'])
+        self.assertFalse(timed.closed)
+
+    def test_empty(self):
+        timed = streams.TimedIterable(iter([]), time.time(), self.finish)
+
+        self.assertEqual(list(timed), [])
+        self.assertEqual(self.finished, [(None, 0, 0)])
+
+    def test_error(self):
+        def failing():
+            yield 'ab'
+            raise ValueError('boom')
+
+        timed = streams.TimedIterable(failing(), time.time(), self.finish,
+                                      self.error)
+
+        self.assertEqual(timed.next(), 'ab')
+        with self.assertRaises(ValueError):
+            timed.next()
+        timed.close()
+        self.assertEqual(self.finished, [ValueError])
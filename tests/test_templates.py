@@ -0,0 +1,80 @@
+from tach import templates
+
+import tests
+
+
+class FakeRequest(object):
+    def __init__(self, path, method):
+        self.environ = {'PATH_INFO': path, 'REQUEST_METHOD': method}
+
+
+class TestLabelTemplate(tests.TestCase):
+    def test_literal(self):
+        template = templates.LabelTemplate('nova.api')
+
+        self.assertEqual(template.render((), {}), 'nova.api')
+
+    def test_fields(self):
+        template = templates.LabelTemplate(
+            'nova.api.{args[1].environ[PATH_INFO]:seg(2)}.'
+            '{args[1].environ[REQUEST_METHOD]:lower}')
+        req = FakeRequest('/v2/servers/1234', 'GET')
+
+        self.assertEqual(template.render(('resource', req), {}),
+                         'nova.api.servers.get')
+
+    def test_kwargs_and_quotes(self):
+        template = templates.LabelTemplate(
+            "{kwargs['action']:upper}.{args[-1]}")
+
+        self.assertEqual(template.render((1, 2), {'action': 'boot'}),
+                         'BOOT.2')
+
+    def test_filters(self):
+        template = templates.LabelTemplate(
+            '{args[0]:seg(9):default(none)}')
+
+        self.assertEqual(template.render(('/a/b',), {}), 'none')
+
+    def test_missing_value(self):
+        template = templates.LabelTemplate('x.{args[3]}.{kwargs[foo]}')
+
+        self.assertEqual(template.render((1,), {}), None)
+        self.assertEqual(template.render((1, 2, 3, 4), {}), None)
+
+    def test_memoized(self):
+        template = templates.LabelTemplate('x.{args[0]}', cache_size=2)
+        self.assertEqual(template.render(('a',), {}), 'x.a')
+        self.assertIn(('a',), template._cache)
+
+        template.render(('b',), {})
+        template.render(('c',), {})
+        self.assertEqual(template._cache, {('c',): 'x.c'})
+
+    def test_unhashable(self):
+        template = templates.LabelTemplate('x.{args[0]}')
+        value = [1]
+
+        self.assertEqual(template.render((value,), {}), 'x.[1]')
+        self.assertEqual(template._cache, {('[1]',): 'x.[1]'})
+
+    def test_unicode(self):
+        template = templates.LabelTemplate('x.{args[0]:upper}')
+
+        self.assertEqual(template.render((u'caf\xe9',), {}), 'x.CAF\xc3\xa9')
+
+    def test_render_error(self):
+        class Broken(object):
+            def __str__(self):
+                raise RuntimeError('boom')
+
+        template = templates.LabelTemplate('x.{args[0]}')
+
+        self.assertEqual(template.render((Broken(),), {}), None)
+
+    def test_invalid(self):
+        for template in ('{self.foo}', '{args[0]bar}', '{args[0]:nope}',
+                         '{args[0]:__import__}', '{args[0]:seg(x)}',
+                         '{args[0]:seg}', '{args[0]:lower(1)}'):
+            with self.assertRaises(ValueError):
+                templates.LabelTemplate(template)
@@ -0,0 +1,109 @@
+from tach import utils
+
+import tests
+
+
+class TestGreenLibrary(tests.TestCase):
+    def test_native(self):
+        self.assertEqual(utils.green_library(), None)
+
+    def test_original(self):
+        import socket
+        self.assertEqual(utils.original('socket', 'socket'), socket.socket)
+
+    def test_original_instrumented(self):
+        import socket
+        self.stubs.Set(utils, 'instrumented', {(socket, 'socket'): 'orig'})
+
+        self.assertEqual(utils.original('socket', 'socket'), 'orig')
+        self.assertEqual(utils.uninstrumented(socket, 'socket'), 'orig')
+        self.assertEqual(utils.uninstrumented(socket, 'error'), socket.error)
+
+    def test_spawn_internal(self):
+        from tach import context
+        import threading
+        seen = []
+        done = threading.Event()
+
+        def run(arg):
+            seen.append((arg, context.internal()))
+            done.set()
+
+        utils.spawn(run, 'arg')
+        done.wait(5)
+
+        self.assertEqual(seen, [('arg', True)])
+
+
+class TestTicker(tests.TestCase):
+    def setUp(self):
+        super(TestTicker, self).setUp()
+
+        self.calls = []
+        self.ticker = utils.Ticker()
+        self.stubs.Set(self.ticker, 'start', lambda: None)
+
+    def task(self):
+        self.calls.append('task')
+
+    def test_every(self):
+        self.ticker.every(5, self.task)
+        now = self.ticker._tasks[0][1]
+
+        self.ticker.tick(now - 1)
+        self.assertEqual(self.calls, [])
+        self.ticker.tick(now)
+        self.assertEqual(self.calls, ['task'])
+        self.ticker.tick(now + 1)
+        self.assertEqual(self.calls, ['task'])
+        self.ticker.tick(now + 5)
+        self.assertEqual(self.calls, ['task', 'task'])
+
+    def test_cancel(self):
+        self.ticker.every(5, self.task)
+        now = self.ticker._tasks[0][1]
+        self.ticker.cancel(self.task)
+        self.ticker.tick(now)
+
+        self.assertEqual(self.calls, [])
+
+    def test_error(self):
+        logged = []
+        self.stubs.Set(utils.LOG, 'exception', logged.append)
+
+        def fail():
+            raise ValueError('boom')
+
+        self.ticker.every(5, fail)
+        self.ticker.every(5, self.task)
+        self.ticker.tick(self.ticker._tasks[1][1])
+
+        self.assertEqual(len(logged), 1)
+        self.assertEqual(self.calls, ['task'])
+
+
+class TestHashRing(tests.TestCase):
+    def test_consistent(self):
+        ring = utils.HashRing([('a', 'A'), ('b', 'B'), ('c', 'C')])
+        other = utils.HashRing([('a', 'A'), ('b', 'B'), ('c', 'C')])
+        keys = ['key%d' % i for i in range(100)]
+
+        self.assertEqual([ring.get(key) for key in keys],
+                         [other.get(key) for key in keys])
+        self.assertEqual(set(ring.get(key) for key in keys),
+                         set(['A', 'B', 'C']))
+
+    def test_add_node(self):
+        ring = utils.HashRing([('a', 'A'), ('b', 'B'), ('c', 'C')])
+        bigger = utils.HashRing([('a', 'A'), ('b', 'B'), ('c', 'C'),
+                                 ('d', 'D')])
+        keys = ['key%d' % i for i in range(1000)]
+
+        moved = [key for key in keys if ring.get(key) != bigger.get(key)]
+        self.assertTrue(all(bigger.get(key) == 'D' for key in moved))
+        self.assertLess(len(moved), 400)
+
+    def test_unicode(self):
+        ring = utils.HashRing([('a', 'A')])
+
+        self.assertEqual(ring.get(u'\xe9'), 'A')